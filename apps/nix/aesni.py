@@ -1,103 +1,207 @@
 import os
 import json
 import signal
-from typing import Dict, List, Optional
+from dataclasses import replace
+from typing import Dict, List, Optional, Tuple
 import subprocess
 import pandas as pd
 
 from helpers import (
     NOW,
+    PerfStat,
     create_settings,
+    env_list,
     nix_build,
     read_stats,
     write_stats,
 )
-from storage import Storage, StorageKind
+from storage import DEFAULT_CIPHER, Storage, StorageKind
+
+SYSTEMS = {
+    "native": (StorageKind.NATIVE, "simpleio-native"),
+    "sgx-lkl": (StorageKind.LKL, "simpleio-sgx-lkl"),
+    "sgx-io": (StorageKind.SPDK, "simpleio-sgx-io"),
+}
+# all of these are built into the lkl kernel (src/lkl/override/defconfig)
+CIPHERS = env_list(
+    "AESNI_CIPHERS",
+    [DEFAULT_CIPHER, "aes-xts-plain64", "serpent-xts-plain64", "twofish-xts-plain64"],
+)
+# the unencrypted baseline
+NO_LUKS = "none"
+# batch sizes in KiB
+BLOCK_SIZES = [int(bs) for bs in env_list("AESNI_BS", ["4", "64", "512", "4096"])]
+ETHREADS = [int(t) for t in env_list("AESNI_ETHREADS", ["1", "2", "4", "8"])]
+SIZE = os.environ.get("AESNI_SIZE", str(2 * 1024 * 1024 * 1024))  # 2G
+
+
+def crypto_type(cipher: str, x86_acc: bool) -> str:
+    if cipher == NO_LUKS or x86_acc:
+        return cipher
+    return f"{cipher} no_x86_acc"
 
 
 def benchmark_simpleio(
-    storage: Storage,
-    type: str,
+    system: str,
     attr: str,
     directory: str,
     stats: Dict[str, List],
+    cipher: str,
+    x86_acc: bool,
+    ethreads: int,
+    bs: int,
+    do_write: bool,
+    record: bool = True,
     extra_env: Dict[str, str] = {},
-    do_write: bool = True,
 ) -> None:
     env = dict(SGXLKL_CWD=directory)
-    env.update(extra_env)
-    env.update(SGXLKL_ENABLE_SGXIO="1")
-    env.update(SGXLKL_ETHREADS="1")
+    env.update(SGXLKL_ENABLE_SGXIO="1" if system == "sgx-io" else "0")
+    env.update(SGXLKL_X86_ACC="1" if x86_acc else "0")
+    if ethreads:
+        env.update(SGXLKL_ETHREADS=str(ethreads))
     env.update(extra_env)
     simpleio = nix_build(attr)
     stdout: Optional[int] = subprocess.PIPE
     if os.environ.get("SGXLKL_ENABLE_GDB", "0") == "1":
         stdout = None
 
-    size = str(2 * 1024 * 1024 * 1024)  # 2G
-
     env_string = []
     for k, v in env.items():
         env_string.append(f"{k}={v}")
     report = ""
     in_results = False
-    env = os.environ.copy()
-    env.update(extra_env)
+    proc_env = os.environ.copy()
+    proc_env.update(env)
+    if cipher == NO_LUKS:
+        # sgx-io would otherwise try to open the plain disk as luks volume
+        proc_env.pop("SGXLKL_SPDK_HD_KEY", None)
 
+    # direct I/O, so that reads go through dm-crypt rather than the page cache
     cmd = [
         simpleio,
         "bin/simpleio",
         f"{directory}/file",
-        size,
-        "0",
+        SIZE,
+        "1",
         "0" if do_write else "1",
-        str(128 * 4096),
+        str(bs * 1024),
     ]
     print(f"$ {' '.join(env_string)} {' '.join(cmd)}")
-    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
+    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=proc_env)
+    perf: Optional[PerfStat] = None
+    counters: Dict[str, float] = {}
     try:
         assert proc.stdout is not None
         for line in proc.stdout:
             print(f"stdout: {line}", end="")
-            if line == "<result>\n":
+            if line == "<start>\n":
+                # system-wide: host dm-crypt encrypts in kcryptd workers
+                perf = PerfStat("cycles", ["-a"])
+            elif line == "<result>\n":
+                if perf is not None:
+                    counters = perf.stop()
+                    perf = None
                 in_results = True
             elif in_results and line == "</result>\n":
                 break
             elif in_results:
                 report = line
     finally:
+        if perf is not None:
+            perf.stop()
         proc.send_signal(signal.SIGINT)
+        proc.wait()
     jsondata = json.loads(report)
-    stats["type"].append(type)
-    stats["bytes"].append(jsondata["bytes"])
-    stats["time"].append(jsondata["time"])
+    if not record:
+        return
+    nbytes = jsondata["bytes"]
+    cycles = counters.get("cycles", float("nan"))
+    stats["system"].append(system)
+    stats["type"].append(crypto_type(cipher, x86_acc))
+    stats["cipher"].append(cipher)
+    stats["x86-acc"].append(int(x86_acc))
+    stats["ethreads"].append(ethreads)
+    stats["batch-size"].append(bs)
     stats["workload"].append("write" if do_write else "read")
+    stats["bytes"].append(nbytes)
+    stats["time"].append(jsondata["time"])
+    stats["aesnithroughput"].append(nbytes / jsondata["time"] / 1024 / 1024)
+    stats["cycles"].append(cycles)
+    stats["cycles-per-byte"].append(cycles / nbytes if nbytes else float("nan"))
 
 
-def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], x86_acc: bool = False) -> None:
-    mount = storage.setup(StorageKind.SPDK)
+def benchmark_crypto(
+    storage: Storage,
+    system: str,
+    cipher: str,
+    x86_acc: bool,
+    stats: Dict[str, List],
+    runs: List[Tuple[int, int, bool, bool]],
+) -> None:
+    kind, attr = SYSTEMS[system]
+    if cipher == NO_LUKS:
+        storage = Storage(replace(storage.settings, spdk_hd_key=None))
+        mount = storage.setup(kind)
+    else:
+        mount = storage.setup(kind, cipher=cipher)
 
     with mount as mnt:
-        extra_env = mount.extra_env()
-        extra_env["SGXLKL_X86_ACC"] = "1" if x86_acc else "0"
-        benchmark_simpleio(
-            storage, "x86_acc" if x86_acc else "no_x86_acc", "simpleio-sgx-io", mnt, stats, extra_env=extra_env
-        )
+        for ethreads, bs, do_write, record in runs:
+            benchmark_simpleio(
+                system,
+                attr,
+                mnt,
+                stats,
+                cipher,
+                x86_acc,
+                ethreads,
+                bs,
+                do_write,
+                record=record,
+                extra_env=mount.extra_env(),
+            )
+            write_stats("aesni.json", stats)
+
 
-       
 def main() -> None:
     stats = read_stats("aesni.json")
     storage = Storage(create_settings())
+    if not storage.settings.spdk_hd_key:
+        print("SGXLKL_SPDK_HD_KEY not set, only running without luks")
+    ciphers = CIPHERS if storage.settings.spdk_hd_key else []
 
-    if "x86_acc" not in stats["type"]:
-        benchmark_sgx_io(storage, stats, x86_acc=True)
-    else:
-        print("skip x86_acc")
-    if "no_x86_acc" not in stats["type"]:
-        benchmark_sgx_io(storage, stats, x86_acc=False)
-    else:
-        print("skip no_x86_acc")
-    write_stats("aesni.json", stats)
+    done = set(
+        zip(stats["system"], stats["type"], stats["ethreads"], stats["batch-size"], stats["workload"])
+    )
+    for system, (kind, _) in SYSTEMS.items():
+        # the host kernel always uses aes-ni and has no enclave threads
+        native = kind == StorageKind.NATIVE
+        ethreads = [0] if native else ETHREADS
+        configs = [(NO_LUKS, True)]
+        for cipher in ciphers:
+            configs += [(cipher, True)] if native else [(cipher, True), (cipher, False)]
+
+        for cipher, x86_acc in configs:
+            type = crypto_type(cipher, x86_acc)
+
+            def pending(threads: int, bs: int, do_write: bool) -> bool:
+                workload = "write" if do_write else "read"
+                return (system, type, threads, bs, workload) not in done
+
+            runs = []
+            for threads in ethreads:
+                for bs in BLOCK_SIZES:
+                    write, read = pending(threads, bs, True), pending(threads, bs, False)
+                    # the read run uses the file left behind by the write run,
+                    # which is then repeated without being recorded again
+                    if write or read:
+                        runs.append((threads, bs, True, write))
+                    if read:
+                        runs.append((threads, bs, False, True))
+            if not runs:
+                print(f"skip {system} {type}")
+                continue
+            benchmark_crypto(storage, system, cipher, x86_acc, stats, runs)
 
     csv = f"aesni-{NOW}.tsv"
     print(csv)
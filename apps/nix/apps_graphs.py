@@ -8,9 +8,11 @@ from plot import apply_hatch, catplot, plt
 from graph_utils import (
     apply_aliases,
     change_width,
+    column_alias,
     apply_to_graphs,
     systems_order,
     PAPER_MODE,
+    SQLITE_DEFAULT_CONFIG,
 )
 
 
@@ -22,41 +24,69 @@ def df_col_select(res_col: List[str], df_columns: List[str], keyword: str) -> No
             res_col.append(col)
 
 
-def apply_sqlite_rows(x: int) -> float:
-    return 10000 / x
+def sqlite_default_config(df: pd.DataFrame) -> pd.DataFrame:
+    if "journal" not in df.columns:  # single configuration of older runs
+        return df
+    return df[
+        (df.journal == SQLITE_DEFAULT_CONFIG["journal"])
+        & (df.synchronous == SQLITE_DEFAULT_CONFIG["synchronous"])
+        & (df["cache-size"] == SQLITE_DEFAULT_CONFIG["cache-size"])
+        & (df["page-size"] == SQLITE_DEFAULT_CONFIG["page-size"])
+    ]
 
 
 def sqlite_graph(df: pd.DataFrame) -> Any:
-    plot_df = df
-    df = df[df.columns[2]]
-    df = df.map(apply_sqlite_rows)
-    plot_df.update(df)
-
-    plot_df["sqlite-op-type"] = plot_df["sqlite-op-type"].map(
-        {
-            "5000 INSERTs into table with no index": "Insert",
-            "5000 UPDATES of individual rows": "Update",
-            "5000 DELETEs of individual rows": "Delete",
-        }
+    plot_df = sqlite_default_config(df)
+    plot_df = plot_df.assign(**{"sqlite-time [s]": plot_df["sqlite-time [s]"].astype(float)})
+    if "sqlite-test" in plot_df.columns:
+        plot_df = plot_df.assign(
+            **{"sqlite-op-type": plot_df["sqlite-test"].astype(str) + " " + plot_df["sqlite-op-type"]}
+        )
+    plot_df = apply_aliases(plot_df)
+
+    g = catplot(
+        data=plot_df,
+        x=column_alias("sqlite-op-type"),
+        y=column_alias("sqlite-time [s]"),
+        kind="bar",
+        height=2.5,
+        aspect=4,
+        hue="system",
+        hue_order=systems_order(plot_df),
+        legend=False,
     )
 
-    groups = len(set((list(plot_df["system"].values))))
-    plot_df = apply_aliases(plot_df)
+    apply_to_graphs(g.ax, True, 4, 0.2)
+    g.ax.set_xticklabels(g.ax.get_xticklabels(), size=5, rotation=90)
+    g.ax.legend(frameon=False)
+
+    return g
+
+
+def sqlite_journal_graph(df: pd.DataFrame) -> Any:
+    """Total speedtest1 time per journal mode and synchronous setting"""
+    df = df[
+        (df["cache-size"] == SQLITE_DEFAULT_CONFIG["cache-size"])
+        & (df["page-size"] == SQLITE_DEFAULT_CONFIG["page-size"])
+    ]
+    # one total per run
+    df = df.drop_duplicates(["system", "journal", "synchronous"])
+    df = df.assign(config=df.journal + "\n" + df.synchronous.map({"full": "sync", "off": "nosync"}))
+    plot_df = apply_aliases(df)
 
     g = catplot(
         data=plot_df,
-        x=plot_df.columns[0],
-        y=plot_df.columns[2],
+        x="config",
+        y=column_alias("sqlite-total [s]"),
         kind="bar",
         height=2.5,
-        # aspect=0.8,
-        order=systems_order(plot_df),
-        hue="Operation",
+        aspect=1.2,
+        hue="system",
+        hue_order=systems_order(plot_df),
         legend=False,
-        palette=["darkgrey", "gray", "black"],
     )
 
-    apply_to_graphs(g.ax, True, 3, 0.285)
+    apply_to_graphs(g.ax, True, 2, 0.2)
     g.ax.legend(frameon=False)
 
     return g
@@ -181,8 +211,10 @@ def main() -> None:
         df = pd.read_csv(arg, delimiter="\t")
         base = os.path.basename(arg)
 
-        if base.startswith("sqlite"):
+        if base.startswith("sqlite-speedtest"):
             graphs.append(("SQLITE", sqlite_graph(df)))
+            if "journal" in df.columns:
+                graphs.append(("SQLITE-JOURNAL", sqlite_journal_graph(df)))
         if base.startswith("nginx"):
             graphs.append(("NGINX-LAT", nginx_graph(df, "lat")))
             graphs.append(("NGINX-THRU", nginx_graph(df, "thru")))
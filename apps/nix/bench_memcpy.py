@@ -1,7 +1,8 @@
 import json
+import math
+import os
 import subprocess
-from collections import defaultdict
-from typing import Dict, List, DefaultDict, Optional, Any
+from typing import Dict, List
 import pandas as pd
 
 from helpers import (
@@ -10,65 +11,119 @@ from helpers import (
     read_stats,
     write_stats,
 )
+from storage import set_hugepages
 
 KINDS = {
     "avx": "0",
     "old": "1",
     "libc": "2",
 }
+REPETITIONS = int(os.environ.get("MEMCPY_REPETITIONS", "3"))
+MAX_SIZE = 64 * 1024 * 1024
+HUGEPAGE_SIZE = 2 * 1024 * 1024
 
 
-def bench_memcpy(kind: str, stats: Dict[str, List]) -> None:
-    memcpy = nix_build("memcpy-test-sgx-io")
-    stdout: Optional[int] = subprocess.PIPE
+def memcpy_cmd(placement: str) -> List[str]:
+    if placement == "native":
+        return [os.path.join(nix_build("memcpy-test"), "bin/memcpy-test")]
+    return [nix_build("memcpy-test-sgx-io"), "bin/memcpy-test"]
 
-    proc = subprocess.Popen([memcpy, "bin/memcpy-test", KINDS[kind]], stdout=stdout, text=True)
+
+def bench_memcpy(placement: str, kind: str, hugepages: bool, stats: Dict[str, List]) -> None:
+    cmd = memcpy_cmd(placement)
+    cmd += [KINDS[kind], "1" if hugepages else "0", str(REPETITIONS), str(MAX_SIZE)]
+    env = os.environ.copy()
+    # source and destination buffer need to fit into the enclave heap
+    env.update(SGXLKL_HEAP=str(1024 * 1024 * 1024))
+    print(f"$ {' '.join(cmd)}")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, env=env)
     try:
-        if proc.stdout is None:
-            proc.wait()
-        else:
-            for line in proc.stdout:
-                print(line)
-                try:
-                    data = json.loads(line)
-                    for i in data:
-                        stats["memcpy-kind"].append(f"memcpy-test-{kind}")
-                        stats["memcpy-size"].append(i)
-                        stats["memcpy-time"].append(data[i])
-                except Exception as e:
-                    continue
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            print(line, end="")
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            stats["memcpy-kind"].append(f"memcpy-test-{kind}")
+            stats["placement"].append(placement)
+            stats["hugepages"].append(int(hugepages))
+            # mmap(MAP_HUGETLB) falls back to regular pages if unsupported
+            stats["hugepages-used"].append(data["hugepages"])
+            stats["cache"].append(data["cache"])
+            stats["memcpy-size"].append(data["size"])
+            stats["src-offset"].append(data["src_offset"])
+            stats["dst-offset"].append(data["dst_offset"])
+            stats["alignment"].append(f"{data['src_offset']}/{data['dst_offset']}")
+            stats["repetition"].append(data["repetition"])
+            stats["memcpy-time"].append(data["ns"])
+            # bytes per ns is GB/s
+            stats["memcpy-throughput"].append(data["size"] / data["ns"] if data["ns"] else None)
     finally:
-        pass
+        proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)} failed with {proc.returncode}")
 
 
-def bench_avx_memcpy(stats: Dict[str, List]) -> None:
-    bench_memcpy("avx", stats)
+def size_class(size: int) -> str:
+    if size <= 256:
+        return "small (<=256B)"
+    elif size <= 4096:
+        return "medium (<=4KiB)"
+    elif size <= 256 * 1024:
+        return "large (<=256KiB)"
+    return "huge (>256KiB)"
 
 
-def bench_old_memcpy(stats: Dict[str, List]) -> None:
-    bench_memcpy("old", stats)
+def geometric_mean(values: pd.Series) -> float:
+    """Every size and alignment of a size class counts the same"""
+    return math.exp(sum(math.log(v) for v in values) / len(values))
 
 
-def bench_libc_memcpy(stats: Dict[str, List]) -> None:
-    bench_memcpy("libc", stats)
+def best_kinds(df: pd.DataFrame) -> pd.DataFrame:
+    """Fastest memcpy variant per size class, from median throughput over repetitions"""
+    df = df.assign(**{"size-class": df["memcpy-size"].map(size_class)})
+    keys = ["placement", "hugepages", "cache", "size-class"]
+    median = df.groupby(keys + ["memcpy-kind", "memcpy-size", "alignment"], as_index=False)[
+        "memcpy-throughput"
+    ].median()
+    median = median[median["memcpy-throughput"] > 0]
+    per_kind = median.groupby(keys + ["memcpy-kind"], as_index=False)["memcpy-throughput"].agg(
+        geometric_mean
+    )
+    best = per_kind.loc[per_kind.groupby(keys)["memcpy-throughput"].idxmax()]
+    return best.rename(columns={"memcpy-kind": "best-kind"})
 
 
 def main() -> None:
-    stats: DefaultDict[str, List] = defaultdict(list)
-
-    benchmarks = {
-        "avx_memcpy": bench_avx_memcpy,
-        "new_memcpy": bench_old_memcpy,
-        "libc_memcpy": bench_libc_memcpy
-    }
-
-    for name, benchmark in benchmarks.items():
-        benchmark(stats)
+    stats = read_stats("memcpy-bench.json")
+    done = set(zip(stats["placement"], stats["memcpy-kind"], stats["hugepages"]))
+
+    for placement in ["native", "enclave"]:
+        for hugepages in [False, True]:
+            if hugepages and placement == "native":
+                # two buffers of MAX_SIZE plus some slack for the alignment offsets
+                set_hugepages(2 * (MAX_SIZE // HUGEPAGE_SIZE + 1))
+            for kind in KINDS:
+                if (placement, f"memcpy-test-{kind}", int(hugepages)) in done:
+                    print(f"skip {placement} {kind} hugepages={hugepages}")
+                    continue
+                bench_memcpy(placement, kind, hugepages, stats)
+                write_stats("memcpy-bench.json", stats)
+            if hugepages and placement == "native":
+                set_hugepages(0)
 
     csv = f"memcpy-bench-{NOW}.tsv"
+    print(csv)
     memcpy_df = pd.DataFrame(stats)
     memcpy_df.to_csv(csv, index=False, sep="\t")
     memcpy_df.to_csv("memcpy-bench-latest.tsv", index=False, sep="\t")
 
-if __name__=="__main__":
+    best = best_kinds(memcpy_df)
+    best.to_csv(f"memcpy-choice-{NOW}.tsv", index=False, sep="\t")
+    best.to_csv("memcpy-choice-latest.tsv", index=False, sep="\t")
+    print(best.to_string(index=False))
+
+
+if __name__ == "__main__":
     main()
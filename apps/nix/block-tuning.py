@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import itertools
+import json
+import os
+import subprocess
+import sys
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+import pandas as pd
+from helpers import NOW, ROOT, create_settings, nix_build, read_stats, run, write_stats
+from storage import Mount, Storage, StorageKind
+
+from fio import benchmark_fio
+
+# applied in this order: changing the scheduler resets nr_requests;
+# schedulers the kernel does not provide (lkl has no mq-deadline) are skipped
+CANDIDATES = dict(
+    scheduler=["none", "mq-deadline"],
+    nr_requests=["64", "256"],
+    read_ahead_kb=["0", "128", "512"],
+    max_sectors_kb=["128", "512"],
+)
+TUNABLES = list(CANDIDATES.keys())
+# the fio image is the root disk (vda), the benchmark disk is attached second
+LKL_DEVICE = "vdb"
+STATS = "block-tuning.json"
+
+Config = Dict[str, str]
+# introspect-blocks.py --json output for one device, also lists available_schedulers
+Queue = Dict[str, Any]
+
+
+def config_name(config: Config) -> str:
+    if not config:
+        return "default"
+    return ",".join(f"{k}={v}" for k, v in config.items())
+
+
+def parse_snapshot(output: str) -> Dict[str, Queue]:
+    """Extract the JSON printed by introspect-blocks.py --json"""
+    start = output.index("{\n")
+    end = output.index("\n}\n", start) + 2
+    return json.loads(output[start:end])
+
+
+def native_queue(dev: str) -> Queue:
+    script = ROOT.joinpath("python-scripts", "introspect-blocks.py")
+    proc = run([sys.executable, str(script), "--json"])
+    return parse_snapshot(proc.stdout)[dev]
+
+
+def lkl_queue(mount: Mount, config: Config = {}) -> Queue:
+    """Queue tunables as seen by the LKL kernel for the virtio disk, after applying `config`"""
+    python_scripts = nix_build("python-scripts")
+    env = os.environ.copy()
+    env.pop("SGXLKL_TAP", None)
+    env.update(mount.extra_env())
+    env.update(lkl_sysctl(config))
+    proc = subprocess.run(
+        [python_scripts, "bin/python3", "/introspect-blocks.py", "--json"],
+        stdout=subprocess.PIPE,
+        text=True,
+        env=env,
+        check=True,
+    )
+    return parse_snapshot(proc.stdout)[LKL_DEVICE]
+
+
+def write_tunable(dev: str, name: str, value: str) -> None:
+    run(["sudo", "sh", "-c", "echo $0 > $1", value, f"/sys/block/{dev}/queue/{name}"])
+
+
+@contextmanager
+def tuned_queue(dev: str, config: Config) -> Iterator[None]:
+    original = native_queue(dev)
+    try:
+        for name, value in config.items():
+            write_tunable(dev, name, value)
+        yield
+    finally:
+        for name in TUNABLES:
+            if name in config:
+                write_tunable(dev, name, original[name])
+
+
+def lkl_sysctl(config: Config) -> Dict[str, str]:
+    if not config:
+        return {}
+    sysctl = ";".join(f"/sys/block/{LKL_DEVICE}/queue/{k}={v}" for k, v in config.items())
+    return dict(SGXLKL_SYSCTL=sysctl)
+
+
+def candidate_configs(defaults: Queue) -> List[Config]:
+    """The untouched queue followed by all combinations the device accepts"""
+    candidates = dict(CANDIDATES)
+    schedulers = defaults.get("available_schedulers")
+    if schedulers is not None:
+        candidates["scheduler"] = [v for v in candidates["scheduler"] if v in schedulers]
+    max_hw = defaults.get("max_hw_sectors_kb")
+    if max_hw is not None:
+        candidates["max_sectors_kb"] = [
+            v for v in candidates["max_sectors_kb"] if int(v) <= int(max_hw)
+        ]
+    configs: List[Config] = [{}]
+    for values in itertools.product(*candidates.values()):
+        configs.append(dict(zip(candidates.keys(), values)))
+    return configs
+
+
+def run_config(
+    system: str, mnt: str, mount: Mount, config: Config, stats: Dict[str, List]
+) -> None:
+    rows = len(stats["system"])
+    if system == "native":
+        with tuned_queue(mount.raw_dev.split("/")[-1], config):
+            benchmark_fio(system, "fio-native", mnt, stats, extra_env=mount.extra_env())
+    else:
+        # failed sysfs writes in the enclave are only logged
+        applied = lkl_queue(mount, config)
+        for name, value in config.items():
+            if applied.get(name) != value:
+                raise RuntimeError(f"lkl did not apply {name}={value}, got {applied.get(name)}")
+        extra_env = mount.extra_env()
+        extra_env.update(lkl_sysctl(config))
+        benchmark_fio(system, "fio-sgx-lkl", mnt, stats, extra_env=extra_env)
+    rows = len(stats["system"]) - rows
+    stats["config"].extend([config_name(config)] * rows)
+    for name in TUNABLES:
+        stats[name].extend([config.get(name, "default")] * rows)
+
+
+def benchmark_system(
+    storage: Storage, system: str, kind: StorageKind, stats: Dict[str, List]
+) -> None:
+    done = set(zip(stats["system"], stats["config"]))
+    mount = storage.setup(kind)
+    with mount as mnt:
+        if kind == StorageKind.NATIVE:
+            defaults = native_queue(mount.raw_dev.split("/")[-1])
+        else:
+            defaults = lkl_queue(mount)
+        print(f"[{system}] queue defaults: {json.dumps(defaults)}")
+        for config in candidate_configs(defaults):
+            if (system, config_name(config)) in done:
+                print(f"skip {system} {config_name(config)}")
+                continue
+            run_config(system, mnt, mount, config, stats)
+            write_stats(STATS, stats)
+
+
+def best_configs(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.assign(bw=df["read-bw"] + df["write-bw"], iops=df["read-iops"] + df["write-iops"])
+    per_config = df.groupby(["system", "config"] + TUNABLES, as_index=False)[["bw", "iops"]].sum()
+    defaults = per_config[per_config.config == "default"].set_index("system")["bw"]
+    per_config["speedup"] = per_config.bw / per_config.system.map(defaults)
+    best = per_config.loc[per_config.groupby("system")["bw"].idxmax()]
+    return best.reset_index(drop=True)
+
+
+def main() -> None:
+    stats = read_stats(STATS)
+    storage = Storage(create_settings())
+
+    benchmarks = {
+        "native": StorageKind.NATIVE,
+        "sgx-lkl": StorageKind.LKL,
+    }
+    for system, kind in benchmarks.items():
+        benchmark_system(storage, system, kind, stats)
+
+    df = pd.DataFrame(stats)
+    csv = f"block-tuning-{NOW}.tsv"
+    print(csv)
+    df.to_csv(csv, index=False, sep="\t")
+    df.to_csv("block-tuning-latest.tsv", index=False, sep="\t")
+
+    best = best_configs(df)
+    best.to_csv("block-tuning-best-latest.tsv", index=False, sep="\t")
+    print(best.to_string(index=False))
+    for row in best.itertuples():
+        config = {name: getattr(row, name) for name in TUNABLES if getattr(row, name) != "default"}
+        if row.system == "sgx-lkl":
+            print(f"sgx-lkl: {lkl_sysctl(config)}")
+        else:
+            print(f"native: {config_name(config)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,204 @@
 #!/usr/bin/env python3
-import json
+import argparse
 import os
-import getpass
-import subprocess
-import tempfile
-import time
-from collections import defaultdict
-from typing import Any, DefaultDict, Dict, List, Union
 import re
-import signal
+import subprocess
+from dataclasses import dataclass, replace
+from typing import Dict, List
 import pandas as pd
 
 from helpers import (
     NOW,
-    ROOT,
-    Chdir,
-    Settings,
     create_settings,
-    nix_build,
-    run,
-    spawn,
     flamegraph_env,
+    nix_build,
     read_stats,
-    write_stats
+    run,
+    scone_env,
+    write_stats,
 )
 from storage import Storage, StorageKind
 
+# 4 KiB - 4 MiB
+BLOCK_SIZES = [4, 64, 1024, 4096]
+SIZE = int(os.environ.get("DD_SIZE", str(4 * 1024 * 1024 * 1024)))  # 4G
+
+
+@dataclass(frozen=True)
+class Run:
+    # block size in kilobytes
+    bs: int
+    direct: bool = True
+    write: bool = False
+    repetition: int = 0
+    # write runs that only lay out the file for a pending read are not recorded again
+    record: bool = True
+
+    @property
+    def workload(self) -> str:
+        return "write" if self.write else "read"
+
+    def args(self, path: str) -> List[str]:
+        count = f"count={SIZE // (self.bs * 1024)}"
+        if self.write:
+            args = ["if=/dev/zero", f"of={path}", "conv=fsync"]
+            flag = "oflag=direct"
+        else:
+            args = [f"if={path}", "of=/dev/null"]
+            flag = "iflag=direct"
+        args += [f"bs={self.bs * 1024}", count]
+        if self.direct:
+            args.append(flag)
+        return args
+
+
+def drop_caches() -> None:
+    # native and scone read through the host page cache
+    run(["sudo", "sh", "-c", "sync; echo 3 > /proc/sys/vm/drop_caches"])
+
+
 def benchmark_dd(
-    storage: Storage,
     system: str,
     attr: str,
-    device: str,
+    directory: str,
     stats: Dict[str, List],
+    dd_run: Run,
     extra_env: Dict[str, str] = {},
 ) -> None:
-    env = os.environ.copy()
+    env = dict(SGXLKL_CWD=directory)
+    env.update(flamegraph_env(f"dd-{system}-{NOW}"))
+    env.update(SGXLKL_ENABLE_SGXIO="1" if system == "sgx-io" else "0")
+    env.update(SGXLKL_ETHREADS="1" if system == "sgx-io" else "8")
     env.update(extra_env)
+    # dd prints its summary with the locale's decimal separator
+    env.update(LC_ALL="C")
     dd = nix_build(attr)
 
-    print(f"###### {system} >> ######")
-    proc = subprocess.Popen([dd], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    env_string = []
+    for k, v in env.items():
+        env_string.append(f"{k}={v}")
+    proc_env = os.environ.copy()
+    proc_env.update(env)
 
-    try:
-        if proc.stdout is None:
-            proc.wait()
-        else:
-            stats["system"].append(system)
-            for line in proc.stdout:
-                data = line.split(',')
-                if len(data) == 2:
-                    stats["latency"].append(data[0])
-                    stats["Throughput"].append(data[1])
-    finally:
-        pass
-
-    print(f"###### {system} << ######")
-
-def benchmark_native_dd(storage: Storage, stats: Dict[str, List]) -> None:
-    mnt = storage.setup(StorageKind.NATIVE)
-    subprocess.run(["sudo", "chown", getpass.getuser(), mnt.dev])
-    benchmark_dd(storage, "native", "dd-native", mnt.dev, stats)
-
-def benchmark_sgx_lkl_dd(storage: Storage, stats: Dict[str, List]) -> None:
-    storage.setup(StorageKind.LKL)
-    benchmark_dd(
-      storage,
-      "sgx-lkl",
-      "dd-sgx-lkl",
-      "/dev/vdb",
-      stats,
-      extra_env=dict(SGXLKL_HDS="/dev/nvme0n1:/mnt/nvme"),
+    drop_caches()
+    cmd = [dd, "bin/dd"] + dd_run.args(f"{directory}/dd-file")
+    print(f"$ {' '.join(env_string)} {' '.join(cmd)}")
+    proc = subprocess.run(
+        cmd, env=proc_env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
     )
+    print(proc.stdout)
+    # 4294967296 bytes (4.3 GB, 4.0 GiB) copied, 6.31 s, 681 MB/s
+    match = re.search(r"^(\d+) bytes .*copied, ([\d.]+) s", proc.stdout, re.MULTILINE)
+    if proc.returncode != 0 or match is None:
+        raise RuntimeError(f"dd failed for {system} with {proc.returncode}")
+    nbytes = int(match.group(1))
+    seconds = float(match.group(2))
+    if not dd_run.record:
+        return
+    stats["system"].append(system)
+    stats["workload"].append(dd_run.workload)
+    stats["batch-size"].append(dd_run.bs)
+    stats["direct"].append(int(dd_run.direct))
+    stats["repetition"].append(dd_run.repetition)
+    stats["bytes"].append(nbytes)
+    stats["time"].append(seconds)
+    stats["dd-throughput"].append(nbytes / seconds / 1024 / 1024)
+
+
+def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], runs: List[Run]) -> None:
+    mount = storage.setup(StorageKind.SPDK)
+
+    with mount as mnt:
+        for dd_run in runs:
+            benchmark_dd("sgx-io", "dd-sgx-io", mnt, stats, dd_run, extra_env=mount.extra_env())
+            write_stats("dd.json", stats)
+
+
+def benchmark_sgx_lkl(storage: Storage, stats: Dict[str, List], runs: List[Run]) -> None:
+    mount = storage.setup(StorageKind.LKL)
+
+    with mount as mnt:
+        for dd_run in runs:
+            benchmark_dd("sgx-lkl", "dd-sgx-lkl", mnt, stats, dd_run, extra_env=mount.extra_env())
+            write_stats("dd.json", stats)
+
+
+def benchmark_scone(storage: Storage, stats: Dict[str, List], runs: List[Run]) -> None:
+    mount = storage.setup(StorageKind.SCONE)
+
+    with mount as mnt:
+        extra_env = scone_env(mnt)
+        extra_env.update(mount.extra_env())
+        for dd_run in runs:
+            benchmark_dd("scone", "dd-scone", mnt, stats, dd_run, extra_env=extra_env)
+            write_stats("dd.json", stats)
+
+
+def benchmark_native(storage: Storage, stats: Dict[str, List], runs: List[Run]) -> None:
+    mount = storage.setup(StorageKind.NATIVE)
+
+    with mount as mnt:
+        for dd_run in runs:
+            benchmark_dd("native", "dd-native", mnt, stats, dd_run, extra_env=mount.extra_env())
+            write_stats("dd.json", stats)
+
+
+BENCHMARKS = {
+    "native": benchmark_native,
+    "sgx-lkl": benchmark_sgx_lkl,
+    "scone": benchmark_scone,
+    "sgx-io": benchmark_sgx_io,
+}
+
+
+def all_runs(repetitions: int) -> List[Run]:
+    runs = []
+    for bs in BLOCK_SIZES:
+        for direct in [True, False]:
+            for repetition in range(repetitions):
+                # the read run uses the file left behind by the write run
+                for write in [True, False]:
+                    runs.append(Run(bs=bs, direct=direct, write=write, repetition=repetition))
+    return runs
 
-def benchmark_sgx_io_dd(storage: Storage, stats: Dict[str, List]) -> None:
-    storage.setup(StorageKind.SPDK)
-    benchmark_dd(storage, "sgx-io", "dd-sgx-io", "/dev/spdk0", stats)
 
 def main() -> None:
-    stats = read_stats("dd.json")
-    settings = create_settings()
-    storage = Storage(settings)
+    parser = argparse.ArgumentParser(description="Sequential read/write throughput with dd")
+    parser.add_argument("systems", nargs="*", help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--repetitions", type=int, default=3)
+    args = parser.parse_args()
+    unknown = set(args.systems) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown systems: {', '.join(unknown)}")
 
-    # provide nix expressions for native and sgx_lkl case
-    benchmarks = {
-        #"native": benchmark_native_dd,
-        #"sgx-lkl": benchmark_sgx_lkl_dd,
-        "sgx-io": benchmark_sgx_io_dd,
-    }
+    runs = all_runs(args.repetitions)
+    stats = read_stats("dd.json")
+    storage = Storage(create_settings())
+    done = set(
+        zip(stats["system"], stats["batch-size"], stats["direct"], stats["workload"], stats["repetition"])
+    )
 
-    system = set(stats["system"])
+    for name in args.systems or BENCHMARKS:
+        def pending(r: Run) -> bool:
+            return (name, r.bs, int(r.direct), r.workload, r.repetition) not in done
 
-    for name, benchmark in benchmarks.items():
-        if name in system:
+        # the disk is reformatted per system, so reads need their write run again
+        todo = [
+            r if pending(r) else replace(r, record=False)
+            for r in runs
+            if pending(r) or (r.write and pending(replace(r, write=False)))
+        ]
+        if not todo:
             print(f"skip {name} benchmark")
             continue
-        benchmark(storage, stats)
-        write_stats("dd.json", stats)
+        BENCHMARKS[name](storage, stats, todo)
 
     csv = f"dd-test-{NOW}.tsv"
+    print(csv)
     df = pd.DataFrame(stats)
     df.to_csv(csv, index=False, sep="\t")
     df.to_csv("dd-test-latest.tsv", index=False, sep="\t")
 
-if __name__=="__main__":
+
+if __name__ == "__main__":
     main()
@@ -194,6 +194,9 @@ let
 
 
   simpleio-musl = pkgsMusl.callPackage ./simpleio {};
+  coreutils-scone = pkgsMusl.coreutils.override {
+    stdenv = sconeStdenv;
+  };
   simpleio-scone = simpleio-musl.override {
     stdenv = sconeStdenv;
   };
@@ -399,8 +402,26 @@ in {
   };
 
   dd-sgx-io = runImage {
-    pkg = busybox;
-    command = [ "bin/dd" "if=/dev/spdk0" "of=/dev/null" ];
+    pkg = pkgsMusl.coreutils;
+    command = [ "bin/dd" ];
+  };
+
+  dd-sgx-lkl = runImage {
+    pkg = pkgsMusl.coreutils;
+    sgx-lkl-run = "${sgx-lkl}/bin/sgx-lkl-run";
+    command = [ "bin/dd" ];
+  };
+
+  dd-scone = runImage {
+    pkg = coreutils-scone;
+    native = true;
+    command = [ "bin/dd" ];
+  };
+
+  dd-native = runImage {
+    pkg = pkgsMusl.coreutils;
+    native = true;
+    command = [ "bin/dd" ];
   };
 
   ls = runImage {
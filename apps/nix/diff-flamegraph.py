@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import subprocess
+from collections import Counter, defaultdict
+from typing import DefaultDict, Dict, List, Tuple
+
+import pandas as pd
+
+
+def read_folded(path: str) -> Counter:
+    stacks: Counter = Counter()
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            stack, _, count = line.rpartition(" ")
+            stacks[stack] += int(count)
+    return stacks
+
+
+def normalize(stacks: Counter, total: int) -> Dict[str, float]:
+    """Scale sample counts so that all stacks sum up to `total`"""
+    own_total = sum(stacks.values())
+    if own_total == 0:
+        return {}
+    factor = total / own_total
+    return {stack: count * factor for stack, count in stacks.items()}
+
+
+def write_diff_folded(
+    path: str, before: Dict[str, float], after: Dict[str, float]
+) -> None:
+    # difffolded.pl format understood by flamegraph.pl: "stack before after"
+    with open(path, "w") as f:
+        for stack in sorted(set(before) | set(after)):
+            f.write(
+                f"{stack} {round(before.get(stack, 0))} {round(after.get(stack, 0))}\n"
+            )
+
+
+def function_shares(stacks: Counter) -> Tuple[DefaultDict[str, float], DefaultDict[str, float]]:
+    """Fraction of samples per function, self (leaf) and inclusive"""
+    total = sum(stacks.values())
+    self_share: DefaultDict[str, float] = defaultdict(float)
+    total_share: DefaultDict[str, float] = defaultdict(float)
+    for stack, count in stacks.items():
+        # the first frame is the process name
+        frames = stack.split(";")[1:]
+        if not frames:
+            continue
+        self_share[frames[-1]] += count / total
+        for frame in set(frames):
+            total_share[frame] += count / total
+    return self_share, total_share
+
+
+def ranked_changes(before: Counter, after: Counter, name_a: str, name_b: str) -> pd.DataFrame:
+    self_a, total_a = function_shares(before)
+    self_b, total_b = function_shares(after)
+    stats: Dict[str, List] = dict(
+        function=[],
+        **{
+            f"self-{name_a}": [],
+            f"self-{name_b}": [],
+            "self-delta": [],
+            f"total-{name_a}": [],
+            f"total-{name_b}": [],
+            "total-delta": [],
+        },
+    )
+    for function in set(total_a) | set(total_b):
+        stats["function"].append(function)
+        stats[f"self-{name_a}"].append(self_a[function] * 100)
+        stats[f"self-{name_b}"].append(self_b[function] * 100)
+        stats["self-delta"].append((self_b[function] - self_a[function]) * 100)
+        stats[f"total-{name_a}"].append(total_a[function] * 100)
+        stats[f"total-{name_b}"].append(total_b[function] * 100)
+        stats["total-delta"].append((total_b[function] - total_a[function]) * 100)
+    df = pd.DataFrame(stats)
+    order = df["self-delta"].abs().sort_values(ascending=False).index
+    return df.loc[order].reset_index(drop=True)
+
+
+def flamegraph(folded: str, svg: str, extra_args: List[str] = []) -> None:
+    with open(folded) as stdin, open(svg, "w") as stdout:
+        subprocess.run(["flamegraph.pl"] + extra_args, stdin=stdin, stdout=stdout, check=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare collapsed stacks (*.folded) of two systems or commits"
+    )
+    parser.add_argument("before", help="folded stacks of the baseline, e.g. fio-sgx-lkl.folded")
+    parser.add_argument("after", help="folded stacks to compare, e.g. fio-sgx-io.folded")
+    parser.add_argument("--output", default=None, help="prefix of generated files")
+    parser.add_argument("--top", type=int, default=30, help="number of functions to print")
+    args = parser.parse_args()
+
+    name_a = os.path.basename(args.before).rsplit(".", 1)[0]
+    name_b = os.path.basename(args.after).rsplit(".", 1)[0]
+    prefix = args.output or f"diff-{name_a}-{name_b}"
+
+    before = read_folded(args.before)
+    after = read_folded(args.after)
+    total = max(sum(before.values()), sum(after.values()))
+    norm_before = normalize(before, total)
+    norm_after = normalize(after, total)
+
+    # red: grew in `after`, blue: shrank; drawn with the shape of `after`
+    diff_folded = f"{prefix}.folded"
+    write_diff_folded(diff_folded, norm_before, norm_after)
+    flamegraph(diff_folded, f"{prefix}.svg", ["--title", f"{name_a} -> {name_b}"])
+
+    # shape of `before`, highlighting what disappeared in `after`
+    reverse_folded = f"{prefix}-reverse.folded"
+    write_diff_folded(reverse_folded, norm_after, norm_before)
+    flamegraph(
+        reverse_folded,
+        f"{prefix}-reverse.svg",
+        ["--negate", "--title", f"{name_b} -> {name_a} (negated)"],
+    )
+
+    df = ranked_changes(before, after, name_a, name_b)
+    tsv = f"{prefix}.tsv"
+    df.to_csv(tsv, index=False, sep="\t")
+    print(f"{prefix}.svg {prefix}-reverse.svg {tsv}")
+    print(df.head(args.top).to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+
+
+if __name__ == "__main__":
+    main()
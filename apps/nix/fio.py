@@ -1,14 +1,23 @@
+import itertools
 import json
 import os
+import resource
 import subprocess
 import signal
+from dataclasses import dataclass
+from pathlib import Path
 from typing import Dict, List, Optional
 
 import pandas as pd
 from helpers import (
     NOW,
+    ROOT,
     create_settings,
+    append_hw_counter_stats,
+    env_list,
+    append_ring_stats,
     flamegraph_env,
+    hw_counter_timeout,
     nix_build,
     read_stats,
     write_stats,
@@ -16,6 +25,79 @@ from helpers import (
 )
 from storage import Storage, StorageKind
 
+DEFAULT_JOB = "fio-rand-RW.job"
+# engines that submit one request at a time per job, fio ignores iodepth for them
+SYNC_ENGINES = {"psync", "sync", "vsync", "pvsync", "pvsync2"}
+
+
+@dataclass(frozen=True)
+class FioJob:
+    rw: str
+    bs: str
+    iodepth: int
+    direct: bool
+    numjobs: int = 8
+    size: str = "40G"
+    runtime: int = 60
+    # None is fio's default (psync)
+    ioengine: Optional[str] = None
+    # use threads instead of processes for numjobs
+    thread: bool = False
+
+    @property
+    def engine(self) -> str:
+        return self.ioengine or "psync"
+
+    @property
+    def filename(self) -> str:
+        mode = "direct" if self.direct else "buffered"
+        return f"fio-{self.rw}-{self.bs}-qd{self.iodepth}-j{self.numjobs}-{self.engine}-{mode}.job"
+
+    def render(self) -> str:
+        mix = "rwmixread=60\nrwmixwrite=40\n" if self.rw == "randrw" else ""
+        engine = f"ioengine={self.ioengine}\n" if self.ioengine else ""
+        thread = "thread\n" if self.thread else ""
+        # all cells share one file, so it is only laid out by the first one
+        return f"""[global]
+name=fio-matrix
+filename=fio-matrix
+rw={self.rw}
+{mix}bs={self.bs}
+direct={int(self.direct)}
+numjobs={self.numjobs}
+{engine}time_based=1
+runtime={self.runtime}
+{thread}
+[file1]
+size={self.size}
+iodepth={self.iodepth}
+"""
+
+
+def workload_matrix() -> List[FioJob]:
+    """Cells of the FIO_MATRIX run, each dimension can be narrowed via environment"""
+    block_sizes = env_list("FIO_BS", ["4k", "16k", "64k", "256k", "1M"])
+    iodepths = env_list("FIO_IODEPTH", ["1", "4", "16", "64", "256"])
+    patterns = env_list("FIO_RW", ["randread", "randwrite", "read", "write", "randrw"])
+    direct = env_list("FIO_DIRECT", ["1", "0"])
+    runtime = int(os.environ.get("FIO_RUNTIME", "60"))
+    ioengine = os.environ.get("FIO_IOENGINE", None)
+    # lkl is built without CONFIG_AIO, so the queue depth only matters for
+    # explicitly requested asynchronous engines
+    if (ioengine or "psync") in SYNC_ENGINES:
+        iodepths = ["1"]
+    return [
+        FioJob(
+            rw=rw,
+            bs=bs,
+            iodepth=int(iodepth),
+            direct=d == "1",
+            runtime=runtime,
+            ioengine=ioengine,
+        )
+        for rw, bs, iodepth, d in itertools.product(patterns, block_sizes, iodepths, direct)
+    ]
+
 
 def benchmark_fio(
     system: str,
@@ -23,13 +105,15 @@ def benchmark_fio(
     directory: str,
     stats: Dict[str, List],
     extra_env: Dict[str, str] = {},
+    job: str = DEFAULT_JOB,
 ) -> None:
 
     env = os.environ.copy()
     # we don't need network for these benchmarks
     del env["SGXLKL_TAP"]
     env.update(dict(SGXLKL_CWD=directory))
-    env.update(flamegraph_env(f"fio-{system}-{NOW}"))
+    prefix = "fio" if job == DEFAULT_JOB else Path(job).stem
+    env.update(flamegraph_env(f"{prefix}-{system}-{NOW}"))
     env.update(extra_env)
     enable_sgxio = "1" if system == "sgx-io" else "0"
     env.update(SGXLKL_ENABLE_SGXIO=enable_sgxio)
@@ -41,7 +125,8 @@ def benchmark_fio(
     if os.environ.get("SGXLKL_ENABLE_GDB", "0") == "1":
         stdout = None
 
-    cmd = [str(fio), "bin/fio", "--output-format=json", "--eta=always", "fio-rand-RW.job"]
+    cmd = [str(fio), "bin/fio", "--output-format=json", "--eta=always", job]
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
     proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
     data = ""
     in_json = False
@@ -62,24 +147,34 @@ def benchmark_fio(
         try:
             print("stop fio...")
             proc.send_signal(signal.SIGINT)
-            proc.wait(timeout=3)
+            proc.wait(timeout=hw_counter_timeout(env))
         except subprocess.TimeoutExpired:
             proc.send_signal(signal.SIGKILL)
             proc.wait()
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # cpu time of the whole run-image process tree, including enclave threads
+    host_cpu = (usage.ru_utime - usage_before.ru_utime) + (usage.ru_stime - usage_before.ru_stime)
     if data == "":
         raise RuntimeError(f"Did not get a result when running benchmark for {system}")
     jsondata = json.loads(data)
-    for jobnum, job in enumerate(jsondata["jobs"]):
+    for jobnum, job_data in enumerate(jsondata["jobs"]):
         stats["system"].append(system)
         stats["job"].append(jobnum)
+        stats["host-cpu-time"].append(host_cpu)
+        for metric_name in ["usr_cpu", "sys_cpu", "ctx"]:
+            stats[metric_name].append(job_data.get(metric_name))
         for op in ["read", "write", "trim"]:
-            metrics = job[op]
+            metrics = job_data[op]
             for metric_name, metric in metrics.items():
                 if isinstance(metric, dict):
                     for name, submetric in metric.items():
                         stats[f"{op}-{metric_name}-{name}"].append(submetric)
                 else:
                     stats[f"{op}-{metric_name}"].append(metric)
+    bytes_moved = sum(job_data[op]["io_bytes"] for job_data in jsondata["jobs"] for op in ["read", "write"])
+    append_hw_counter_stats(stats, env, bytes_moved, rows=len(jsondata["jobs"]))
+    bandwidth = sum(job_data[op]["bw"] for job_data in jsondata["jobs"] for op in ["read", "write"])
+    append_ring_stats(stats, env, f"{prefix}-{system}", bandwidth, rows=len(jsondata["jobs"]))
 
 
 def benchmark_native(storage: Storage, stats: Dict[str, List]) -> None:
@@ -114,7 +209,78 @@ def benchmark_sgx_io(storage: Storage, stats: Dict[str, List]) -> None:
         benchmark_fio("sgx-io", "fio-sgx-io", mnt, stats, extra_env=mount.extra_env())
 
 
+MATRIX_SYSTEMS = {
+    "native": (StorageKind.NATIVE, "fio-native"),
+    "sgx-io": (StorageKind.SPDK, "fio-sgx-io"),
+    "scone": (StorageKind.SCONE, "fio-scone"),
+    "sgx-lkl": (StorageKind.LKL, "fio-sgx-lkl"),
+}
+
+
+def benchmark_matrix(
+    storage: Storage, system: str, jobs: List[FioJob], stats: Dict[str, List]
+) -> None:
+    done = set(zip(stats["system"], stats["job-file"]))
+    todo = [job for job in jobs if (system, job.filename) not in done]
+    if not todo:
+        print(f"skip {system} benchmark")
+        return
+    kind, attr = MATRIX_SYSTEMS[system]
+    files = {job.filename: job.render() for job in todo}
+    if kind == StorageKind.SCONE:
+        # files unknown to the file shield cannot be read from the image,
+        # scone runs natively and reads the jobs from the host instead
+        job_dir = ROOT.joinpath("fio-jobs")
+        job_dir.mkdir(exist_ok=True)
+        for name, content in files.items():
+            job_dir.joinpath(name).write_text(content)
+        mount = storage.setup(kind)
+    else:
+        mount = storage.setup(kind, extra_files=files)
+    with mount as mnt:
+        extra_env = mount.extra_env()
+        if kind == StorageKind.SCONE:
+            extra_env.update(scone_env(mnt))
+        for job in todo:
+            job_file = job.filename
+            if kind == StorageKind.SCONE:
+                job_file = str(ROOT.joinpath("fio-jobs", job.filename))
+            rows = len(stats["system"])
+            benchmark_fio(system, attr, mnt, stats, extra_env=extra_env, job=job_file)
+            rows = len(stats["system"]) - rows
+            cell = dict(
+                rw=job.rw,
+                bs=job.bs,
+                iodepth=job.iodepth,
+                direct=int(job.direct),
+                numjobs=job.numjobs,
+                ioengine=job.engine,
+            )
+            stats["job-file"].extend([job.filename] * rows)
+            for key, value in cell.items():
+                stats[key].extend([value] * rows)
+            write_stats("fio-matrix.json", stats)
+
+
+def matrix_main() -> None:
+    stats = read_stats("fio-matrix.json")
+    storage = Storage(create_settings())
+    jobs = workload_matrix()
+    for system in MATRIX_SYSTEMS:
+        benchmark_matrix(storage, system, jobs, stats)
+
+    csv = f"fio-matrix-{NOW}.tsv"
+    print(csv)
+    df = pd.DataFrame(stats)
+    df.to_csv(csv, index=False, sep="\t")
+    df.to_csv("fio-matrix-latest.tsv", index=False, sep="\t")
+
+
 def main() -> None:
+    if os.environ.get("FIO_MATRIX", None) is not None:
+        matrix_main()
+        return
+
     stats = read_stats("fio.json")
 
     settings = create_settings()
@@ -6,6 +6,13 @@ from plot import ticker
 
 PAPER_MODE = os.environ.get("PAPER_MODE", "1") == "1"
 
+# sqlite.DEFAULT_CONFIG, the configuration plotted outside of the journal sweep
+SQLITE_DEFAULT_CONFIG: Dict[str, Union[str, int]] = {
+    "journal": "delete",
+    "synchronous": "full",
+    "cache-size": 2000,
+    "page-size": 4096,
+}
 SYSTEM_ALIASES: Dict[str, str] = {"sgx-io": "rkt-io"}
 OPERATION_ALIASES: Dict[str, str] = {
     "read-bw": "read",
@@ -38,7 +45,16 @@ ROW_ALIASES = dict(
     type={
         "x86_acc": "aes-ni",
         "no_x86_acc": "no aes-ni",
-        "not-optimized": "not optimized"
+        "not-optimized": "not optimized",
+        "none": "no luks",
+        "capi:xts(aes)-plain64": "capi xts",
+        "capi:xts(aes)-plain64 no_x86_acc": "capi xts\nno aes-ni",
+        "aes-xts-plain64": "aes-xts",
+        "aes-xts-plain64 no_x86_acc": "aes-xts\nno aes-ni",
+        "serpent-xts-plain64": "serpent",
+        "serpent-xts-plain64 no_x86_acc": "serpent\nno aes-ni",
+        "twofish-xts-plain64": "twofish",
+        "twofish-xts-plain64 no_x86_acc": "twofish\nno aes-ni",
     },
 )
 COLUMN_ALIASES: Dict[str, str] = {
@@ -53,7 +69,8 @@ COLUMN_ALIASES: Dict[str, str] = {
     "memcopy-size": "Copy size [kB]",
     "memcopy-time": "Latency [ms]",
     "time_per_syscall": "Time [μs]",
-    "sqlite-time [s]": "Transactions per second",
+    "sqlite-time [s]": "Time [s]",
+    "sqlite-total [s]": "Total time [s]",
     "lat_avg(ms)": "Latency [ms]",
     "req_sec_tot": "Requests/sec",
     "Throughput(ops/sec)": "Throughput [ops/sec]",
@@ -61,12 +78,24 @@ COLUMN_ALIASES: Dict[str, str] = {
     "sqlite-op-type": "Operation",
     "hdparm_kind": "Read",
     "network-bs-throughput": "Throughput [MiB/s]",
+    "streams": "TCP streams",
     "batch_size": "Batch size(KiB)",
     "batch-size": "Batch size(KiB)",
     "storage-bs-throughput": "Throughput [MiB/s]",
+    "dd-throughput": "Throughput [MiB/s]",
+    "read-throughput": "Throughput [MiB/s]",
+    "submissions-per-op": "SPDK submissions / op",
     "aesnithroughput": "Throughput [MiB/s]",
+    "spdk-throughput": "Throughput [MiB/s]",
+    "cycles-per-byte": "Cycles / byte",
     "cores": "Jobs",
-    "mysql-throughput": "Throughput [events/sec]"
+    "numjobs": "fio jobs",
+    "ethreads": "Enclave threads",
+    "mysql-throughput": "Throughput [events/sec]",
+    "memcpy-throughput": "Throughput [GB/s]",
+    "memcpy-size": "Copy size",
+    "memcpy-kind": "memcpy",
+    "alignment": "src/dst offset",
 }
 
 
@@ -61,16 +61,20 @@ def syscalls_perf_graph(df: pd.DataFrame) -> Any:
     df2 = df2.assign(
         time_per_syscall=10e6 * df2.total_time / (df2.packets_per_thread * df2.threads)
     )
+    # one bar per benchmarked syscall once syscall-perf.py measured several
+    several = "syscall" in df2.columns and df2.syscall.nunique() > 1
     g = catplot(
         data=apply_aliases(df2),
         x=column_alias("system"),
         y=column_alias("time_per_syscall"),
+        hue="syscall" if several else None,
         order=systems_order(df2),
         kind="bar",
         height=2.5,
         # aspect=1.2,
-        color=color,
-        palette=None,
+        color=None if several else color,
+        palette=palette if several else None,
+        legend=False,
     )
     # change_width(g.ax, 0.405)
     # g.ax.set_xlabel("")
@@ -79,7 +83,7 @@ def syscalls_perf_graph(df: pd.DataFrame) -> Any:
     # g.ax.set_xticklabels(g.ax.get_xmajorticklabels(), fontsize=8)
     # g.ax.set_yticklabels(g.ax.get_ymajorticklabels(), fontsize=8)
     # g.ax.grid(which="major")
-    apply_to_graphs(g.ax, False, -1, 0.28)
+    apply_to_graphs(g.ax, several, -1, 0.28)
 
     return g
 
@@ -237,12 +241,51 @@ def hdparm_graph(df: pd.DataFrame, metric: str) -> Any:
     return g
 
 
+def human_size(size: int) -> str:
+    for unit in ["B", "KiB", "MiB"]:
+        if size < 1024:
+            return f"{size}{unit}"
+        size //= 1024
+    return f"{size}GiB"
+
+
+def memcpy_plot_df(df: pd.DataFrame) -> pd.DataFrame:
+    # median over repetitions
+    keys = ["memcpy-kind", "placement", "hugepages", "hugepages-used", "cache", "memcpy-size", "alignment"]
+    df = df.groupby(keys, as_index=False)["memcpy-throughput"].median()
+    return df.sort_values("memcpy-size").assign(**{"memcpy-size": df["memcpy-size"].map(human_size)})
+
+
 def memcpy_graph(df: pd.DataFrame) -> Any:
+    df = memcpy_plot_df(df)
+    df = df[(df.alignment == "0/0") & (df.hugepages == 0)]
     g = catplot(
         data=apply_aliases(df),
         x=column_alias("memcpy-size"),
-        y=column_alias("memcpy-time"),
+        y=column_alias("memcpy-throughput"),
+        hue=column_alias("memcpy-kind"),
+        row=column_alias("placement"),
+        col=column_alias("cache"),
+        kind="point",
+        height=2.5,
+        aspect=1.5,
+    )
+    for ax in g.axes.flat:
+        ax.set_xticklabels(ax.get_xticklabels(), size=6, rotation=90)
+
+    return g
+
+
+def memcpy_alignment_graph(df: pd.DataFrame) -> Any:
+    df = memcpy_plot_df(df)
+    df = df[(df.cache == "warm") & (df.hugepages == 0) & df["memcpy-size"].isin(["4KiB", "1MiB"])]
+    g = catplot(
+        data=apply_aliases(df),
+        x=column_alias("alignment"),
+        y=column_alias("memcpy-throughput"),
         hue=column_alias("memcpy-kind"),
+        row=column_alias("placement"),
+        col=column_alias("memcpy-size"),
         kind="bar",
         height=2.5,
         aspect=1.2,
@@ -251,6 +294,27 @@ def memcpy_graph(df: pd.DataFrame) -> Any:
     return g
 
 
+def memcpy_hugepages_graph(df: pd.DataFrame) -> Any:
+    df = memcpy_plot_df(df)
+    df = df[(df.alignment == "0/0") & (df.cache == "cold")]
+    g = catplot(
+        data=apply_aliases(df),
+        x=column_alias("memcpy-size"),
+        y=column_alias("memcpy-throughput"),
+        # requested hugepages may have fallen back to regular pages
+        hue=column_alias("hugepages-used"),
+        row=column_alias("placement"),
+        col=column_alias("memcpy-kind"),
+        kind="point",
+        height=2.5,
+        aspect=1.2,
+    )
+    for ax in g.axes.flat:
+        ax.set_xticklabels(ax.get_xticklabels(), size=6, rotation=90)
+
+    return g
+
+
 def print_usage() -> None:
     print(f"USAGE: {sys.argv[0]} results.tsv...", file=sys.stderr)
     sys.exit(1)
@@ -286,8 +350,10 @@ def main() -> None:
         elif basename.startswith("hdparm"):
             graphs.append(("HDPARM-Cached", hdparm_graph(df, "cached")))
             graphs.append(("HDPARM-Buffered", hdparm_graph(df, "buffered")))
-        elif basename.startswith("memcpy"):
+        elif basename.startswith("memcpy-bench"):
             graphs.append(("MEMCPY", memcpy_graph(df)))
+            graphs.append(("MEMCPY-alignment", memcpy_alignment_graph(df)))
+            graphs.append(("MEMCPY-hugepages", memcpy_hugepages_graph(df)))
 
     for name, graph in graphs:
         filename = f"{name}.{out_format}"
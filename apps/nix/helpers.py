@@ -1,8 +1,11 @@
+import csv
+import glob
 import os
 import signal
 import subprocess
 import sys
 import json
+import tempfile
 from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime
@@ -57,7 +60,7 @@ def read_stats(path: str) -> DefaultDict[str, List]:
     return stats
 
 
-def write_stats(path: str, stats: DefaultDict[str, List]) -> None:
+def write_stats(path: str, stats: Dict[str, List]) -> None:
     with open(path, "w") as f:
         json.dump(stats, f)
 
@@ -174,6 +177,14 @@ def nix_build(attr: str) -> str:
     return run(["nix-build", "-A", attr, "--out-link", attr]).stdout.strip()
 
 
+def env_list(name: str, default: List[str]) -> List[str]:
+    """Comma-separated list from the environment, used to narrow benchmark matrices"""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return value.split(",")
+
+
 def scone_env(mountpoint: Optional[str]) -> Dict[str, str]:
     env = dict(
         SCONE_CONFIG=str(ROOT.joinpath("scone/sgx-musl.conf")),
@@ -190,21 +201,170 @@ def scone_env(mountpoint: Optional[str]) -> Dict[str, str]:
     return env
 
 
+def emmt_env(name: str) -> Dict[str, str]:
+    tsv = f"{name}-emmt.tsv"
+    info(tsv)
+    return dict(
+        SGXLKL_ENABLE_GDB="1",
+        SGXLKL_EMMT_TSV=os.path.abspath(tsv),
+        SGXLKL_EMMT_INTERVAL=os.environ.get("EMMT_INTERVAL", "1"),
+    )
+
+
 def flamegraph_env(name: str) -> Dict[str, str]:
     profiling = os.environ.get("PROFILING", None)
+    if os.environ.get("EMMT_TELEMETRY", None) is not None:
+        # run-image.py runs the program either under gdb or under perf
+        if profiling is not None:
+            raise Exception("EMMT_TELEMETRY and PROFILING cannot be combined")
+        return emmt_env(name)
+
     if profiling is None:
         return {}
 
+    if profiling == "ring":
+        perf_data = os.path.abspath(f"{name}-ring.perf.data")
+        ring_stats = os.path.abspath(f"{name}-ring.json")
+        info(f"{perf_data} {ring_stats}")
+        return dict(
+            SGXLKL_ENABLE_PERF_RING="1",
+            PERF_RING_FILENAME=perf_data,
+            PERF_RING_STATS=ring_stats,
+        )
+
     if os.environ.get("SGXLKL_ENABLE_PERF_HW_COUNTER", None) is None:
         flamegraph = f"{name}.svg"
         perf_data = f"{name}.perf.data"
         perf_script = f"{name}.perf.script"
-        info(f"{flamegraph} {perf_data} {perf_script}")
-        return dict(PERF_FILENAME=perf_data, SGXLKL_ENABLE_FLAMEGRAPH="1", FLAMEGRAPH_FILENAME=flamegraph, PERF_SCRIPT_FILENAME=perf_script)
+        collapsed = f"{name}.folded"
+        info(f"{flamegraph} {perf_data} {perf_script} {collapsed}")
+        return dict(PERF_FILENAME=perf_data, SGXLKL_ENABLE_FLAMEGRAPH="1", FLAMEGRAPH_FILENAME=flamegraph, PERF_SCRIPT_FILENAME=perf_script, PERF_COLLAPSED_FILENAME=collapsed)
     else:
         perf_data = f"{name}-hw-counters.perf.data"
-        info(perf_data)
-        return dict(PERF_FILENAME=perf_data)
+        hw_counters = os.path.abspath(f"{name}-hw-counters.tsv")
+        info(f"{perf_data} {hw_counters}")
+        return dict(PERF_FILENAME=perf_data, HW_COUNTERS_FILENAME=hw_counters)
+
+
+def hw_counter_timeout(env: Dict[str, str]) -> Optional[int]:
+    """How long to wait for run-image.py to exit after SIGINT"""
+    # post-processing hardware counters can take a while
+    return None if "HW_COUNTERS_FILENAME" in env else 3
+
+
+def append_hw_counter_stats(
+    stats: Dict[str, List],
+    env: Dict[str, str],
+    bytes_moved: float,
+    rows: int = 1,
+) -> None:
+    """
+    Add the whole-run hardware counter metrics written by run-image.py to
+    `rows` result rows, joined with the number of bytes the benchmark moved.
+    """
+    path = env.get("HW_COUNTERS_FILENAME", None)
+    if path is None:
+        return
+    if not os.path.exists(path):
+        raise RuntimeError(f"run-image.py did not write hardware counters to {path}")
+    with open(path) as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        total = next((row for row in reader if row["level"] == "total"), None)
+    if total is None:
+        raise RuntimeError(f"no samples in {path}, check that perf recorded the counters")
+    cycles = float(total.get("cycles", 0))
+    values = {
+        "hw-ipc": float(total["ipc"]),
+        "hw-llc-mpki": float(total["llc-mpki"]),
+        "hw-dtlb-miss-rate": float(total["dtlb-miss-rate"]),
+        "hw-cycles-per-byte": cycles / bytes_moved if bytes_moved else float("nan"),
+        "hw-counters": path,
+    }
+    for key, value in values.items():
+        stats[key].extend([value] * rows)
+
+
+PROFILING_BASELINES = "profiling-baselines.json"
+
+
+def append_ring_stats(
+    stats: Dict[str, List],
+    env: Dict[str, str],
+    key: str,
+    value: float,
+    higher_is_better: bool = True,
+    rows: int = 1,
+) -> None:
+    """
+    Report the overhead of the always-on sampling mode (PROFILING=ring) next to
+    the result and keep the ring buffer dumps only if `value` regressed by more
+    than PROFILING_REGRESSION percent compared to the best run recorded for `key`.
+    """
+    ring_stats = env.get("PERF_RING_STATS", None)
+    if ring_stats is None or not os.path.exists(ring_stats):
+        return
+    with open(ring_stats) as f:
+        overhead = json.load(f)
+
+    baselines: Dict[str, float] = {}
+    if os.path.exists(PROFILING_BASELINES):
+        with open(PROFILING_BASELINES) as f:
+            baselines = json.load(f)
+    threshold = float(os.environ.get("PROFILING_REGRESSION", "10")) / 100
+    baseline = baselines.get(key, None)
+    regressed = False
+    if baseline is not None and baseline != 0:
+        change = (value - baseline) / baseline
+        regressed = -change > threshold if higher_is_better else change > threshold
+    if baseline is None or (value > baseline if higher_is_better else value < baseline):
+        baselines[key] = value
+        with open(PROFILING_BASELINES, "w") as f:
+            json.dump(baselines, f)
+
+    perf_data = env["PERF_RING_FILENAME"]
+    dumps = sorted(glob.glob(f"{perf_data}*"))
+    if regressed:
+        info(f"{key} regressed: {value} vs. best {baseline}, keeping {' '.join(dumps)}")
+    else:
+        for dump in dumps:
+            os.unlink(dump)
+        dumps = []
+
+    values = {
+        "profiling-overhead": overhead["overhead"],
+        "profiling-cpu-time": overhead["perf_cpu_time"],
+        "profiling-regressed": regressed,
+        "profiling-dumps": " ".join(dumps),
+    }
+    for k, v in values.items():
+        stats[k].extend([v] * rows)
+
+
+class PerfStat:
+    """`perf stat -x,` counting from construction until stop()"""
+
+    def __init__(self, events: str, target: List[str]) -> None:
+        self.output = tempfile.NamedTemporaryFile(prefix="perf-stat", suffix=".csv")
+        cmd = ["perf", "stat", "-x,", "-o", self.output.name, "-e", events] + target
+        print(f"$ {' '.join(cmd)}")
+        self.proc = subprocess.Popen(cmd)
+
+    def stop(self) -> Dict[str, float]:
+        self.proc.send_signal(signal.SIGINT)
+        self.proc.wait()
+        counters: Dict[str, float] = {}
+        with open(self.output.name) as f:
+            for line in f:
+                fields = line.strip().split(",")
+                if len(fields) < 3 or line.startswith("#"):
+                    continue
+                value, unit, event = fields[0], fields[1], fields[2]
+                try:
+                    counters[event] = float(value) * (1024 * 1024 if unit == "MiB" else 1)
+                except ValueError:  # <not counted>/<not supported>
+                    counters[event] = float("nan")
+        self.output.close()
+        return counters
 
 
 def create_settings() -> Settings:
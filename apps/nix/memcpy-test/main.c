@@ -1,63 +1,182 @@
+#define _GNU_SOURCE
+
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
-#include <sys/time.h>
+#include <stdint.h>
+#include <time.h>
+#include <sys/mman.h>
+#include <emmintrin.h>
 
-#define NUM_PTS 9
-#define ITERS 1000000
+#define MIN_SIZE 64UL
+#define MAX_SIZE (64UL << 20)
+#define HUGEPAGE_SIZE (2UL << 20)
+// room for the alignment offsets below
+#define SLACK 4096UL
+// bytes copied per warm measurement, the number of copies is derived from it
+#define WARM_BYTES (256UL << 20)
+#define COLD_BYTES (16UL << 20)
 
 void *memcpy_avx(void *dest, const void *src, size_t n);
 void *__memcpy_fwd(void *dest, const void *src, size_t n);
 
-static int test_sizes[] = {4, 8, 16, 32, 64, 128, 256, 512, 1024};
+typedef void *(*memcpy_fn)(void *dest, const void *src, size_t n);
 
-static void* (*memcpy_funcs[3])(void *dest, const void *src, size_t n) = {
+static const char *kind_names[] = {"avx", "old", "libc"};
+static memcpy_fn memcpy_funcs[] = {
   memcpy_avx,
   __memcpy_fwd,
   memcpy,
 };
 
-static double get_time() {
-  struct timeval tv;
-  gettimeofday(&tv, NULL);
-  double ret = tv.tv_usec;
-  ret = (ret/1000);
-  ret += (tv.tv_sec * 1000);
-
-  return ret;
-}
-
-static double bench_memcpy(int mem_size, int no){
-  double total_time = 0;
-  void *src, *dest;
-  src = malloc(mem_size*1024);
-  dest = malloc(mem_size*1024);
-  
-  double start_t, end_t;
-  start_t = get_time();
-  for(int i=0; i<ITERS; i++){
-    memcpy_funcs[no](dest, src, mem_size*1024);
-  }
-  end_t = get_time();
-  
-  free(src);
-  free(dest);
-
-  total_time = (end_t - start_t)/ITERS;
-  return total_time;
-}  
-
-int main(int argc, char** argv){
-  if (argc != 2){
-    fprintf(stderr, "%s 0|1\n", argv[0]);
+// source/destination offsets from a page-aligned address
+static const size_t alignments[][2] = {
+  {0, 0},
+  {1, 0},
+  {0, 1},
+  {8, 8},
+  {3, 17},
+};
+
+static uint64_t now_ns(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+}
+
+static size_t huge_size(size_t size) {
+  return (size + HUGEPAGE_SIZE - 1) & ~(HUGEPAGE_SIZE - 1);
+}
+
+static void *alloc_buffer(size_t size, int *hugepages) {
+  void *buf = MAP_FAILED;
+  if (*hugepages) {
+    buf = mmap(NULL, huge_size(size), PROT_READ | PROT_WRITE,
+               MAP_PRIVATE | MAP_ANONYMOUS | MAP_HUGETLB, -1, 0);
+    if (buf == MAP_FAILED) {
+      perror("mmap(MAP_HUGETLB), falling back to regular pages");
+      *hugepages = 0;
+    }
+  }
+  if (buf == MAP_FAILED) {
+    buf = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+  }
+  if (buf == MAP_FAILED) {
+    perror("mmap");
     exit(EXIT_FAILURE);
   }
+  // fault in all pages before measuring
+  memset(buf, 'a', size);
+  return buf;
+}
 
-  double result_array[NUM_PTS];
+static void flush(const char *buf, size_t size) {
+  for (size_t i = 0; i < size; i += 64) {
+    _mm_clflush(buf + i);
+  }
+  _mm_mfence();
+}
 
-  for(int i=0; i<NUM_PTS; i++){
-    result_array[i] = bench_memcpy(test_sizes[i], (strtol(argv[1], NULL, 10)));
+// Warm: the same copy repeated back-to-back, time per copy in ns.
+static double bench_warm(memcpy_fn fn, char *dest, const char *src, size_t size) {
+  size_t iters = WARM_BYTES / size;
+  if (iters < 3) {
+    iters = 3;
   }
+  fn(dest, src, size);
+  uint64_t start = now_ns();
+  for (size_t i = 0; i < iters; i++) {
+    fn(dest, src, size);
+  }
+  return (double)(now_ns() - start) / iters;
+}
 
-  printf("{\"4KB\":%f,\"8KB\":%f,\"16KB\":%f,\"32KB\":%f,\"64KB\":%f,\"128KB\":%f,\"256KB\":%f,\"512KB\":%f,\"1024KB\":%f}\n",result_array[0], result_array[1],result_array[2],result_array[3],result_array[4], result_array[5], result_array[6], result_array[7], result_array[8]);
+// Cold: source and destination are evicted from all cache levels before
+// every copy; only the copy itself is timed, minus the timer overhead.
+static double bench_cold(memcpy_fn fn, char *dest, const char *src, size_t size, double timer) {
+  size_t iters = COLD_BYTES / size;
+  if (iters < 3) {
+    iters = 3;
+  } else if (iters > 1000) {
+    iters = 1000;
+  }
+  uint64_t total = 0;
+  for (size_t i = 0; i < iters; i++) {
+    flush(src, size);
+    flush(dest, size);
+    uint64_t start = now_ns();
+    fn(dest, src, size);
+    total += now_ns() - start;
+  }
+  double ns = (double)total / iters - timer;
+  return ns > 0 ? ns : 0;
+}
+
+static double timer_overhead(void) {
+  uint64_t min = UINT64_MAX;
+  for (int i = 0; i < 1000; i++) {
+    uint64_t start = now_ns();
+    uint64_t t = now_ns() - start;
+    if (t < min) {
+      min = t;
+    }
+  }
+  return min;
+}
+
+int main(int argc, char** argv) {
+  if (argc < 2 || argc > 5) {
+    fprintf(stderr, "%s 0|1|2 [hugepages] [repetitions] [max_size]\n", argv[0]);
+    exit(EXIT_FAILURE);
+  }
+  long kind = strtol(argv[1], NULL, 10);
+  if (kind < 0 || kind > 2) {
+    fprintf(stderr, "kind must be 0 (avx), 1 (old) or 2 (libc)\n");
+    exit(EXIT_FAILURE);
+  }
+  int hugepages = argc > 2 ? atoi(argv[2]) : 0;
+  int repetitions = argc > 3 ? atoi(argv[3]) : 1;
+  size_t max_size = argc > 4 ? strtoul(argv[4], NULL, 10) : MAX_SIZE;
+
+  memcpy_fn fn = memcpy_funcs[kind];
+  int src_hugepages = hugepages, dest_hugepages = hugepages;
+  char *src = alloc_buffer(max_size + SLACK, &src_hugepages);
+  char *dest = alloc_buffer(max_size + SLACK, &dest_hugepages);
+  // only report hugepages if both buffers got them, otherwise
+  // fall back to regular pages for both
+  if (src_hugepages != dest_hugepages) {
+    if (src_hugepages) {
+      munmap(src, huge_size(max_size + SLACK));
+      src_hugepages = 0;
+      src = alloc_buffer(max_size + SLACK, &src_hugepages);
+    } else {
+      munmap(dest, huge_size(max_size + SLACK));
+      dest_hugepages = 0;
+      dest = alloc_buffer(max_size + SLACK, &dest_hugepages);
+    }
+  }
+  hugepages = src_hugepages && dest_hugepages;
+  double timer = timer_overhead();
+
+  for (int rep = 0; rep < repetitions; rep++) {
+    for (size_t size = MIN_SIZE; size <= max_size; size *= 2) {
+      for (size_t a = 0; a < sizeof(alignments) / sizeof(alignments[0]); a++) {
+        size_t src_offset = alignments[a][0], dest_offset = alignments[a][1];
+        for (int cold = 0; cold <= 1; cold++) {
+          double ns;
+          if (cold) {
+            ns = bench_cold(fn, dest + dest_offset, src + src_offset, size, timer);
+          } else {
+            ns = bench_warm(fn, dest + dest_offset, src + src_offset, size);
+          }
+          printf("{\"kind\": \"%s\", \"size\": %zu, \"src_offset\": %zu, \"dst_offset\": %zu, "
+                 "\"cache\": \"%s\", \"hugepages\": %d, \"repetition\": %d, \"ns\": %lf}\n",
+                 kind_names[kind], size, src_offset, dest_offset, cold ? "cold" : "warm",
+                 hugepages, rep, ns);
+          fflush(stdout);
+        }
+      }
+    }
+  }
+  return 0;
 }
@@ -5,7 +5,8 @@ import pandas as pd
 from plot import apply_hatch, catplot
 import os
 
-from graph_utils import apply_aliases, change_width, column_alias, apply_to_graphs
+from graph_utils import apply_aliases, change_width, column_alias, apply_to_graphs, systems_order
+from scaling import throughput, usl
 
 
 def preprocess_hdparm(df_col: pd.Series) -> Any:
@@ -88,22 +89,50 @@ def hdparm_zerocopy_plot(dir: str, graphs: List[Any]) -> None:
     graphs.append(g)
 
 
+def page_cache_plot(dir: str, graphs: List[Any]) -> None:
+    path = os.path.join(os.path.realpath(dir), "page-cache-latest.tsv")
+    if not os.path.exists(path):
+        print(f"{path} not found, skip page_cache")
+        return
+    df = pd.read_csv(path, sep="\t")
+    df = apply_aliases(df)
+    g = catplot(
+        data=df,
+        x=column_alias("system"),
+        y=column_alias("read-throughput"),
+        order=systems_order(df),
+        hue=column_alias("mode"),
+        hue_order=["cached", "buffered", "direct"],
+        kind="bar",
+        height=2.5,
+        legend=False,
+    )
+    apply_to_graphs(g.ax, True, 3, 0.2)
+
+    graphs.append(g)
+
+
 def network_bs_plot(dir: str, graphs: List[Any]) -> None:
     df = pd.read_csv(
         os.path.join(os.path.realpath(dir), "network-test-bs-latest.tsv"), sep="\t"
     )
-    df["network-bs-throughput"] = 1024 / df["time"]
+    if "aggregate-goodput-gbps" in df.columns:
+        # measured at the receiver, summed over all concurrent streams
+        df = df.groupby(["system", "batch_size", "streams"], as_index=False).first()
+        df["network-bs-throughput"] = df["aggregate-goodput-gbps"] * 1e9 / 8 / 1024 / 1024
+    else:
+        df["network-bs-throughput"] = 1024 / df["time"]
+        df["streams"] = 1
     # df["batch_size"] = df["batch_size"].apply(lambda x: str(x)+"KiB")
 
     g = catplot(
         data=apply_aliases(df),
         x=column_alias("batch_size"),
         y=column_alias("network-bs-throughput"),
+        hue=column_alias("streams"),
         kind="bar",
         height=2.5,
         legend=False,
-        color="black",
-        palette=None,
     )
 
     # change_width(g.ax, 0.25)
@@ -117,64 +146,143 @@ def network_bs_plot(dir: str, graphs: List[Any]) -> None:
 
 def storage_bs_plot(dir: str, graphs: List[Any]) -> None:
     df = pd.read_csv(
-        os.path.join(os.path.realpath(dir), "simpleio-unenc.tsv"), sep="\t"
+        os.path.join(os.path.realpath(dir), "simpleio-latest.tsv"), sep="\t"
     )
-    df["storage-bs-throughput"] = (10 * 1024) / df["time"]
+    if "throughput-mib" not in df.columns:
+        df["throughput-mib"] = (10 * 1024) / df["time"]
+        df["direct"] = 1
+    df["storage-bs-throughput"] = df["throughput-mib"]
+    df["operation"] = df["workload"] + df["direct"].map({1: " (direct)", 0: " (buffered)"})
 
     g = catplot(
-        data=apply_aliases(df),
+        data=apply_aliases(df[df.system == "sgx-io"]),
         x=column_alias("batch-size"),
         y=column_alias("storage-bs-throughput"),
+        hue=column_alias("operation"),
         kind="bar",
         height=2.5,
         legend=False,
-        color="black",
-        palette=None,
     )
 
-    # change_width(g.ax, 0.25)
-    # # g.ax.set_xlabel('')
-    # g.ax.set_xticklabels(g.ax.get_xmajorticklabels(), fontsize=6)
-    # g.ax.set_yticklabels(g.ax.get_ymajorticklabels(), fontsize=6)
+    apply_to_graphs(g.ax, True, 2, 0.2)
+
+    graphs.append(g)
 
-    apply_to_graphs(g.ax, False, -1)
+
+def dd_plot(dir: str, graphs: List[Any]) -> None:
+    path = os.path.join(os.path.realpath(dir), "dd-test-latest.tsv")
+    if not os.path.exists(path):
+        print(f"{path} not found, skip dd")
+        return
+    df = pd.read_csv(path, sep="\t")
+    if "workload" not in df.columns:
+        print("dd-test-latest.tsv predates dd.py's read/write sweep, skip dd")
+        return
+    df["operation"] = df["workload"] + df["direct"].map({1: " (direct)", 0: " (buffered)"})
+    # mean over repetitions, the bars show the spread
+    df = apply_aliases(df)
+    g = catplot(
+        data=df,
+        x=column_alias("batch-size"),
+        y=column_alias("dd-throughput"),
+        hue=column_alias("system"),
+        hue_order=systems_order(df),
+        col=column_alias("operation"),
+        col_wrap=2,
+        kind="bar",
+        height=2.5,
+        legend=False,
+    )
+    for ax in g.axes.flat:
+        apply_to_graphs(ax, False, -1, 0.2)
+    g.axes.flat[0].legend(loc="best", fontsize="small")
 
     graphs.append(g)
 
 
-def smp_plot(dir: str, graphs: List[Any]) -> None:
+def storage_bs_submissions_plot(dir: str, graphs: List[Any]) -> None:
     df = pd.read_csv(
-        os.path.join(os.path.realpath(dir), "smp-latest.tsv"), sep="\t"
+        os.path.join(os.path.realpath(dir), "simpleio-latest.tsv"), sep="\t"
     )
-    df = pd.melt(df,
-                 id_vars=['cores', 'job'],
-                 value_vars=['read-bw', 'write-bw'],
-                 var_name="operation",
-                 value_name="disk-throughput")
-    df = df.groupby(["cores", "operation"]).sum().reset_index()
-
-    df["disk-throughput"] /= 1024
+    df = df[(df.system == "sgx-io") & (df.direct == 1)]
+
     g = catplot(
         data=apply_aliases(df),
-        x=column_alias("cores"),
-        y=column_alias("disk-throughput"),
-        hue=column_alias("operation"),
+        x=column_alias("batch-size"),
+        y=column_alias("submissions-per-op"),
+        hue=column_alias("workload"),
         kind="bar",
         height=2.5,
         legend=False,
-        palette=["grey", "black"],
     )
 
-    # change_width(g.ax, 0.25)
-    # # g.ax.set_xlabel('')
-    # g.ax.set_xticklabels(g.ax.get_xmajorticklabels(), fontsize=6)
-    # g.ax.set_yticklabels(g.ax.get_ymajorticklabels(), fontsize=6)
-    # g.ax.legend(loc='best', fontsize='small')
-    apply_to_graphs(g.ax, True, 2, 0.285)
+    apply_to_graphs(g.ax, True, 2, 0.3)
 
     graphs.append(g)
 
 
+def read_smp(dir: str) -> pd.DataFrame:
+    df = pd.read_csv(os.path.join(os.path.realpath(dir), "smp-latest.tsv"), sep="\t")
+    if "numjobs" not in df.columns:
+        # before the ethreads/numjobs sweep both were set to `cores`
+        df["ethreads"] = df["cores"]
+        df["numjobs"] = df["cores"]
+        for column in ["usr_cpu", "sys_cpu", "host-cpu-time"]:
+            df[column] = float("nan")
+    df = throughput(df)
+    df["disk-throughput"] = df["bw"] / 1024
+    return df
+
+
+def smp_scaling_plot(
+    dir: str, graphs: List[Any], df: pd.DataFrame, dimension: str, fixed: str
+) -> None:
+    """Measured throughput along `dimension` with the fitted USL curve dashed"""
+    order = sorted(df[dimension].unique())
+    data = apply_aliases(df.copy())
+    systems = systems_order(data)
+    g = catplot(
+        data=data,
+        x=column_alias(dimension),
+        y=column_alias("disk-throughput"),
+        hue="system",
+        hue_order=systems,
+        order=order,
+        kind="point",
+        height=2.5,
+        legend=False,
+        markers=["o", "s", "^"][: len(systems)],
+        palette=["black", "dimgrey", "darkgrey"][: len(systems)],
+    )
+    fits_path = os.path.join(os.path.realpath(dir), "smp-fit-latest.tsv")
+    if os.path.exists(fits_path):
+        fits = apply_aliases(pd.read_csv(fits_path, sep="\t"))
+        colors = dict(zip(systems, ["black", "dimgrey", "darkgrey"]))
+        for row in fits[fits.dimension == dimension].to_dict("records"):
+            value = int(row["fixed"].split("=")[1])
+            if not ((data.system == row["system"]) & (data[column_alias(fixed)] == value)).any():
+                continue
+            model = [usl(n, row["lambda"], row["sigma"], row["kappa"]) / 1024 for n in order]
+            g.ax.plot(range(len(order)), model, linestyle="--", linewidth=0.8, color=colors[row["system"]])
+    g.ax.set_xlabel(column_alias(dimension))
+    g.ax.legend(loc="best", fontsize="small")
+    graphs.append(g)
+
+
+def smp_plot(dir: str, graphs: List[Any]) -> None:
+    df = read_smp(dir)
+    # scaling with fio jobs, each system at its highest number of ethreads
+    max_threads = df.groupby("system")["ethreads"].transform("max")
+    smp_scaling_plot(dir, graphs, df[df.ethreads == max_threads], "numjobs", "ethreads")
+
+
+def smp_ethreads_plot(dir: str, graphs: List[Any]) -> None:
+    df = read_smp(dir)
+    # scaling with enclave threads at the highest number of fio jobs
+    df = df[(df.system != "native") & (df.numjobs == df.numjobs.max())]
+    smp_scaling_plot(dir, graphs, df, "ethreads", "numjobs")
+
+
 def read_iperf(path: str, type: str) -> pd.DataFrame:
     df = pd.read_csv(path, sep="\t")
     df = df[df["direction"] == "send"]
@@ -204,43 +312,84 @@ def network_optimization_plot(dir: str, graphs: List[Any]) -> None:
     graphs.append(g)
 
 
-def aesni_plot(dir: str, graphs: List[Any]) -> None:
+def read_aesni(dir: str) -> pd.DataFrame:
     df = pd.read_csv(
         os.path.join(os.path.realpath(dir), "aesni-latest.tsv"), sep="\t"
     )
     df = df.assign(aesnithroughput=df.bytes / df.time / 1024 / 1024)
+    if "system" not in df.columns:  # single sgx-io write of older runs
+        return df.assign(system="sgx-io", workload="write")
+    # 512 KiB batches like the old benchmark, best enclave thread count
+    df = df[df["batch-size"] == 512]
+    best = df.groupby(["system", "type", "workload"])["aesnithroughput"].idxmax()
+    return df.loc[best]
+
+
+def aesni_crypto_plot(dir: str, graphs: List[Any], y: str) -> None:
+    df = apply_aliases(read_aesni(dir))
     g = catplot(
-        data=apply_aliases(df),
+        data=df,
         x=column_alias("type"),
-        y=column_alias("aesnithroughput"),
+        y=column_alias(y),
+        hue=column_alias("system"),
+        hue_order=systems_order(df),
+        col=column_alias("workload"),
         kind="bar",
         height=2.5,
         aspect=1.2,
-        color="black",
-        palette=None
+        legend=False,
     )
-    apply_to_graphs(g.ax, False, -1, 0.1)
-    g.ax.set_ylabel(g.ax.get_ylabel(), size=8)
-    g.ax.set_xticklabels(g.ax.get_xticklabels(), size=8)
-    g.ax.set_yticklabels(g.ax.get_yticklabels(), size=8)
+    for ax in g.axes.flat:
+        apply_to_graphs(ax, False, -1, 0.1)
+        ax.set_xticklabels(ax.get_xticklabels(), size=6, rotation=90)
+    g.axes.flat[0].legend(loc="best", fontsize="small")
     graphs.append(g)
 
 
+def aesni_plot(dir: str, graphs: List[Any]) -> None:
+    aesni_crypto_plot(dir, graphs, "aesnithroughput")
+
+
+def aesni_cycles_plot(dir: str, graphs: List[Any]) -> None:
+    if "cycles-per-byte" not in read_aesni(dir).columns:
+        print("aesni-latest.tsv predates the cycle counts, skip aesni_cycles")
+        return
+    aesni_crypto_plot(dir, graphs, "cycles-per-byte")
+
+
 def spdk_zerocopy_plot(dir: str, graphs: List[Any]) -> None:
     df = pd.read_csv(
         os.path.join(os.path.realpath(dir), "spdk-zerocopy-latest.tsv"), sep="\t"
     )
-    df = df.assign(aesnithroughput=df.bytes / df.time / 1024 / 1024)
     g = catplot(
         data=apply_aliases(df),
-        x=column_alias("type"),
-        y=column_alias("aesnithroughput"),
+        x=column_alias("batch-size"),
+        y=column_alias("spdk-throughput"),
+        hue=column_alias("type"),
+        kind="bar",
+        height=2.5,
+        aspect=1.2,
+        legend=False,
+    )
+    apply_to_graphs(g.ax, True, 2, 0.18)
+    graphs.append(g)
+
+
+def spdk_zerocopy_cycles_plot(dir: str, graphs: List[Any]) -> None:
+    df = pd.read_csv(
+        os.path.join(os.path.realpath(dir), "spdk-zerocopy-latest.tsv"), sep="\t"
+    )
+    g = catplot(
+        data=apply_aliases(df),
+        x=column_alias("batch-size"),
+        y=column_alias("cycles-per-byte"),
+        hue=column_alias("type"),
         kind="bar",
         height=2.5,
         aspect=1.2,
+        legend=False,
     )
-    change_width(g.ax, 0.25)
-    g.ax.set_xlabel('')
+    apply_to_graphs(g.ax, True, 2, 0.18)
     graphs.append(g)
 
 
@@ -255,15 +404,23 @@ def main() -> None:
         # disabled for now
         #"network_bs": network_bs_plot,
         #"storage_bs": storage_bs_plot,
+        #"storage_bs_submissions": storage_bs_submissions_plot,
         # "spdk_zerocopy": spdk_zerocopy_plot,
+        # "spdk_zerocopy_cycles": spdk_zerocopy_cycles_plot,
+        "dd": dd_plot,
+        "page_cache": page_cache_plot,
         "smp": smp_plot,
+        "smp_ethreads": smp_ethreads_plot,
         "aesni": aesni_plot,
+        "aesni_cycles": aesni_cycles_plot,
         "network_optimization": network_optimization_plot
     }
 
     for name, pf in plot_func.items():
+        # plots can be skipped if the data is too old
+        before = len(graphs)
         pf(sys.argv[1], graphs)
-        graph_names.append(name)
+        graph_names += [name] * (len(graphs) - before)
 
     for i in range(len(graphs)):
         name = f"{graph_names[i]}.pdf"
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import socket
+import sys
+import time
+from threading import Lock, Thread
+from typing import Tuple
+
+# Receive side of network-test-bs.py: a stand-in for `nc -l > /dev/null` that
+# reports for every connection how many bytes arrived and when.
+
+output_lock = Lock()
+
+
+def drain(conn: socket.socket, peer: Tuple[str, int], buf_size: int) -> None:
+    buf = memoryview(bytearray(buf_size))
+    received = 0
+    first = last = None
+    with conn:
+        while True:
+            n = conn.recv_into(buf)
+            if n == 0:
+                break
+            last = time.monotonic()
+            if first is None:
+                first = last
+            received += n
+    if first is None or last is None:
+        first = last = time.monotonic()
+    record = dict(
+        peer=peer[0],
+        port=peer[1],
+        bytes=received,
+        start=first,
+        end=last,
+        time=last - first,
+    )
+    with output_lock:
+        print(json.dumps(record), flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Count received bytes per TCP connection")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--buf-size", type=int, default=1024 * 1024, help="recv buffer in bytes")
+    args = parser.parse_args()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("", args.port))
+    server.listen(128)
+    print(json.dumps(dict(listening=args.port)), flush=True)
+    while True:
+        conn, peer = server.accept()
+        Thread(target=drain, args=(conn, peer, args.buf_size), daemon=True).start()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -1,6 +1,9 @@
-import time
+import queue
 import subprocess
-from typing import Dict, List
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Dict, List
 import json
 import signal
 import os
@@ -9,23 +12,72 @@ import pandas as pd
 
 from helpers import (
     NOW,
+    ROOT,
     Settings,
     create_settings,
     nix_build,
     read_stats,
     write_stats,
-    spawn,
     run as helper_run,
 )
 from storage import Storage, StorageKind
 from network import Network, NetworkKind, setup_remote_network, remote_cmd
 
+SINK = ROOT.joinpath("network-sink.py")
+SINK_PORT = "8888"
+
+
+class ReceiverSink:
+    """network-sink.py on the remote host, measuring goodput at the receiver"""
+
+    def __init__(self, settings: Settings) -> None:
+        # the remote host runs the same python interpreter as we do
+        python = Path(sys.executable).resolve().parents[1]
+        helper_run(["nix", "copy", str(python), "--to", f"ssh://{settings.remote_ssh_host}"])
+        self.ssh_host = settings.remote_ssh_host
+        self.python = str(python.joinpath("bin", "python3"))
+        # a sink left over from an aborted run would still hold the port
+        self.kill_remote()
+        cmd = ["ssh", self.ssh_host, "--", self.python, "-", "--port", SINK_PORT]
+        print(f"$ {' '.join(cmd)} < {SINK}")
+        with open(SINK) as script:
+            self.proc = subprocess.Popen(cmd, stdin=script, stdout=subprocess.PIPE, text=True)
+        self.records: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+        # wait until the sink listens
+        self.records.get(timeout=60)
+
+    def _read(self) -> None:
+        assert self.proc.stdout is not None
+        for line in self.proc.stdout:
+            try:
+                self.records.put(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"sink: {line}", end="")
+
+    def connections(self, count: int, timeout: float = 60) -> List[Dict[str, Any]]:
+        return [self.records.get(timeout=timeout) for _ in range(count)]
+
+    def kill_remote(self) -> None:
+        pattern = f"{self.python} - --port {SINK_PORT}"
+        helper_run(["ssh", self.ssh_host, "--", f"pkill -f '{pattern}' || true"])
+
+    def stop(self) -> None:
+        self.kill_remote()
+        self.proc.send_signal(signal.SIGINT)
+        try:
+            self.proc.wait(timeout=3)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+
 class Benchmark:
     def __init__(self, settings: Settings) -> None:
         self.settings = create_settings()
         self.storage = Storage(settings)
         self.network = Network(settings)
-        self.local_nc = nix_build("netcat-native")
 
     def run(
         self,
@@ -39,64 +91,73 @@ class Benchmark:
 
         network_test = nix_build(attr)
         server_ip = self.settings.remote_dpdk_ip
-        num_bytes = str(1*1024*1024*1024) # 1 GiB
+        num_bytes = str(1*1024*1024*1024) # 1 GiB per stream
         batch_size = [4, 8, 16, 32, 64, 128, 256, 512] # in KiB
         #batch_size = [4, 8] # in KiB
+        streams = [int(s) for s in os.environ.get("NETWORK_TEST_STREAMS", "1,2,4,8").split(",")]
 
-        helper_run(["nix", "copy", self.local_nc, "--to", f"ssh://{self.settings.remote_ssh_host}"])
-
-        nc_cmds = [
-            ["while", "true"],
-            ["do", f"{self.local_nc}/bin/nc", "-l", "8888", ">", "/dev/null", "2>&1"],
-            ["done"]
-        ]
-        nc_command = "; ".join(map(lambda cmd: " ".join(cmd), nc_cmds))
-
-        with spawn("ssh", self.settings.remote_ssh_host, "--", nc_command) as remote_nc_proc:
+        done = set(zip(stats["system"], stats["batch_size"], stats["streams"]))
+        sink = ReceiverSink(self.settings)
+        try:
             for bs in batch_size:
-                #while True:
-                #    try:
-                #        nc_cmd = [
-                #            f"{self.local_nc}/bin/nc",
-                #            "-z", "-v",
-                #            f"{server_ip}",
-                #            "8888"
-                #        ]
-                #        nc_proc = subprocess.run(nc_cmd)
-                #        break
-                #    except subprocess.CalledProcessError:
-                #        #status = remote_nc_proc.poll()
-                #        #if status is not None:
-                #        #    raise OSError(f"netcat-server exiteded with {status}")
-                #        #time.sleep(1)
-                #        pass
-
-                local_proc = subprocess.Popen(
-                    [
-                     network_test,
-                     "bin/network-test",
-                     "write",
-                     f"{server_ip}",
-                     num_bytes,
-                     str(bs),
-                    ],
-                    stdout=subprocess.PIPE, text=True, env=env,
-                )
-
-                try:
-                    local_proc.wait()
-                    #breakpoint()
-                    assert local_proc.stdout
-                    for line in local_proc.stdout:
-                        data = json.loads(line)
-                        stats["system"].append(system)
-                        stats["batch_size"].append(bs)
-                        for i in data:
-                            stats[i].append(data[i])
-                    print(local_proc.stdout.read())
-                except Exception as e:
-                    print(f"{local_proc.stdout} not in json format")
-                print(stats)
+                for num_streams in streams:
+                    if (system, bs, num_streams) in done:
+                        print(f"skip {system} bs={bs} streams={num_streams}")
+                        continue
+                    cmd = [
+                        network_test,
+                        "bin/network-test",
+                        "write",
+                        f"{server_ip}",
+                        num_bytes,
+                        str(bs * 1024),
+                        str(num_streams),
+                    ]
+                    print(f"$ {' '.join(cmd)}")
+                    # drain stdout while waiting, so a full pipe cannot block the sender
+                    proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True, env=env)
+                    senders = []
+                    for line in proc.stdout.splitlines():
+                        try:
+                            senders.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            print(line)
+                    if len(senders) != num_streams:
+                        raise RuntimeError(f"expected {num_streams} results from network-test, got: {proc.stdout}")
+                    self.record(stats, system, bs, senders, sink.connections(num_streams))
+        finally:
+            sink.stop()
+
+    def record(
+        self,
+        stats: Dict[str, List],
+        system: str,
+        bs: int,
+        senders: List[Dict[str, Any]],
+        receivers: List[Dict[str, Any]],
+    ) -> None:
+        by_port = {r["port"]: r for r in receivers}
+        received = sum(r["bytes"] for r in receivers)
+        # all flows from the first to the last byte seen by the receiver
+        duration = max(r["end"] for r in receivers) - min(r["start"] for r in receivers)
+        aggregate = received * 8 / duration / 1e9 if duration > 0 else float("nan")
+        for sender in senders:
+            receiver = by_port.get(sender["port"], {})
+            stats["system"].append(system)
+            stats["batch_size"].append(bs)
+            stats["streams"].append(len(senders))
+            stats["stream"].append(sender["stream"])
+            stats["bytes"].append(sender["bytes"])
+            stats["time"].append(sender["time"])
+            recv_bytes = receiver.get("bytes", float("nan"))
+            recv_time = receiver.get("time", float("nan"))
+            stats["receiver-bytes"].append(recv_bytes)
+            stats["receiver-time"].append(recv_time)
+            stats["receiver-goodput-gbps"].append(
+                recv_bytes * 8 / recv_time / 1e9 if recv_time else float("nan")
+            )
+            stats["aggregate-goodput-gbps"].append(aggregate)
+
 
 def benchmark_nw_test_sgx_lkl(benchmark: Benchmark, stats: Dict[str, List]) -> None:
     extra_env = benchmark.network.setup(NetworkKind.TAP)
@@ -118,11 +179,7 @@ def main() -> None:
         "sgx-io": benchmark_nw_test_sgx_io,
     }
 
-    system = set(stats["system"])
     for name, bench_func in benchmarks.items():
-        if name in system:
-            print(f"skip {name} benchmark")
-            continue
         bench_func(benchmark, stats)
         write_stats("network-test-bs.json", stats)
 
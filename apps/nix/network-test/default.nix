@@ -5,6 +5,6 @@ stdenv.mkDerivation {
   src = ./.;
   installPhase = ''
     mkdir -p $out/bin
-    gcc -o $out/bin/network-test main.c
+    gcc -pthread -o $out/bin/network-test main.c
   '';
 }
@@ -7,13 +7,86 @@
 #include <unistd.h>
 #include <string.h>
 #include <stdlib.h>
+#include <time.h>
 
 //char buf[1 << 16];
 #define MIN(X, Y) (((X) < (Y)) ? (X) : (Y))
 
+struct stream {
+  int id;
+  int read_socket;
+  struct sockaddr_in servaddr;
+  long num_bytes;
+  long batch_size;
+  pthread_t thread;
+};
+
+static pthread_mutex_t output_lock = PTHREAD_MUTEX_INITIALIZER;
+
+static double now(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec / 1e9;
+}
+
+static void *run_stream(void *arg) {
+  struct stream *s = arg;
+  size_t total_sent = 0;
+  double start;
+  struct sockaddr_in local = {};
+  socklen_t local_len = sizeof(local);
+
+  char *buf = (char*) malloc(s->batch_size*sizeof(char));
+  memset(buf, 'a', s->batch_size);
+
+  int fd = socket(AF_INET, SOCK_STREAM, 0);
+  for (;;) {
+    int ret = connect(fd, (struct sockaddr*)&s->servaddr, sizeof(s->servaddr));
+    if (ret != -1) break;
+    perror("connect");
+    usleep(2000000);
+  }
+  // lets the receiver side match its measurement to this stream
+  getsockname(fd, (struct sockaddr*)&local, &local_len);
+
+  start = now();
+
+  while(total_sent < s->num_bytes) {
+    int to_send = MIN(s->batch_size, s->num_bytes - total_sent);
+    int ret;
+    if (s->read_socket) {
+      ret = read(fd, buf, to_send);
+      if (ret <= 0) {
+        perror("read");
+        break;
+      }
+    } else {
+      ret = write(fd, buf, to_send);
+      if (ret == -1) {
+        perror("write");
+        break;
+      }
+    }
+
+    total_sent += ret;
+  }
+
+  double elapsed = now() - start;
+  close(fd);
+
+  pthread_mutex_lock(&output_lock);
+  printf("{\"stream\": %d, \"port\": %d, \"bytes\": %zu, \"time\": %lf}\n",
+         s->id, ntohs(local.sin_port), total_sent, elapsed);
+  fflush(stdout);
+  pthread_mutex_unlock(&output_lock);
+
+  free(buf);
+  return NULL;
+}
+
 int main(int argc, char** argv) {
-  if (argc != 5) {
-    fprintf(stderr, "%s read|write <dotted-address> num_bytes batch_size\n", argv[0]);
+  if (argc != 5 && argc != 6) {
+    fprintf(stderr, "%s read|write <dotted-address> num_bytes batch_size [streams]\n", argv[0]);
     exit(EXIT_FAILURE);
   }
 
@@ -28,56 +101,35 @@ int main(int argc, char** argv) {
 
   long num_bytes = strtol(argv[3], NULL, 10);
   long batch_size = strtol(argv[4], NULL, 10);
-
-  size_t total_sent = 0;
-  clock_t start;
+  int num_streams = argc == 6 ? atoi(argv[5]) : 1;
+  if (num_streams < 1) {
+    fprintf(stderr, "Invalid number of streams\n");
+    exit(EXIT_FAILURE);
+  }
 
   struct sockaddr_in servaddr = {};
   servaddr.sin_family = AF_INET;
   servaddr.sin_addr.s_addr = addr;
   servaddr.sin_port = htons(8888);
 
-  char *buf = (char*) malloc(batch_size*sizeof(char));
-  memset(buf, 'a', batch_size);
-
-  for (;;) {
-    int fd = socket(AF_INET, SOCK_STREAM, 0);
-    for (;;) {
-      int ret = connect(fd, (struct sockaddr*)&servaddr, sizeof(servaddr));
-      if (ret != -1) break;
-      perror("connect");
-      usleep(2000000);
-    }
-
-    start = clock();
-
-    while(total_sent < num_bytes) {
-      int to_send = MIN(batch_size, num_bytes - total_sent);
-      int ret;
-      if (read_socket) {
-        ret = read(fd, buf, to_send);
-        if (ret <= 0) {
-          perror("read");
-          break;
-        }
-      } else {
-        ret = write(fd, buf, to_send);
-        if (ret == -1) {
-          perror("write");
-          break;
-        }
-      }
-
-      total_sent += to_send;
+  // every stream transfers num_bytes on its own connection
+  struct stream *streams = calloc(num_streams, sizeof(*streams));
+  for (int i = 0; i < num_streams; i++) {
+    streams[i].id = i;
+    streams[i].read_socket = read_socket;
+    streams[i].servaddr = servaddr;
+    streams[i].num_bytes = num_bytes;
+    streams[i].batch_size = batch_size;
+    if (pthread_create(&streams[i].thread, NULL, run_stream, &streams[i]) != 0) {
+      perror("pthread_create");
+      exit(EXIT_FAILURE);
     }
-
-    printf("{\"bytes\": %ld, \"time\": %lf}\n", total_sent, ((double)clock() - start)/CLOCKS_PER_SEC);
-    close(fd);
-
-    break;
+  }
+  for (int i = 0; i < num_streams; i++) {
+    pthread_join(streams[i].thread, NULL);
   }
 
-  free(buf);
+  free(streams);
 
   return 0;
 }
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+import argparse
+import getpass
+import json
+import os
+import signal
+import subprocess
+from typing import Dict, List, Optional, Tuple
+import pandas as pd
+
+from helpers import (
+    NOW,
+    create_settings,
+    flamegraph_env,
+    nix_build,
+    read_stats,
+    run,
+    write_stats,
+)
+from storage import Storage, StorageKind
+
+# hdparm-style sequential reads from the raw disk with a known page cache
+# state: `cached` is a second pass over a prewarmed range (hdparm -T),
+# `buffered` reads through an emptied page cache (hdparm -t) and `direct`
+# bypasses the (LKL) page cache with O_DIRECT.
+MODES: Dict[str, Tuple[bool, str]] = {
+    "cached": (False, "warm"),
+    "buffered": (False, "cold"),
+    "direct": (True, "cold"),
+}
+# hdparm reads in 2 MiB chunks
+BATCH_SIZE = 2 * 1024 * 1024
+# the cached range has to fit into the enclave heap
+CACHED_SIZE = int(os.environ.get("PAGE_CACHE_CACHED_SIZE", str(256 * 1024 * 1024)))
+DISK_SIZE = int(os.environ.get("PAGE_CACHE_DISK_SIZE", str(2 * 1024 * 1024 * 1024)))
+
+SYSTEMS = {
+    "native": (StorageKind.NATIVE, "simpleio-native"),
+    "sgx-lkl": (StorageKind.LKL, "simpleio-sgx-lkl"),
+    "sgx-io": (StorageKind.SPDK, "simpleio-sgx-io"),
+}
+
+
+def drop_host_caches() -> None:
+    # simpleio drops the cache of the kernel it runs on, this is the host one
+    run(["sudo", "sh", "-c", "sync; echo 3 > /proc/sys/vm/drop_caches"])
+
+
+def benchmark_read(
+    system: str,
+    attr: str,
+    device: str,
+    stats: Dict[str, List],
+    mode: str,
+    repetition: int,
+    extra_env: Dict[str, str] = {},
+) -> None:
+    direct, cache = MODES[mode]
+    env = dict(SGXLKL_CWD="/")
+    env.update(flamegraph_env(f"page-cache-{system}-{mode}-{NOW}"))
+    env.update(SGXLKL_ENABLE_SGXIO="1" if system == "sgx-io" else "0")
+    env.update(SGXLKL_ETHREADS="1" if system == "sgx-io" else "8")
+    env.update(SGXLKL_HEAP=str(1024 * 1024 * 1024))
+    env.update(extra_env)
+    simpleio = nix_build(attr)
+    stdout: Optional[int] = subprocess.PIPE
+    if os.environ.get("SGXLKL_ENABLE_GDB", "0") == "1":
+        stdout = None
+
+    env_string = []
+    for k, v in env.items():
+        env_string.append(f"{k}={v}")
+    report = ""
+    in_results = False
+    proc_env = os.environ.copy()
+    proc_env.update(env)
+
+    size = CACHED_SIZE if mode == "cached" else DISK_SIZE
+    drop_host_caches()
+    cmd = [
+        simpleio,
+        "bin/simpleio",
+        device,
+        str(size),
+        "1" if direct else "0",
+        "1",
+        str(BATCH_SIZE),
+        cache,
+    ]
+    print(f"$ {' '.join(env_string)} {' '.join(cmd)}")
+    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=proc_env)
+    try:
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            print(f"stdout: {line}", end="")
+            if line == "<result>\n":
+                in_results = True
+            elif in_results and line == "</result>\n":
+                break
+            elif in_results:
+                report = line
+    finally:
+        proc.send_signal(signal.SIGINT)
+        proc.wait()
+    if report == "":
+        raise RuntimeError(f"Did not get a result when running {mode} reads for {system}")
+    jsondata = json.loads(report)
+    stats["system"].append(system)
+    stats["mode"].append(mode)
+    stats["repetition"].append(repetition)
+    stats["bytes"].append(jsondata["bytes"])
+    stats["time"].append(jsondata["time"])
+    stats["read-throughput"].append(jsondata["bytes"] / jsondata["time"] / 1024 / 1024)
+    stats["lat_p50_us"].append(jsondata["lat_p50_us"])
+    stats["lat_p99_us"].append(jsondata["lat_p99_us"])
+    # a cached pass should not reach the disk
+    stats["dev-read-ios"].append(jsondata.get("dev_read_ios"))
+    # the native run is unprivileged, drop_host_caches covers it
+    stats["dropped-caches"].append(jsondata["dropped_caches"])
+
+
+def benchmark_system(
+    storage: Storage, system: str, stats: Dict[str, List], runs: List[Tuple[str, int]]
+) -> None:
+    kind, attr = SYSTEMS[system]
+    mount = storage.setup(kind)
+    # raw disk as hdparm does it, no filesystem (and no luks) involved
+    if kind == StorageKind.NATIVE:
+        run(["sudo", "chown", getpass.getuser(), mount.raw_dev])
+        device = mount.raw_dev
+        extra_env = {}
+    elif kind == StorageKind.LKL:
+        device = "/dev/vdb"
+        extra_env = dict(SGXLKL_HDS=f"{mount.raw_dev}:/mnt/spdk0")
+    else:
+        device = "/dev/spdk0"
+        extra_env = mount.extra_env()
+    for mode, repetition in runs:
+        benchmark_read(system, attr, device, stats, mode, repetition, extra_env=extra_env)
+        write_stats("page-cache.json", stats)
+
+
+def summarize(df: pd.DataFrame) -> pd.DataFrame:
+    """Median throughput per mode and what the page cache gains or costs over O_DIRECT"""
+    summary = df.pivot_table(index="system", columns="mode", values="read-throughput", aggfunc="median")
+    if "direct" in summary.columns:
+        for mode in ["cached", "buffered"]:
+            if mode in summary.columns:
+                summary[f"{mode}-vs-direct"] = summary[mode] / summary["direct"]
+    return summary.reset_index()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Read throughput with a controlled page cache")
+    parser.add_argument("systems", nargs="*", help=f"any of {', '.join(SYSTEMS)} (default: all)")
+    parser.add_argument("--repetitions", type=int, default=5)
+    args = parser.parse_args()
+    unknown = set(args.systems) - set(SYSTEMS)
+    if unknown:
+        parser.error(f"unknown systems: {', '.join(unknown)}")
+
+    stats = read_stats("page-cache.json")
+    storage = Storage(create_settings())
+    done = set(zip(stats["system"], stats["mode"], stats["repetition"]))
+
+    for system in args.systems or SYSTEMS:
+        runs = [
+            (mode, repetition)
+            for repetition in range(args.repetitions)
+            for mode in MODES
+            if (system, mode, repetition) not in done
+        ]
+        if not runs:
+            print(f"skip {system} benchmark")
+            continue
+        benchmark_system(storage, system, stats, runs)
+
+    csv = f"page-cache-{NOW}.tsv"
+    print(csv)
+    df = pd.DataFrame(stats)
+    df.to_csv(csv, index=False, sep="\t")
+    df.to_csv("page-cache-latest.tsv", index=False, sep="\t")
+
+    summary = summarize(df)
+    summary.to_csv(f"page-cache-summary-{NOW}.tsv", index=False, sep="\t")
+    summary.to_csv("page-cache-summary-latest.tsv", index=False, sep="\t")
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
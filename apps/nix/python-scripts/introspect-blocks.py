@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import glob
+import json
 import os
+import sys
+from typing import Any, Dict, List
 
 
 def dump_files(dir_path: str):
@@ -17,7 +20,47 @@ def dump_files(dir_path: str):
                 pass
 
 
+def read_tunable(path: str) -> str:
+    with open(path) as file:
+        value = file.read().strip()
+    # scheduler lists all available schedulers: "[mq-deadline] kyber none"
+    if "[" in value:
+        return value[value.index("[") + 1:value.index("]")]
+    return value
+
+
+def available_schedulers(path: str) -> List[str]:
+    with open(path) as file:
+        return file.read().replace("[", "").replace("]", "").split()
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """
+    Top-level queue tunables of every block device:
+    {"vdb": {"nr_requests": "128", "scheduler": "none", "available_schedulers": ["none"], ...}}
+    """
+    devices: Dict[str, Dict[str, Any]] = {}
+    for queue in sorted(glob.glob("/sys/block/*/queue")):
+        tunables: Dict[str, Any] = {}
+        for tuneable in sorted(os.listdir(queue)):
+            path = os.path.join(queue, tuneable)
+            if os.path.isdir(path):
+                continue
+            try:
+                tunables[tuneable] = read_tunable(path)
+                if tuneable == "scheduler":
+                    tunables["available_schedulers"] = available_schedulers(path)
+            except OSError:
+                pass
+        devices[queue.split("/")[3]] = tunables
+    return devices
+
+
 def main() -> None:
+    if "--json" in sys.argv[1:]:
+        json.dump(snapshot(), sys.stdout, indent=2)
+        print()
+        return
     for queue in glob.glob("/sys/block/*/queue"):
         dump_files(queue)
 
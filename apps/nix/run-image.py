@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 
+import glob
+import json
+import multiprocessing
 import os
+import re
 import shutil
 import signal
 import subprocess
 import sys
 import tempfile
+import time
 from datetime import datetime
-from typing import List, Dict, IO, Iterator, Any
+from collections import Counter, defaultdict, deque
+from typing import List, Deque, Dict, IO, Iterator, Any, Mapping, Optional, Tuple
 from contextlib import contextmanager
 
 NOW = datetime.now().strftime("%Y%m%d-%H%M%S")
@@ -29,6 +35,10 @@ def enable_perf_hw_counters() -> bool:
     return os.environ.get("SGXLKL_ENABLE_PERF_HW_COUNTER", None) is not None
 
 
+def enable_perf_ring() -> bool:
+    return os.environ.get("SGXLKL_ENABLE_PERF_RING", None) is not None
+
+
 def traceshark_cmd(perf_data: str) -> List[str]:
     events = [
         "power:cpu_frequency",
@@ -65,6 +75,17 @@ def traceshark_cmd(perf_data: str) -> List[str]:
 
 def get_debugger(perf_data: str) -> List[str]:
     if os.environ.get("SGXLKL_ENABLE_GDB", None) is not None:
+        emmt_tsv = os.environ.get("SGXLKL_EMMT_TSV", None)
+        if emmt_tsv is not None:
+            interval = os.environ.get("SGXLKL_EMMT_INTERVAL", "1")
+            return [
+                "sgx-lkl-gdb",
+                "-ex", "enable sgx_emmt",
+                "-ex", "set mi-async on",
+                "-ex", f"sgx_emmt_sample {interval} {emmt_tsv}",
+                "-ex", "run&",
+                "--args"
+            ]
         return ["sgx-lkl-gdb", "-ex", "run", "--args"]
     elif os.environ.get("SGXLKL_ENABLE_STRACE", None) is not None:
         return ["strace"]
@@ -88,6 +109,15 @@ def get_debugger(perf_data: str) -> List[str]:
             "LLC-stores"
         ]
         return ["perf", "record", "-e", ",".join(events), "-o", perf_data, "-a", "-g", "-F99", "--"]
+    elif enable_perf_ring():
+        # Low-overhead mode: only follow the started process tree at a low
+        # frequency into a ring buffer that is dumped on SIGUSR2 and on exit
+        freq = os.environ.get("SGXLKL_PERF_RING_FREQ", "49")
+        pages = os.environ.get("SGXLKL_PERF_RING_PAGES", "512")
+        return [
+            "perf", "record", "--overwrite", "--switch-output=signal",
+            "-F", freq, "-g", "-m", pages, "-o", perf_data, "--"
+        ]
     elif enable_flamegraph():
         return ["perf", "record", "-o", perf_data, "-a", "-g", "-F999", "--"]
     elif enable_tracecmd():
@@ -104,36 +134,201 @@ def get_debugger(perf_data: str) -> List[str]:
     return []
 
 
+def _frame_name(frame: str, cache: Dict[str, str]) -> str:
+    name = cache.get(frame)
+    if name is not None:
+        return name
+    # "    ffffffff8100a1b2 do_syscall_64+0x42 ([kernel.kallsyms])"
+    parts = frame.split(None, 1)
+    rest = parts[1] if len(parts) > 1 else ""
+    dso = ""
+    if rest.endswith(")"):
+        idx = rest.rfind(" (")
+        if idx != -1:
+            dso = rest[idx + 2:-1]
+            rest = rest[:idx]
+        elif rest.startswith("("):
+            dso, rest = rest[1:-1], ""
+    sym = re.sub(r"\+0x[0-9a-f]+$", "", rest.strip())
+    if sym == "" or sym == "[unknown]":
+        sym = f"[{os.path.basename(dso)}]" if dso and dso != "[unknown]" else "[unknown]"
+    cache[frame] = sym
+    return sym
+
+
+def collapse_perf_chunk(lines: List[str]) -> Counter:
+    """
+    Fold perf script samples into "comm;caller;...;callee" -> count like
+    stackcollapse-perf.pl does. Chunks must start at a sample boundary.
+    """
+    folded: Counter = Counter()
+    cache: Dict[str, str] = {}
+    comm = None
+    stack: List[str] = []
+    for line in lines + [""]:
+        if line.strip() == "":
+            if comm is not None:
+                stack.reverse()
+                folded[";".join([comm] + stack)] += 1
+            comm = None
+            stack = []
+        elif line[0] in " \t":
+            stack.append(_frame_name(line.strip(), cache))
+        elif comm is None and not line.startswith("#"):
+            # "comm  pid/tid [cpu] time: period event:", comm may contain spaces
+            match = re.match(r"^(.+?)\s+\d+(?:/\d+)?\s", line)
+            comm = (match.group(1) if match else line.split()[0]).replace(" ", "_")
+    return folded
+
+
+PERF_CHUNK_LINES = 100000
+# chunks handed to the pool but not yet folded, bounds memory to a few chunks per worker
+PERF_CHUNKS_IN_FLIGHT = 2 * multiprocessing.cpu_count()
+
+
+def perf_script_chunks(perf_stdout: IO[bytes], script: Optional[IO[bytes]]) -> Iterator[List[str]]:
+    """
+    Tee perf script output to an optional file while splitting it into chunks
+    that end at a sample boundary.
+    """
+    chunk: List[str] = []
+    for raw in perf_stdout:
+        if script is not None:
+            script.write(raw)
+        line = raw.decode("utf-8", "replace").rstrip("\n")
+        chunk.append(line)
+        if len(chunk) >= PERF_CHUNK_LINES and line.strip() == "":
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def post_process_perf(perf_data: str, flamegraph: str) -> None:
+    perf_script = os.environ.get("PERF_SCRIPT_FILENAME", None)
+    if not enable_flamegraph() and perf_script is None:
+        # nobody reads the output, the hardware counters have their own perf script
+        return
     perf = subprocess.Popen(["perf", "script", "-i", perf_data],
                             stdout=subprocess.PIPE)
     assert perf.stdout is not None
-    perf_script = os.environ.get("PERF_SCRIPT_FILENAME", None)
-    perf_stdout = perf.stdout
-    if perf_script is not None:
-        with open(perf_script, "wb") as perf_script_fd:
-            shutil.copyfileobj(perf_stdout, perf_script_fd) # type: ignore
-        perf_stdout = open(perf_script, "rb")
-
-    if not enable_flamegraph():
-        return
-
-    stackcollapse = subprocess.Popen(
-        ["stackcollapse-perf.pl"], stdin=perf_stdout, stdout=subprocess.PIPE
+    script_fd = open(perf_script, "wb") if perf_script is not None else None
+
+    try:
+        if not enable_flamegraph():
+            if script_fd is not None:
+                shutil.copyfileobj(perf.stdout, script_fd)
+            return
+
+        folded: Counter = Counter()
+        with multiprocessing.Pool() as pool:
+            # imap would let the pool's task handler read (and queue) the
+            # whole output, so only read ahead as far as the window allows
+            in_flight: Deque[Any] = deque()
+            for chunk in perf_script_chunks(perf.stdout, script_fd):
+                in_flight.append(pool.apply_async(collapse_perf_chunk, (chunk,)))
+                if len(in_flight) >= PERF_CHUNKS_IN_FLIGHT:
+                    folded.update(in_flight.popleft().get())
+            for result in in_flight:
+                folded.update(result.get())
+    finally:
+        if script_fd is not None:
+            script_fd.close()
+        # perf gets SIGPIPE instead of blocking on a full pipe if we bailed out early
+        perf.stdout.close()
+        perf.wait()
+
+    collapsed = os.environ.get("PERF_COLLAPSED_FILENAME", None)
+    if collapsed is None:
+        collapsed = os.path.splitext(flamegraph)[0] + ".folded"
+    with open(collapsed, "w") as f:
+        for stack, count in sorted(folded.items()):
+            f.write(f"{stack} {count}\n")
+
+    with open(collapsed) as collapsed_fd, open(flamegraph, "w") as f:
+        subprocess.run(["flamegraph.pl"], stdin=collapsed_fd, stdout=f)
+
+
+def parse_hw_counter_sample(line: str) -> Optional[Tuple[str, int, str, str]]:
+    """
+    Split `perf script -F period,event,sym,dso` output, i.e.
+    "   250013 cycles:  do_syscall_64 ([kernel.kallsyms])"
+    """
+    tokens = line.split()
+    event_idx = next((i for i, t in enumerate(tokens) if t.endswith(":")), None)
+    if event_idx is None or event_idx == 0 or not tokens[event_idx - 1].isdigit():
+        return None
+    event = tokens[event_idx][:-1]
+    # perf appends modifiers like cycles:u
+    event = event.split(":")[0]
+    period = int(tokens[event_idx - 1])
+    rest = tokens[event_idx + 1:]
+    dso = "[unknown]"
+    if rest and rest[-1].startswith("(") and rest[-1].endswith(")"):
+        dso = os.path.basename(rest[-1][1:-1]) or rest[-1][1:-1]
+        rest = rest[:-1]
+    sym = " ".join(rest) or "[unknown]"
+    return event, period, dso, sym
+
+
+def hw_counter_metrics(counts: Mapping[str, float]) -> Dict[str, float]:
+    def ratio(a: str, b: str, scale: float = 1.0) -> float:
+        if counts.get(b, 0) == 0:
+            return float("nan")
+        return counts.get(a, 0) * scale / counts[b]
+
+    return {
+        "ipc": ratio("instructions", "cycles"),
+        "llc-mpki": ratio("LLC-load-misses", "instructions", 1000),
+        "dtlb-miss-rate": ratio("dTLB-load-misses", "dTLB-loads"),
+        "l1d-miss-rate": ratio("L1-dcache-load-misses", "L1-dcache-loads"),
+        "cache-miss-rate": ratio("cache-misses", "cache-references"),
+    }
+
+
+def post_process_hw_counters(perf_data: str, tsv: str) -> None:
+    """
+    Sum up sampled event periods in total, per DSO and per symbol and write
+    them together with derived metrics (IPC, LLC MPKI, ...) as TSV.
+    """
+    perf = subprocess.Popen(
+        ["perf", "script", "-i", perf_data, "-F", "period,event,sym,dso", "--hide-call-graph"],
+        stdout=subprocess.PIPE,
+        text=True,
+        errors="replace",
     )
-    with open(flamegraph, "w") as f:
-        flamegraph_proc = subprocess.Popen(
-            ["flamegraph.pl"], stdin=stackcollapse.stdout, stdout=f
-        )
-    flamegraph_proc.communicate()
-    if perf_script is not None:
-        perf_stdout.close()
+    assert perf.stdout is not None
+    groups: Dict[Tuple[str, str, str], Counter] = defaultdict(Counter)
+    events = set()
+    for line in perf.stdout:
+        sample = parse_hw_counter_sample(line)
+        if sample is None:
+            continue
+        event, period, dso, sym = sample
+        events.add(event)
+        groups[("total", "", "")][event] += period
+        groups[("dso", dso, "")][event] += period
+        groups[("symbol", dso, sym)][event] += period
+    perf.wait()
+
+    event_columns = sorted(events)
+    metric_columns = list(hw_counter_metrics({}).keys())
+    with open(tsv, "w") as f:
+        f.write("\t".join(["level", "dso", "symbol"] + event_columns + metric_columns) + "\n")
+        rows = sorted(groups.items(), key=lambda kv: -kv[1].get("cycles", 0))
+        for (level, dso, sym), counts in rows:
+            metrics = hw_counter_metrics(counts)
+            fields = [level, dso, sym]
+            fields += [str(counts.get(e, 0)) for e in event_columns]
+            fields += [f"{metrics[m]:.6g}" for m in metric_columns]
+            f.write("\t".join(fields) + "\n")
+    print(f"wrote {tsv}", file=sys.stderr)
 
 
 @contextmanager
 def debug_mount_env(image: str) -> Iterator[Dict[str, str]]:
     env = os.environ.copy()
-    if image == "NONE" or not (enable_flamegraph() or enable_traceshark() or enable_perf_hw_counters()):
+    if image == "NONE" or not (enable_flamegraph() or enable_traceshark() or enable_perf_hw_counters() or enable_perf_ring()):
         yield env
         return
 
@@ -176,7 +371,54 @@ def run(
 
     signal.signal(signal.SIGINT, stop_proc)
     signal.signal(signal.SIGTERM, stop_proc)
-    proc.wait()
+    if not enable_perf_ring():
+        proc.wait()
+        return
+
+    def dump_ring(signum: Any, frame: Any) -> None:
+        proc.send_signal(signal.SIGUSR2)
+
+    signal.signal(signal.SIGUSR2, dump_ring)
+    start = time.time()
+    perf_cpu_time = 0.0
+    while True:
+        # perf's own cpu time, i.e. excluding the profiled process tree
+        perf_cpu_time = process_cpu_time(proc.pid) or perf_cpu_time
+        try:
+            proc.wait(timeout=0.5)
+            break
+        except subprocess.TimeoutExpired:
+            pass
+    wall_time = time.time() - start
+    ring_stats = os.environ.get("PERF_RING_STATS", None)
+    if ring_stats is not None:
+        with open(ring_stats, "w") as f:
+            json.dump(dict(perf_cpu_time=perf_cpu_time,
+                           wall_time=wall_time,
+                           overhead=perf_cpu_time / wall_time if wall_time else 0.0,
+                           cpus=os.cpu_count()), f)
+
+
+def process_cpu_time(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    # utime and stime are the 14th and 15th field of the stat line
+    ticks = int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def save_perf_ring(perf_data: str) -> None:
+    """Move all ring buffer dumps (perf.data.<timestamp>) out of the tmpdir"""
+    dest = os.environ.get("PERF_RING_FILENAME", None)
+    if dest is None:
+        return
+    for dump in sorted(glob.glob(f"{perf_data}*")):
+        suffix = dump[len(perf_data):]
+        shutil.move(dump, f"{dest}{suffix}")
+        print(f"{dest}{suffix}", file=sys.stderr)
 
 
 def main(args: List[str]) -> None:
@@ -195,6 +437,9 @@ def main(args: List[str]) -> None:
             try:
                 run(sgx_lkl_run, image, debugger, cmd, env, tmpdirname)
             finally:
+                if enable_perf_ring():
+                    save_perf_ring(perf_data)
+                    return
                 if not enable_flamegraph() and not enable_traceshark() and not enable_perf_hw_counters():
                     return
 
@@ -203,6 +448,9 @@ def main(args: List[str]) -> None:
                     flamegraph = os.path.join(tmpdirname,
                                               f"flamegraph-{NOW}.svg")
                 post_process_perf(perf_data, flamegraph)
+                hw_counters = os.environ.get("HW_COUNTERS_FILENAME", None)
+                if enable_perf_hw_counters() and hw_counters is not None:
+                    post_process_hw_counters(perf_data, hw_counters)
                 perf = os.environ.get("PERF_FILENAME", None)
                 if perf is not None:
                     shutil.move(perf_data, perf)
@@ -0,0 +1,59 @@
+import math
+from typing import Dict, Optional
+
+import pandas as pd
+
+
+def usl(n: float, lam: float, sigma: float, kappa: float) -> float:
+    """Universal Scalability Law: throughput at concurrency n"""
+    return lam * n / (1 + sigma * (n - 1) + kappa * n * (n - 1))
+
+
+def fit_usl(points: Dict[int, float]) -> Optional[Dict[str, float]]:
+    """
+    Least-squares fit of the USL to throughput per concurrency level. The
+    model is linear after the transformation n * X(1) / X(n) - 1 =
+    sigma * (n - 1) + kappa * n * (n - 1). Amdahl's law is the kappa = 0 case.
+    """
+    if 1 not in points or len(points) < 3:
+        return None
+    lam = points[1]
+    rows = [(n - 1, n * (n - 1), n * lam / x - 1) for n, x in points.items() if x > 0]
+    saa = sum(a * a for a, _, _ in rows)
+    sab = sum(a * b for a, b, _ in rows)
+    sbb = sum(b * b for _, b, _ in rows)
+    say = sum(a * y for a, _, y in rows)
+    sby = sum(b * y for _, b, y in rows)
+    det = saa * sbb - sab * sab
+    if det == 0:
+        return None
+    sigma = (say * sbb - sby * sab) / det
+    kappa = (saa * sby - sab * say) / det
+
+    mean = sum(points.values()) / len(points)
+    ss_tot = sum((x - mean) ** 2 for x in points.values())
+    ss_res = sum((x - usl(n, lam, sigma, kappa)) ** 2 for n, x in points.items())
+    if kappa > 0 and sigma < 1:
+        peak = math.sqrt((1 - sigma) / kappa)
+    else:
+        peak = math.inf
+    return {
+        "lambda": lam,
+        "sigma": sigma,
+        "kappa": kappa,
+        "amdahl_sigma": say / saa,
+        "peak_concurrency": peak,
+        "r2": 1 - ss_res / ss_tot if ss_tot else 1.0,
+    }
+
+
+def throughput(df: pd.DataFrame) -> pd.DataFrame:
+    """Summed read+write bandwidth (KiB/s) per system, ethreads and numjobs"""
+    df = df.assign(bw=df["read-bw"] + df["write-bw"])
+    return df.groupby(["system", "ethreads", "numjobs"], as_index=False).agg(
+        bw=("bw", "sum"),
+        bw_per_job=("bw", "mean"),
+        usr_cpu=("usr_cpu", "sum"),
+        sys_cpu=("sys_cpu", "sum"),
+        host_cpu_time=("host-cpu-time", "first"),
+    )
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+import argparse
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import DefaultDict, Dict, IO, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+
+# perf script:
+#   sgx-lkl-run  1234 [002]  1234.567890: sched:sched_switch: prev_comm=...
+# trace-cmd report:
+#   sgx-lkl-run-1234  [002] d..2  1234.567890: sched_switch: prev_comm=...
+EVENT_LINE = re.compile(
+    r"^\s*(?P<comm>.+?)[-\s]+(?P<pid>\d+)(?:/\d+)?\s+\[(?P<cpu>\d+)\]\s+"
+    r"(?:[\w.]{4,}\s+)?(?P<ts>\d+\.\d+):\s+(?:\d+\s+)?(?P<event>[\w:]+):\s*(?P<args>.*)$"
+)
+EVENT_ARG = re.compile(r"(\w+)=(.*?)(?=\s+\w+=|\s+==>|$)")
+# cpu_idle reports this state when a CPU leaves idle
+PWR_EVENT_EXIT = 4294967295
+
+
+@dataclass
+class ThreadStats:
+    comm: str
+    run_time: float = 0.0
+    wait_time: float = 0.0
+    switches: int = 0
+    preemptions: int = 0
+    migrations: int = 0
+    wakeups: int = 0
+    wakeup_latencies: List[float] = field(default_factory=list)
+    cpus: Dict[int, float] = field(default_factory=lambda: defaultdict(float))
+    # timestamp when the thread got on a cpu or became runnable
+    running_since: Optional[float] = None
+    runnable_since: Optional[float] = None
+    woken_at: Optional[float] = None
+
+
+class SchedAnalyzer:
+    def __init__(self) -> None:
+        self.threads: Dict[int, ThreadStats] = {}
+        self.first_ts: Optional[float] = None
+        self.last_ts = 0.0
+        # cpu -> (frequency, since)
+        self.cpu_freq: Dict[int, Tuple[int, float]] = {}
+        self.freq_residency: DefaultDict[Tuple[int, int], float] = defaultdict(float)
+        self.idle_since: Dict[int, float] = {}
+        self.idle_time: DefaultDict[int, float] = defaultdict(float)
+        self.cpus: Set[int] = set()
+
+    def thread(self, pid: int, comm: str) -> ThreadStats:
+        t = self.threads.get(pid)
+        if t is None:
+            t = ThreadStats(comm=comm)
+            self.threads[pid] = t
+        return t
+
+    def feed(self, line: str) -> None:
+        match = EVENT_LINE.match(line)
+        if not match:
+            return
+        ts = float(match.group("ts"))
+        cpu = int(match.group("cpu"))
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+        self.cpus.add(cpu)
+        event = match.group("event").split(":")[-1]
+        handler = getattr(self, f"on_{event}", None)
+        if handler is None:
+            return
+        args = dict(EVENT_ARG.findall(match.group("args")))
+        handler(ts, cpu, args)
+
+    def on_sched_switch(self, ts: float, cpu: int, args: Dict[str, str]) -> None:
+        prev_pid = int(args["prev_pid"])
+        next_pid = int(args["next_pid"])
+        if prev_pid != 0:
+            prev = self.thread(prev_pid, args["prev_comm"])
+            if prev.running_since is not None:
+                prev.run_time += ts - prev.running_since
+                prev.cpus[cpu] += ts - prev.running_since
+            prev.running_since = None
+            prev.switches += 1
+            if args.get("prev_state", "").startswith("R"):
+                prev.preemptions += 1
+                prev.runnable_since = ts
+        if next_pid != 0:
+            nxt = self.thread(next_pid, args["next_comm"])
+            if nxt.runnable_since is not None:
+                nxt.wait_time += ts - nxt.runnable_since
+                nxt.runnable_since = None
+            if nxt.woken_at is not None:
+                nxt.wakeup_latencies.append(ts - nxt.woken_at)
+                nxt.woken_at = None
+            nxt.running_since = ts
+
+    def on_sched_wakeup(self, ts: float, cpu: int, args: Dict[str, str]) -> None:
+        pid = int(args["pid"])
+        t = self.thread(pid, args.get("comm", ""))
+        if t.running_since is not None:
+            return
+        t.wakeups += 1
+        t.woken_at = ts
+        t.runnable_since = ts
+
+    on_sched_wakeup_new = on_sched_wakeup
+
+    def on_sched_migrate_task(self, ts: float, cpu: int, args: Dict[str, str]) -> None:
+        self.thread(int(args["pid"]), args.get("comm", "")).migrations += 1
+
+    def on_cpu_frequency(self, ts: float, cpu: int, args: Dict[str, str]) -> None:
+        cpu_id = int(args["cpu_id"])
+        old = self.cpu_freq.get(cpu_id)
+        if old is not None:
+            self.freq_residency[(cpu_id, old[0])] += ts - old[1]
+        self.cpu_freq[cpu_id] = (int(args["state"]), ts)
+
+    def on_cpu_idle(self, ts: float, cpu: int, args: Dict[str, str]) -> None:
+        cpu_id = int(args["cpu_id"])
+        if int(args["state"]) == PWR_EVENT_EXIT:
+            since = self.idle_since.pop(cpu_id, None)
+            if since is not None:
+                self.idle_time[cpu_id] += ts - since
+        else:
+            self.idle_since.setdefault(cpu_id, ts)
+
+    def finish(self) -> None:
+        for t in self.threads.values():
+            if t.running_since is not None:
+                t.run_time += self.last_ts - t.running_since
+                t.running_since = None
+        for cpu_id, (freq, since) in self.cpu_freq.items():
+            self.freq_residency[(cpu_id, freq)] += self.last_ts - since
+
+    @property
+    def duration(self) -> float:
+        if self.first_ts is None:
+            return 0.0
+        return self.last_ts - self.first_ts
+
+    def threads_df(self) -> pd.DataFrame:
+        stats: DefaultDict[str, List] = defaultdict(list)
+        duration = self.duration or 1.0
+        for pid, t in self.threads.items():
+            lat = pd.Series(t.wakeup_latencies, dtype=float) * 1e6
+            stats["pid"].append(pid)
+            stats["comm"].append(t.comm)
+            stats["run_time"].append(t.run_time)
+            stats["wait_time"].append(t.wait_time)
+            stats["utilization"].append(t.run_time / duration)
+            stats["switches"].append(t.switches)
+            stats["preemptions"].append(t.preemptions)
+            stats["migrations"].append(t.migrations)
+            stats["cpus"].append(len(t.cpus))
+            stats["wakeups"].append(t.wakeups)
+            stats["wakeup_latency_avg_us"].append(lat.mean())
+            stats["wakeup_latency_p50_us"].append(lat.quantile(0.5))
+            stats["wakeup_latency_p99_us"].append(lat.quantile(0.99))
+            stats["wakeup_latency_max_us"].append(lat.max())
+        return pd.DataFrame(stats).sort_values("run_time", ascending=False)
+
+    def comms_df(self, threads: pd.DataFrame) -> pd.DataFrame:
+        df = threads.groupby("comm").agg(
+            threads=("pid", "count"),
+            run_time=("run_time", "sum"),
+            wait_time=("wait_time", "sum"),
+            utilization=("utilization", "sum"),
+            migrations=("migrations", "sum"),
+            wakeups=("wakeups", "sum"),
+        )
+        # share of all cpus
+        df["cpu_share"] = df["utilization"] / max(len(self.cpus), 1)
+        return df.sort_values("run_time", ascending=False).reset_index()
+
+    def frequency_df(self) -> pd.DataFrame:
+        stats: DefaultDict[str, List] = defaultdict(list)
+        for (cpu, freq), time in sorted(self.freq_residency.items()):
+            stats["cpu"].append(cpu)
+            stats["frequency_khz"].append(freq)
+            stats["time"].append(time)
+            stats["residency"].append(time / (self.duration or 1.0))
+        return pd.DataFrame(stats)
+
+    def idle_df(self) -> pd.DataFrame:
+        duration = self.duration or 1.0
+        return pd.DataFrame(
+            dict(
+                cpu=sorted(self.cpus),
+                idle_time=[self.idle_time[c] for c in sorted(self.cpus)],
+                idle_share=[self.idle_time[c] / duration for c in sorted(self.cpus)],
+            )
+        )
+
+
+@contextmanager
+def open_trace(path: str) -> Iterator[IO[str]]:
+    """Stream the textual trace, converting perf.data/trace.dat on the fly"""
+    if path == "-":
+        yield sys.stdin
+        return
+    cmd: Optional[List[str]] = None
+    if path.endswith("perf.data"):
+        cmd = ["perf", "script", "-i", path, "--hide-call-graph"]
+    elif path.endswith(".dat"):
+        cmd = ["trace-cmd", "report", "-i", path]
+    if cmd is None:
+        with open(path, errors="replace") as f:
+            yield f
+        return
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, errors="replace")
+    assert proc.stdout is not None
+    try:
+        yield proc.stdout
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def plot(prefix: str, comms: pd.DataFrame, freq: pd.DataFrame, top: int) -> None:
+    from plot import catplot, plt
+
+    g = catplot(
+        data=comms.head(top),
+        y="comm",
+        x="utilization",
+        kind="bar",
+        height=2.5,
+        aspect=1.5,
+        color="grey",
+    )
+    g.ax.set_xlabel("Utilization [CPUs]")
+    g.ax.set_ylabel("")
+    g.savefig(f"{prefix}-utilization.pdf")
+    print(f"{prefix}-utilization.pdf")
+    plt.close("all")
+
+    if freq.empty:
+        return
+    residency = freq.groupby("frequency_khz")["time"].sum().reset_index()
+    residency["frequency_mhz"] = residency["frequency_khz"] // 1000
+    g = catplot(
+        data=residency,
+        x="frequency_mhz",
+        y="time",
+        kind="bar",
+        height=2.5,
+        color="grey",
+    )
+    g.ax.set_xlabel("Frequency [MHz]")
+    g.ax.set_ylabel("Residency [s]")
+    g.savefig(f"{prefix}-frequency.pdf")
+    print(f"{prefix}-frequency.pdf")
+    plt.close("all")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Scheduler statistics from traceshark/trace-cmd captures"
+    )
+    parser.add_argument(
+        "trace", help="perf.data, trace.dat, textual perf script/trace-cmd report output or -"
+    )
+    parser.add_argument("--output", default="sched", help="prefix of generated files")
+    parser.add_argument("--top", type=int, default=15, help="threads/comms to print and plot")
+    parser.add_argument("--no-plot", action="store_true", help="only write TSV files")
+    args = parser.parse_args()
+
+    analyzer = SchedAnalyzer()
+    with open_trace(args.trace) as trace:
+        for line in trace:
+            analyzer.feed(line)
+    analyzer.finish()
+    if not analyzer.threads:
+        print(f"no sched events in {args.trace}", file=sys.stderr)
+        sys.exit(1)
+
+    threads = analyzer.threads_df()
+    comms = analyzer.comms_df(threads)
+    freq = analyzer.frequency_df()
+    idle = analyzer.idle_df()
+    for name, df in [("threads", threads), ("comms", comms), ("frequency", freq), ("idle", idle)]:
+        tsv = f"{args.output}-{name}.tsv"
+        df.to_csv(tsv, index=False, sep="\t")
+        print(tsv)
+
+    print(f"trace duration: {analyzer.duration:.3f}s, cpus: {len(analyzer.cpus)}")
+    print(comms.head(args.top).to_string(index=False))
+    print(threads.head(args.top).to_string(index=False))
+    if not args.no_plot:
+        plot(args.output, comms, freq, args.top)
+
+
+if __name__ == "__main__":
+    main()
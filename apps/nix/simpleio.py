@@ -1,7 +1,8 @@
+import argparse
 import os
 import json
-import sys
 import signal
+from dataclasses import dataclass, replace
 from typing import Dict, List, Optional
 import subprocess
 import pandas as pd
@@ -18,19 +19,31 @@ from helpers import (
 from storage import Storage, StorageKind
 
 
+@dataclass(frozen=True)
+class Run:
+    # batch size in kilobytes
+    bs: int
+    direct: bool = True
+    write: bool = False
+    repetition: int = 0
+    # write runs that only lay out the file for a pending read are not recorded again
+    record: bool = True
+
+    @property
+    def workload(self) -> str:
+        return "write" if self.write else "read"
+
+
 def benchmark_simpleio(
-    storage: Storage,
     system: str,
     attr: str,
     directory: str,
     stats: Dict[str, List],
-    bs: int,
+    run: Run,
     extra_env: Dict[str, str] = {},
-    do_write: bool = False,
 ) -> None:
     env = dict(SGXLKL_CWD=directory)
     env.update(flamegraph_env(f"simpleio-{system}-{NOW}"))
-    env.update(extra_env)
     enable_sgxio = "1" if system == "sgx-io" else "0"
     env.update(SGXLKL_ENABLE_SGXIO=enable_sgxio)
     threads = "1" if system == "sgx-io" else "8"
@@ -41,28 +54,27 @@ def benchmark_simpleio(
     if os.environ.get("SGXLKL_ENABLE_GDB", "0") == "1":
         stdout = None
 
-    size = str(10 * 1024 * 1024 * 1024)  # 10G
-
+    size = os.environ.get("SIMPLEIO_SIZE", str(10 * 1024 * 1024 * 1024))  # 10G
 
     env_string = []
     for k, v in env.items():
         env_string.append(f"{k}={v}")
     report = ""
     in_results = False
-    env = os.environ.copy()
-    env.update(extra_env)
+    proc_env = os.environ.copy()
+    proc_env.update(env)
 
     cmd = [
         simpleio,
         "bin/simpleio",
         f"{directory}/file",
         size,
-        "0" if do_write else "1",
-        "1",
-        str(bs * 1024),
+        "1" if run.direct else "0",
+        "0" if run.write else "1",
+        str(run.bs * 1024),
     ]
     print(f"$ {' '.join(env_string)} {' '.join(cmd)}")
-    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
+    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=proc_env)
     try:
         assert proc.stdout is not None
         for line in proc.stdout:
@@ -75,76 +87,125 @@ def benchmark_simpleio(
                 report = line
     finally:
         proc.send_signal(signal.SIGINT)
+        proc.wait()
     jsondata = json.loads(report)
+    if not run.record:
+        return
     stats["system"].append(system)
     stats["bytes"].append(jsondata["bytes"])
     stats["time"].append(jsondata["time"])
-    stats["workload"].append("write" if do_write else "read")
-    stats["batch-size"].append(bs)
+    stats["workload"].append(run.workload)
+    stats["batch-size"].append(run.bs)
+    stats["direct"].append(int(run.direct))
+    stats["repetition"].append(run.repetition)
+    stats["ops"].append(jsondata["ops"])
+    stats["throughput-mib"].append(jsondata["bytes"] / jsondata["time"] / 1024 / 1024)
+    for metric in ["lat_avg_us", "lat_p50_us", "lat_p99_us", "lat_max_us"]:
+        stats[metric].append(jsondata[metric])
+    # requests that reached the block device; for sgx-io these are spdk submissions
+    ios = jsondata.get("dev_write_ios" if run.write else "dev_read_ios")
+    stats["dev-ios"].append(ios)
+    stats["submissions-per-op"].append(ios / jsondata["ops"] if ios is not None and jsondata["ops"] else None)
+
+
+def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], runs: List[Run]) -> None:
+    mount = storage.setup(StorageKind.SPDK)
 
+    with mount as mnt:
+        for run in runs:
+            benchmark_simpleio(
+                "sgx-io", "simpleio-sgx-io", mnt, stats, run, extra_env=mount.extra_env()
+            )
+            write_stats("simpleio-stats.json", stats)
 
-def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], bs:int) -> None:
-    mount = storage.setup(StorageKind.SPDK)
+
+def benchmark_sgx_lkl(storage: Storage, stats: Dict[str, List], runs: List[Run]) -> None:
+    mount = storage.setup(StorageKind.LKL)
 
     with mount as mnt:
-        benchmark_simpleio(
-            storage, "sgx-io", "simpleio-sgx-io", mnt, stats, bs, extra_env=mount.extra_env()
-        )
-
-
-#def benchmark_sgx_lkl(storage: Storage, stats: Dict[str, List]) -> None:
-#    mount = storage.setup(StorageKind.LKL)
-#
-#    with mount as mnt:
-#        benchmark_simpleio(
-#            storage,
-#            "sgx-lkl",
-#            "simpleio-sgx-lkl",
-#            mnt,
-#            stats,
-#            extra_env=mount.extra_env(),
-#        )
-#
-#
-#def benchmark_scone(storage: Storage, stats: Dict[str, List]) -> None:
-#    with storage.setup(StorageKind.NATIVE) as mnt:
-#        benchmark_simpleio(storage, "scone", "simpleio-scone", mnt, stats, extra_env=scone_env(mnt))
-#
-#
-#def benchmark_native(storage: Storage, stats: Dict[str, List]) -> None:
-#    with storage.setup(StorageKind.NATIVE) as mnt:
-#        benchmark_simpleio(storage, "native", "simpleio-native", mnt, stats)
+        for run in runs:
+            benchmark_simpleio(
+                "sgx-lkl", "simpleio-sgx-lkl", mnt, stats, run, extra_env=mount.extra_env()
+            )
+            write_stats("simpleio-stats.json", stats)
+
+
+def benchmark_scone(storage: Storage, stats: Dict[str, List], runs: List[Run]) -> None:
+    mount = storage.setup(StorageKind.SCONE)
+
+    with mount as mnt:
+        extra_env = scone_env(mnt)
+        extra_env.update(mount.extra_env())
+        for run in runs:
+            benchmark_simpleio("scone", "simpleio-scone", mnt, stats, run, extra_env=extra_env)
+            write_stats("simpleio-stats.json", stats)
+
+
+def benchmark_native(storage: Storage, stats: Dict[str, List], runs: List[Run]) -> None:
+    mount = storage.setup(StorageKind.NATIVE)
+
+    with mount as mnt:
+        for run in runs:
+            benchmark_simpleio("native", "simpleio-native", mnt, stats, run, extra_env=mount.extra_env())
+            write_stats("simpleio-stats.json", stats)
 
 
 BENCHMARKS = {
-    #"native": benchmark_native,
+    "native": benchmark_native,
     "sgx-io": benchmark_sgx_io,
-    #"scone": benchmark_scone,
-    #"sgx-lkl": benchmark_sgx_lkl,
+    "scone": benchmark_scone,
+    "sgx-lkl": benchmark_sgx_lkl,
 }
 
 
+def sweep_runs(repetitions: int) -> List[Run]:
+    runs = []
+    # 4 KiB - 4 MiB
+    for bs in [4, 16, 64, 256, 1024, 4096]:
+        for direct in [True, False]:
+            for repetition in range(repetitions):
+                # the read run uses the file left behind by the write run
+                for write in [True, False]:
+                    runs.append(Run(bs=bs, direct=direct, write=write, repetition=repetition))
+    return runs
+
+
 def main() -> None:
-    if len(sys.argv) <= 1:
-        benchmarks = BENCHMARKS
+    parser = argparse.ArgumentParser()
+    parser.add_argument("systems", nargs="*", help=f"any of {', '.join(BENCHMARKS)} (default: sgx-io)")
+    parser.add_argument("--sweep", action="store_true", help="block size x direct/buffered x read/write")
+    parser.add_argument("--repetitions", type=int, default=3)
+    args = parser.parse_args()
+    unknown = set(args.systems) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown systems: {', '.join(unknown)}")
+
+    if args.sweep:
+        runs = sweep_runs(args.repetitions)
     else:
-        benchmarks = {k: BENCHMARKS[k] for k in (sys.argv[1:])}
+        # batch sizes in kilobytes
+        runs = [Run(bs=bs) for bs in [4, 8, 16, 32, 64, 128, 256, 512]]
 
     stats = read_stats("simpleio-stats.json")
     storage = Storage(create_settings())
-    system = set(stats["system"])
-
-    # batch sizes in kilobytes
-    batch_sizes = [4, 8, 16, 32, 64, 128, 256, 512]
-    #batch_sizes = [128]
-
-    for bs in batch_sizes:
-        for name, benchmark in benchmarks.items():
-            if name in system and len(sys.argv) <= 1:
-                print(f"skip {name} benchmark")
-                continue
-            benchmark(storage, stats, bs)
-            write_stats("simpleio-stats.json", stats)
+    done = set(
+        zip(stats["system"], stats["batch-size"], stats["direct"], stats["workload"], stats["repetition"])
+    )
+
+    for name in args.systems or ["sgx-io"]:
+        def pending(r: Run) -> bool:
+            return (name, r.bs, int(r.direct), r.workload, r.repetition) not in done
+
+        # the disk is reformatted per system, so reads need their write run again
+        todo = [
+            r if pending(r) else replace(r, record=False)
+            for r in runs
+            if pending(r) or (r.write and pending(replace(r, write=False)))
+        ]
+        if not todo:
+            print(f"skip {name} benchmark")
+            continue
+        BENCHMARKS[name](storage, stats, todo)
 
     csv = f"simpleio-{NOW}.tsv"
     print(csv)
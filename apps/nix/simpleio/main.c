@@ -8,7 +8,11 @@
 #include <string.h>
 #include <time.h>
 #include <stdint.h>
+#include <sys/ioctl.h>
 #include <sys/mman.h>
+#include <sys/mount.h>
+#include <sys/stat.h>
+#include <sys/sysmacros.h>
 #include <errno.h>
 
 
@@ -18,23 +22,133 @@
 #define PAGE_ALIGN_DOWN(x) (((size_t)(x)) & PAGE_MASK)
 #define BUF_SIZE (getpagesize() * 128U)
 
+// Per-op latency histogram: 16 linear sub-buckets per power of two (~6% error)
+#define LAT_SUB_BITS 4
+#define LAT_SUB_MASK ((1U << LAT_SUB_BITS) - 1)
+#define LAT_BUCKETS (64U << LAT_SUB_BITS)
+
+static uint64_t lat_hist[LAT_BUCKETS];
+
+static unsigned lat_bucket(uint64_t ns) {
+  if (ns <= LAT_SUB_MASK) {
+    return ns;
+  }
+  unsigned shift = 63 - __builtin_clzll(ns) - LAT_SUB_BITS;
+  return ((shift + 1) << LAT_SUB_BITS) + ((ns >> shift) & LAT_SUB_MASK);
+}
+
+static uint64_t lat_value(unsigned bucket) {
+  if (bucket <= LAT_SUB_MASK) {
+    return bucket;
+  }
+  unsigned shift = (bucket >> LAT_SUB_BITS) - 1;
+  return ((uint64_t)(LAT_SUB_MASK + 1) | (bucket & LAT_SUB_MASK)) << shift;
+}
+
+static double lat_percentile(uint64_t ops, double p) {
+  uint64_t rank = (uint64_t)(p * ops), seen = 0;
+  for (unsigned b = 0; b < LAT_BUCKETS; b++) {
+    seen += lat_hist[b];
+    if (seen > rank) {
+      return lat_value(b) / 1000.0;
+    }
+  }
+  return 0;
+}
+
+static uint64_t now_ns(void) {
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (uint64_t)ts.tv_sec * 1000000000ULL + ts.tv_nsec;
+}
+
+// Completed I/O requests of the block device backing `fd`, i.e. the number
+// of SPDK submissions for sgx-io. Returns -1 if the device has no stat file.
+struct dev_stat {
+  long long read_ios, read_sectors, write_ios, write_sectors;
+};
+
+static int read_dev_stat(int fd, struct dev_stat *st) {
+  struct stat sb;
+  char path[64];
+  if (fstat(fd, &sb) < 0) {
+    return -1;
+  }
+  dev_t dev = S_ISBLK(sb.st_mode) ? sb.st_rdev : sb.st_dev;
+  snprintf(path, sizeof(path), "/sys/dev/block/%u:%u/stat", major(dev), minor(dev));
+  FILE *f = fopen(path, "r");
+  if (!f) {
+    return -1;
+  }
+  long long read_merges, read_ticks, write_merges;
+  int n = fscanf(f, "%lld %lld %lld %lld %lld %lld %lld",
+                 &st->read_ios, &read_merges, &st->read_sectors, &read_ticks,
+                 &st->write_ios, &write_merges, &st->write_sectors);
+  fclose(f);
+  return n == 7 ? 0 : -1;
+}
+
+// Empties the page cache of the kernel we run on, i.e. the LKL one inside
+// the enclave. Returns 0 if any of the two ways worked.
+static int drop_caches(int fd) {
+  struct stat sb;
+  int ret = -1;
+  sync();
+  // what hdparm -t does before reading
+  if (fstat(fd, &sb) == 0 && S_ISBLK(sb.st_mode) && ioctl(fd, BLKFLSBUF, 0) == 0) {
+    ret = 0;
+  }
+  int proc_fd = open("/proc/sys/vm/drop_caches", O_WRONLY);
+  if (proc_fd >= 0) {
+    if (write(proc_fd, "3\n", 2) == 2) {
+      ret = 0;
+    }
+    close(proc_fd);
+  }
+  if (ret < 0) {
+    perror("drop_caches");
+  }
+  return ret;
+}
+
+// Reads the range once, so that the measured pass hits the page cache.
+static int prewarm(int fd, char *buf, long batch_size, size_t bytes) {
+  size_t total = 0;
+  while (total < bytes) {
+    ssize_t n = read(fd, buf, MIN(batch_size, bytes - total));
+    if (n < 0) {
+      perror("read");
+      return -1;
+    } else if (n == 0) {
+      break;
+    }
+    total += n;
+  }
+  return lseek(fd, 0, SEEK_SET) < 0 ? -1 : 0;
+}
+
 int main(int argc, char** argv) {
-  clock_t start, end, last_print;
+  uint64_t start, end, op_start, op_time, lat_sum = 0, lat_max = 0;
+  struct dev_stat dev_before, dev_after;
+  int has_dev_stat;
   size_t bytes;
-  size_t total_written = 0, written_since_print = 0;
+  size_t total_written = 0;
   int direct_io = 0;
   void *buf = NULL;
-  int flags = O_TRUNC|O_CREAT;
+  int flags = O_CREAT;
   int fd = 0;
   unsigned i = 0;
   unsigned do_read = 0;
+  int dropped_caches = 0;
   long batch_size = 0;
 
   // batch_size in KiB
   if (argc < 6) {
-    fprintf(stderr, "USAGE: %s file bytes direct_io read batch_size\n", argv[0]);
+    fprintf(stderr, "USAGE: %s file bytes direct_io read batch_size [cold|warm]\n", argv[0]);
     return 1;
   }
+  // cold: drop the page cache before, warm: read everything once before
+  const char *cache = argc > 6 ? argv[6] : "none";
 
   bytes = PAGE_ALIGN_DOWN(atoll(argv[2]));
 
@@ -77,9 +191,10 @@ int main(int argc, char** argv) {
     flags |= O_DIRECT;
   }
   if (do_read) {
+    // keep data of a previous write run, so reads hit the device and not holes
     flags |= O_RDWR;
   } else {
-    flags |= O_WRONLY;
+    flags |= O_WRONLY|O_TRUNC;
   }
   fd = open(argv[1], flags, 0755);
   if (fd < 0) {
@@ -87,22 +202,38 @@ int main(int argc, char** argv) {
     return 1;
   }
   if (do_read) {
-    if (ftruncate(fd, bytes) < 0) {
+    struct stat sb;
+    if (fstat(fd, &sb) < 0) {
+      perror("fstat");
+      return 1;
+    }
+    // block devices, e.g. /dev/mapper/spdk0, are read as they are
+    if (S_ISREG(sb.st_mode) && (size_t)sb.st_size < bytes && ftruncate(fd, bytes) < 0) {
       perror("ftruncate");
       return 1;
     }
   }
+  if (strcmp(cache, "cold") == 0) {
+    dropped_caches = drop_caches(fd) == 0;
+  } else if (strcmp(cache, "warm") == 0 && prewarm(fd, buf, batch_size, bytes) < 0) {
+    return 1;
+  }
   memset(buf, 'a', batch_size);
-  start = clock();
-  last_print = start;
+  has_dev_stat = read_dev_stat(fd, &dev_before) == 0;
+  // lets the caller attach profilers for just the transfer
+  printf("<start>\n");
+  fflush(stdout);
+  start = now_ns();
   while (total_written < bytes) {
     int to_write = MIN(batch_size, bytes - total_written);
     ssize_t written;
+    op_start = now_ns();
     if (do_read) {
       written = read(fd, buf, to_write);
     } else {
       written = write(fd, buf, to_write);
     }
+    op_time = now_ns() - op_start;
 
     if (written == -1) {
       perror("write");
@@ -117,30 +248,41 @@ int main(int argc, char** argv) {
       break;
     }
     i++;
-    if (i % 100 == 0) {
-      clock_t current = clock();
-      //fprintf(stderr, "[%.2lf%%] Throughput: %lf MiB / s\n",
-      //       ((double)total_written/bytes * 100), (written_since_print / 1024 / 1024) / (((double) (current - last_print)) / CLOCKS_PER_SEC));
-      written_since_print = 0;
-      last_print = current;
+    lat_hist[lat_bucket(op_time)]++;
+    lat_sum += op_time;
+    if (op_time > lat_max) {
+      lat_max = op_time;
     }
     total_written += written;
-    written_since_print += written;
   }
   fprintf(stderr, "fsync()\n");
   fsync(fd);
-  close(fd);
   if (direct_io) {
     munmap(buf, batch_size);
   } else {
     free(buf);
   }
-  end = clock();
+  end = now_ns();
+  if (has_dev_stat) {
+    has_dev_stat = read_dev_stat(fd, &dev_after) == 0;
+  }
+  close(fd);
 
-  fprintf(stderr, "Throughput: %lf MiB / s\n",
-         (total_written / 1024 / 1024) / (((double) (end - start)) / CLOCKS_PER_SEC));
+  double seconds = (end - start) / 1e9;
+  fprintf(stderr, "Throughput: %lf MiB / s\n", (total_written / 1024.0 / 1024.0) / seconds);
   printf("<result>\n");
-  printf("{\"bytes\": %ld, \"time\": %lf}\n", total_written, ((double)(end - start))/CLOCKS_PER_SEC);
+  printf("{\"bytes\": %zu, \"time\": %lf, \"ops\": %u, "
+         "\"lat_avg_us\": %lf, \"lat_p50_us\": %lf, \"lat_p99_us\": %lf, \"lat_max_us\": %lf",
+         total_written, seconds, i,
+         i ? lat_sum / 1000.0 / i : 0, lat_percentile(i, 0.5), lat_percentile(i, 0.99), lat_max / 1000.0);
+  if (has_dev_stat) {
+    printf(", \"dev_read_ios\": %lld, \"dev_write_ios\": %lld, "
+           "\"dev_read_sectors\": %lld, \"dev_write_sectors\": %lld",
+           dev_after.read_ios - dev_before.read_ios, dev_after.write_ios - dev_before.write_ios,
+           dev_after.read_sectors - dev_before.read_sectors,
+           dev_after.write_sectors - dev_before.write_sectors);
+  }
+  printf(", \"cache\": \"%s\", \"dropped_caches\": %d}\n", cache, dropped_caches);
   printf("</result>\n");
   fflush(stdout);
   return 0;
@@ -6,22 +6,36 @@
 #include <unistd.h>
 #include <arpa/inet.h>
 #include <sys/socket.h>
+#include <sys/uio.h>
 
 struct thread_ctx {
   pthread_t id;
   int socket;
   int packets;
   int size;
+  int use_sendmsg;
   struct sockaddr_in addr;
 };
 char buf[1472];
 
 void *send_thread(void *_args) {
   struct thread_ctx *ctx = (struct thread_ctx*)_args;
+  struct iovec iov = { .iov_base = buf, .iov_len = ctx->size };
+  struct msghdr msg = {
+    .msg_name = &ctx->addr,
+    .msg_namelen = sizeof(ctx->addr),
+    .msg_iov = &iov,
+    .msg_iovlen = 1,
+  };
   for (unsigned i = 0; i < ctx->packets; i++) {
-    int res = sendto(ctx->socket, buf, ctx->size, 0, (struct sockaddr *) &ctx->addr, sizeof(ctx->addr));
+    int res;
+    if (ctx->use_sendmsg) {
+      res = sendmsg(ctx->socket, &msg, 0);
+    } else {
+      res = sendto(ctx->socket, buf, ctx->size, 0, (struct sockaddr *) &ctx->addr, sizeof(ctx->addr));
+    }
     if (res == -1) {
-      perror("sendto()");
+      perror(ctx->use_sendmsg ? "sendmsg()" : "sendto()");
       break;
     }
   }
@@ -29,14 +43,21 @@ void *send_thread(void *_args) {
 }
 
 int main(int argc, char** argv) {
-  if (argc < 2) {
-    fprintf(stderr, "USAGE: %s host packets", argv[0]);
+  if (argc < 3) {
+    fprintf(stderr, "USAGE: %s host packets [sendto|sendmsg]\n", argv[0]);
     return 1;
   }
   #define PTHREAD_NUM 8
   struct thread_ctx contexts[PTHREAD_NUM] = {};
   char *host = argv[1];
   int packets = atoi(argv[2]);
+  // both carry the destination, so the sockets stay unconnected
+  if (argc > 3 && strcmp(argv[3], "sendmsg") == 0) {
+    contexts[0].use_sendmsg = 1;
+  } else if (argc > 3 && strcmp(argv[3], "sendto") != 0) {
+    fprintf(stderr, "unsupported syscall: %s\n", argv[3]);
+    return 1;
+  }
 
   contexts[0].addr.sin_family = AF_INET;
   contexts[0].addr.sin_port = htons(1);
@@ -50,8 +71,8 @@ int main(int argc, char** argv) {
     perror("socket");
     return 1;
   }
-  for (int i = 1; i < PTHREAD_NUM; i *= 2) {
-    memcpy(&contexts[i], &contexts[0], sizeof(contexts));
+  for (int i = 1; i < PTHREAD_NUM; i++) {
+    memcpy(&contexts[i], &contexts[0], sizeof(contexts[0]));
     contexts[i].socket = socket(AF_INET, SOCK_DGRAM, IPPROTO_UDP);
     if (contexts[i].socket == -1) {
       perror("socket");
@@ -88,7 +109,7 @@ int main(int argc, char** argv) {
   printf("</results>\n");
   fflush(stdout);
 
-  for (int i = 1; i < PTHREAD_NUM; i *= 2) {
+  for (int i = 0; i < PTHREAD_NUM; i++) {
     close(contexts[i].socket);
   }
 
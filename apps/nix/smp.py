@@ -1,86 +1,88 @@
-import json
-import os
-import subprocess
-import signal
-from typing import Dict, List, Optional
+from collections import defaultdict
+from typing import DefaultDict, Dict, List, Tuple
 
 import pandas as pd
 from helpers import (
     NOW,
     create_settings,
-    flamegraph_env,
-    nix_build,
     read_stats,
     write_stats,
 )
 from storage import Storage, StorageKind
 
+from fio import FioJob, benchmark_fio
+from scaling import fit_usl, throughput
 
-def benchmark_fio(
-    system: str,
-    attr: str,
-    cores: int,
-    directory: str,
-    stats: Dict[str, List],
-    extra_env: Dict[str, str] = {},
-) -> None:
-
-    env = os.environ.copy()
-    # we don't need network for these benchmarks
-    del env["SGXLKL_TAP"]
-    env.update(dict(SGXLKL_CWD=directory))
-    env.update(flamegraph_env(f"fio-{system}-{NOW}"))
-    env.update(extra_env)
-    enable_sgxio = "1" if system == "sgx-io" else "0"
-    env.update(SGXLKL_ENABLE_SGXIO=enable_sgxio)
-    env.update(SGXLKL_ETHREADS=str(cores))
-    env.update(extra_env)
-    fio = nix_build(attr)
-    stdout: Optional[int] = subprocess.PIPE
-    if os.environ.get("SGXLKL_ENABLE_GDB", "0") == "1":
-        stdout = None
-
-    cmd = [str(fio), "bin/fio", "--output-format=json", "--eta=always", f"fio-rand-RW-smp-{cores}.job"]
-    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
-    data = ""
-    in_json = False
-    print(f"[Benchmark]: {system}")
-    try:
-        if proc.stdout is None:
-            proc.wait()
-        else:
-            for line in proc.stdout:
-                print(line, end="")
-                if line == "{\n":
-                    in_json = True
-                if in_json:
-                    data += line
-                if line == "}\n":
-                    break
-    finally:
-        proc.send_signal(signal.SIGINT)
-        proc.wait()
-    if data == "":
-        raise RuntimeError(f"Did not get a result when running benchmark for {system}")
-    jsondata = json.loads(data)
-    for jobnum, job in enumerate(jsondata["jobs"]):
-        stats["system"].append(system)
-        stats["job"].append(jobnum)
-        stats["cores"].append(cores)
-        for op in ["read", "write", "trim"]:
-            metrics = job[op]
-            for metric_name, metric in metrics.items():
-                if isinstance(metric, dict):
-                    for name, submetric in metric.items():
-                        stats[f"{op}-{metric_name}-{name}"].append(submetric)
-                else:
-                    stats[f"{op}-{metric_name}"].append(metric)
-
-
-def benchmark_sgx_io(storage: Storage, stats: Dict[str, List], cores: int) -> None:
-    mount = storage.setup(StorageKind.SPDK)
+SYSTEMS = {
+    "native": (StorageKind.NATIVE, "fio-native"),
+    "sgx-lkl": (StorageKind.LKL, "fio-sgx-lkl"),
+    "sgx-io": (StorageKind.SPDK, "fio-sgx-io"),
+}
+ETHREADS = [1, 2, 4, 6, 8]
+NUMJOBS = [1, 2, 4, 6, 8]
+
+
+def smp_job(numjobs: int) -> FioJob:
+    return FioJob(
+        rw="randrw",
+        bs="4K",
+        iodepth=1,
+        direct=False,
+        numjobs=numjobs,
+        size="1G",
+        runtime=50,
+        thread=True,
+    )
+
+
+def benchmark_system(storage: Storage, system: str, stats: Dict[str, List]) -> None:
+    kind, attr = SYSTEMS[system]
+    # native has no enclave threads to scale
+    ethreads = [0] if kind == StorageKind.NATIVE else ETHREADS
+    done = set(zip(stats["system"], stats["ethreads"], stats["numjobs"]))
+    todo = [
+        (threads, numjobs)
+        for threads in ethreads
+        for numjobs in NUMJOBS
+        if (system, threads, numjobs) not in done
+    ]
+    if not todo:
+        print(f"skip {system} benchmark")
+        return
+    jobs = {numjobs: smp_job(numjobs) for numjobs in NUMJOBS}
+    files = {job.filename: job.render() for job in jobs.values()}
+    mount = storage.setup(kind, extra_files=files)
     with mount as mnt:
-        benchmark_fio("sgx-io", "fio-sgx-io", cores, mnt, stats, extra_env=mount.extra_env())
+        for threads, numjobs in todo:
+            print(f"[{system}] ethreads={threads} numjobs={numjobs}")
+            extra_env = mount.extra_env()
+            if threads:
+                extra_env.update(SGXLKL_ETHREADS=str(threads))
+            rows = len(stats["system"])
+            benchmark_fio(system, attr, mnt, stats, extra_env=extra_env, job=jobs[numjobs].filename)
+            rows = len(stats["system"]) - rows
+            stats["ethreads"].extend([threads] * rows)
+            stats["numjobs"].extend([numjobs] * rows)
+            write_stats("smp.json", stats)
+
+
+def fit_scaling(df: pd.DataFrame) -> pd.DataFrame:
+    """USL fits along numjobs (per ethreads) and along ethreads (per numjobs)"""
+    fits: DefaultDict[str, List] = defaultdict(list)
+    dimensions: List[Tuple[str, str]] = [("numjobs", "ethreads"), ("ethreads", "numjobs")]
+    for dimension, fixed in dimensions:
+        for (system, value), group in df.groupby(["system", fixed]):
+            if dimension == "ethreads" and system == "native":
+                continue
+            fit = fit_usl(dict(zip(group[dimension], group["bw"])))
+            if fit is None:
+                continue
+            fits["system"].append(system)
+            fits["dimension"].append(dimension)
+            fits["fixed"].append(f"{fixed}={value}")
+            for key, v in fit.items():
+                fits[key].append(v)
+    return pd.DataFrame(fits)
 
 
 def main() -> None:
@@ -90,13 +92,8 @@ def main() -> None:
 
     storage = Storage(settings)
 
-    done_cores = set(stats["cores"])
-    for cores in [1, 2, 4, 6, 8]:
-        if cores in done_cores:
-            print(f"skip {cores} cores")
-            continue
-        benchmark_sgx_io(storage, stats, cores)
-        write_stats("smp.json", stats)
+    for system in SYSTEMS:
+        benchmark_system(storage, system, stats)
 
     csv = f"smp-{NOW}.tsv"
     print(csv)
@@ -104,6 +101,11 @@ def main() -> None:
     throughput_df.to_csv(csv, index=False, sep="\t")
     throughput_df.to_csv("smp-latest.tsv", index=False, sep="\t")
 
+    fits = fit_scaling(throughput(throughput_df))
+    fits.to_csv(f"smp-fit-{NOW}.tsv", index=False, sep="\t")
+    fits.to_csv("smp-fit-latest.tsv", index=False, sep="\t")
+    print(fits.to_string(index=False))
+
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,13 @@
 import os
 import json
 import signal
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 import subprocess
 import pandas as pd
 
 from helpers import (
     NOW,
+    PerfStat,
     create_settings,
     nix_build,
     read_stats,
@@ -14,6 +15,38 @@ from helpers import (
 )
 from storage import Storage, StorageKind
 
+# transfer size of each read() in KiB
+BATCH_SIZES = [4, 16, 64, 256, 512, 1024, 4096]
+# counted system-wide: the enclave reaches memory through the SPDK/DMA path
+MEMORY_EVENTS = os.environ.get(
+    "PERF_MEMORY_EVENTS", "uncore_imc/data_reads/,uncore_imc/data_writes/"
+)
+
+
+def process_tree(pid: int) -> Set[int]:
+    pids = {pid}
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                for child in f.read().split():
+                    pids |= process_tree(int(child))
+    except OSError:
+        pass
+    return pids
+
+
+def cpu_time(pids: Set[int]) -> float:
+    ticks = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # utime and stime are the 14th and 15th field of the stat line
+        ticks += int(fields[11]) + int(fields[12])
+    return ticks / os.sysconf("SC_CLK_TCK")
+
 
 def benchmark_simpleio(
     storage: Storage,
@@ -21,6 +54,7 @@ def benchmark_simpleio(
     attr: str,
     directory: str,
     stats: Dict[str, List],
+    bs: int,
     extra_env: Dict[str, str] = {},
 ) -> None:
     env = dict(SGXLKL_CWD=directory)
@@ -32,15 +66,15 @@ def benchmark_simpleio(
     stdout: Optional[int] = subprocess.PIPE
     if os.environ.get("SGXLKL_ENABLE_GDB", "0") == "1":
         stdout = None
-    size = str(10 * 1024 * 1024 * 1024)  # 2G
+    size = str(10 * 1024 * 1024 * 1024)  # 10G
 
     env_string = []
     for k, v in env.items():
         env_string.append(f"{k}={v}")
     report = ""
     in_results = False
-    env = os.environ.copy()
-    env.update(extra_env)
+    proc_env = os.environ.copy()
+    proc_env.update(env)
 
     cmd = [
         simpleio,
@@ -49,47 +83,84 @@ def benchmark_simpleio(
         size,
         "0",
         "1",
-        str(128 * 4096),
+        str(bs * 1024),
     ]
     print(f"$ {' '.join(env_string)} {' '.join(cmd)}")
-    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
+    proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=proc_env)
+    pids: Set[int] = set()
+    cpu_start = 0.0
+    cpu_end = float("nan")
+    perf: Optional[PerfStat] = None
+    memory: Optional[PerfStat] = None
+    counters: Dict[str, float] = {}
     try:
         assert proc.stdout is not None
         for line in proc.stdout:
             print(f"stdout: {line}", end="")
-            if line == "<result>\n":
+            if line == "<start>\n":
+                # only count the transfer, not enclave start and SPDK setup
+                pids = process_tree(proc.pid)
+                cpu_start = cpu_time(pids)
+                target = ["-p", ",".join(map(str, pids))]
+                perf = PerfStat("cycles,instructions", target)
+                memory = PerfStat(MEMORY_EVENTS, ["-a"])
+            elif line == "<result>\n":
+                cpu_end = cpu_time(pids)
+                for p in [perf, memory]:
+                    if p is not None:
+                        counters.update(p.stop())
+                perf = memory = None
                 in_results = True
             elif in_results and line == "</result>\n":
                 break
             elif in_results:
                 report = line
     finally:
+        for p in [perf, memory]:
+            if p is not None:
+                p.stop()
         proc.send_signal(signal.SIGINT)
+        proc.wait()
     jsondata = json.loads(report)
+    nbytes = jsondata["bytes"]
+    seconds = jsondata["time"]
+    cycles = counters.get("cycles", float("nan"))
+    memory_bytes = sum(v for k, v in counters.items() if k.startswith("uncore_imc"))
     stats["type"].append(type)
-    stats["bytes"].append(jsondata["bytes"])
-    stats["time"].append(jsondata["time"])
+    stats["batch-size"].append(bs)
+    stats["bytes"].append(nbytes)
+    stats["time"].append(seconds)
+    stats["spdk-throughput"].append(nbytes / seconds / 1024 / 1024)
+    stats["cpu-time"].append(cpu_end - cpu_start)
+    stats["cycles"].append(cycles)
+    stats["instructions"].append(counters.get("instructions", float("nan")))
+    stats["cycles-per-byte"].append(cycles / nbytes if nbytes else float("nan"))
+    # includes every other memory user on the machine during the transfer
+    stats["memory-bandwidth"].append(
+        memory_bytes / seconds / 1024 / 1024 if memory_bytes else float("nan")
+    )
+    stats["memory-bytes-per-byte"].append(memory_bytes / nbytes if nbytes else float("nan"))
 
 
 def main() -> None:
     stats = read_stats("spdk-zerocopy.json")
     storage = Storage(create_settings())
+    done = set(zip(stats["type"], stats["batch-size"]))
+    modes = {"optimized": "1", "not-optimized": "0"}
 
     mount = storage.setup(StorageKind.SPDK)
     with mount as mnt:
-        extra_env1 = mount.extra_env()
-        extra_env1["SGXLKL_SPDK_ZEROCOPY"] = "1"
-        benchmark_simpleio(
-            storage, "optimized", "simpleio-sgx-io", mnt, stats, extra_env=extra_env1
-        )
-        import time
-        time.sleep(5)
-        extra_env2 = mount.extra_env()
-        extra_env2["SGXLKL_SPDK_ZEROCOPY"] = "0"
-        benchmark_simpleio(
-            storage, "not-optimized", "simpleio-sgx-io", mnt, stats, extra_env=extra_env2
-        )
-    write_stats("spdk-zerocopy.json", stats)
+        for bs in BATCH_SIZES:
+            for type, zerocopy in modes.items():
+                if (type, bs) in done:
+                    print(f"skip {type} {bs}KiB")
+                    continue
+                extra_env = mount.extra_env()
+                extra_env["SGXLKL_SPDK_ZEROCOPY"] = zerocopy
+                benchmark_simpleio(
+                    storage, type, "simpleio-sgx-io", mnt, stats, bs, extra_env=extra_env
+                )
+                write_stats("spdk-zerocopy.json", stats)
 
     csv = f"spdk-zerocopy-{NOW}.tsv"
     print(csv)
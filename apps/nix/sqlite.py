@@ -1,13 +1,16 @@
 import os
 import subprocess
 import signal
-from typing import Dict, List, Any
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import DefaultDict, Dict, List, Any
 import re
 
 import pandas as pd
 from helpers import (
     NOW,
     create_settings,
+    env_list,
     nix_build,
     read_stats,
     write_stats,
@@ -16,6 +19,52 @@ from helpers import (
 )
 from storage import Storage, StorageKind
 
+# " 100 - 5000 INSERTs into table with no index......................    0.045s"
+TEST_LINE = re.compile(r"^\s*(\d+) - (.+?)\.{2,}\s+([0-9.]+)s$")
+TOTAL_LINE = re.compile(r"^\s+TOTAL\.+\s+([0-9.]+)s$")
+
+
+@dataclass(frozen=True)
+class SqliteConfig:
+    journal: str = "delete"
+    # speedtest1 can only turn syncing off, the default is FULL
+    synchronous: str = "full"
+    # in pages
+    cache_size: int = 2000
+    page_size: int = 4096
+
+    def args(self) -> List[str]:
+        args = [
+            "--size", "10",
+            "--journal", self.journal,
+            "--cachesize", str(self.cache_size),
+            "--pagesize", str(self.page_size),
+        ]
+        if self.synchronous == "off":
+            args.append("--nosync")
+        # the page size only applies to a new database
+        args.append(f"bench-{self.journal}-{self.synchronous}-{self.cache_size}-{self.page_size}.db")
+        return args
+
+    def key(self) -> tuple:
+        return (self.journal, self.synchronous, self.cache_size, self.page_size)
+
+
+# closest to the single run of the old benchmark, plotted by apps_graphs.sqlite_graph;
+# keep graph_utils.SQLITE_DEFAULT_CONFIG in sync
+DEFAULT_CONFIG = SqliteConfig()
+
+
+def config_matrix() -> List[SqliteConfig]:
+    """Each dimension can be narrowed via environment"""
+    return [
+        SqliteConfig(journal, synchronous, int(cache_size), int(page_size))
+        for journal in env_list("SQLITE_JOURNAL", ["delete", "wal"])
+        for synchronous in env_list("SQLITE_SYNCHRONOUS", ["full", "off"])
+        for cache_size in env_list("SQLITE_CACHE_SIZE", ["2000", "20000"])
+        for page_size in env_list("SQLITE_PAGE_SIZE", ["1024", "4096", "16384"])
+    ]
+
 
 def benchmark_sqlite(
     storage: Storage,
@@ -23,10 +72,11 @@ def benchmark_sqlite(
     attr: str,
     directory: str,
     stats: Dict[str, List[Any]],
+    config: SqliteConfig,
     extra_env: Dict[str, str] = {},
 ) -> None:
     env = os.environ.copy()
-    del env["SGXLKL_TAP"]
+    env.pop("SGXLKL_TAP", None)
     env.update(dict(SGXLKL_CWD=directory))
     env.update(extra_env)
 
@@ -35,71 +85,124 @@ def benchmark_sqlite(
 
     sqlite = nix_build(attr)
     stdout = subprocess.PIPE
-    cmd = [str(sqlite)]
+    cmd = [str(sqlite), "bin/speedtest1"] + config.args()
+    print(f"$ {' '.join(cmd)}")
     proc = subprocess.Popen(cmd, stdout=stdout, text=True, env=env)
 
     print(f"[Benchmark]:{system}")
 
-    n_rows = 0
+    rows: DefaultDict[str, List[Any]] = defaultdict(list)
+    total = None
     try:
-        if proc.stdout is None:
-            proc.wait()
-        else:
-            for line in proc.stdout:
-                line = line.rstrip()
-                print(line)
-                match = re.match(r"(?: \d+ - |\s+)([^.]+)[.]+\s+([0-9.]+)s", line)
-                if match:
-                    if "TOTAL" in match.group(1):
-                        continue
-                    stats["system"].append(system)
-                    stats["sqlite-op-type"].append(match.group(1))
-                    stats["sqlite-time [s]"].append(match.group(2))
-                    n_rows += 1
-                    if n_rows == 3:
-                        break
+        assert proc.stdout is not None
+        for line in proc.stdout:
+            line = line.rstrip()
+            print(line)
+            match = TEST_LINE.match(line)
+            if match:
+                rows["sqlite-test"].append(int(match.group(1)))
+                rows["sqlite-op-type"].append(match.group(2).strip())
+                rows["sqlite-time [s]"].append(float(match.group(3)))
+                continue
+            match = TOTAL_LINE.match(line)
+            if match:
+                total = float(match.group(1))
+                break
     finally:
         proc.send_signal(signal.SIGINT)
-
-    expected = 3
-    if n_rows < expected:
-        raise RuntimeError(f"Expected {expected} rows, got: {n_rows} when running benchmark for {system}")
-
-
-def benchmark_sqlite_native(storage: Storage, stats: Dict[str, List[Any]]) -> None:
+        proc.wait()
+
+    if total is None or not rows:
+        raise RuntimeError(f"speedtest1 did not finish when running benchmark for {system}")
+    # only complete runs are recorded, so that resuming does not mix runs
+    n = len(rows["sqlite-test"])
+    for key, values in rows.items():
+        stats[key].extend(values)
+    stats["system"].extend([system] * n)
+    stats["journal"].extend([config.journal] * n)
+    stats["synchronous"].extend([config.synchronous] * n)
+    stats["cache-size"].extend([config.cache_size] * n)
+    stats["page-size"].extend([config.page_size] * n)
+    stats["sqlite-total [s]"].extend([total] * n)
+
+
+def benchmark_sqlite_native(
+    storage: Storage, stats: Dict[str, List[Any]], configs: List[SqliteConfig]
+) -> None:
     mount = storage.setup(StorageKind.NATIVE)
     with mount as mnt:
-        benchmark_sqlite(storage, "native", "sqlite-native", mnt, stats, extra_env=mount.extra_env())
+        for config in configs:
+            benchmark_sqlite(
+                storage, "native", "sqlite-native", mnt, stats, config, extra_env=mount.extra_env()
+            )
+            write_stats("sqlite.json", stats)
 
 
-def benchmark_sqlite_sgx_lkl(storage: Storage, stats: Dict[str, List[Any]]) -> None:
+def benchmark_sqlite_sgx_lkl(
+    storage: Storage, stats: Dict[str, List[Any]], configs: List[SqliteConfig]
+) -> None:
     mount = storage.setup(StorageKind.LKL)
     with mount as mnt:
-        benchmark_sqlite(
-            storage,
-            "sgx-lkl",
-            "sqlite-sgx-lkl",
-            mnt,
-            stats,
-            extra_env=mount.extra_env())
-
-
-def benchmark_sqlite_sgx_io(storage: Storage, stats: Dict[str, List[Any]]) -> None:
+        for config in configs:
+            benchmark_sqlite(
+                storage,
+                "sgx-lkl",
+                "sqlite-sgx-lkl",
+                mnt,
+                stats,
+                config,
+                extra_env=mount.extra_env())
+            write_stats("sqlite.json", stats)
+
+
+def benchmark_sqlite_sgx_io(
+    storage: Storage, stats: Dict[str, List[Any]], configs: List[SqliteConfig]
+) -> None:
     mount = storage.setup(StorageKind.SPDK)
     with mount as mnt:
-        benchmark_sqlite(storage, "sgx-io", "sqlite-sgx-io", mnt, stats, extra_env=mount.extra_env())
+        for config in configs:
+            benchmark_sqlite(
+                storage, "sgx-io", "sqlite-sgx-io", mnt, stats, config, extra_env=mount.extra_env()
+            )
+            write_stats("sqlite.json", stats)
 
 
-def benchmark_sqlite_scone(storage: Storage, stats: Dict[str, List[Any]]) -> None:
+def benchmark_sqlite_scone(
+    storage: Storage, stats: Dict[str, List[Any]], configs: List[SqliteConfig]
+) -> None:
     mount = storage.setup(StorageKind.SCONE)
     with mount as mnt:
         extra_env = scone_env(mnt)
         extra_env.update(mount.extra_env())
-        benchmark_sqlite(storage, "scone", "sqlite-scone", mnt, stats, extra_env=extra_env)
+        for config in configs:
+            benchmark_sqlite(storage, "scone", "sqlite-scone", mnt, stats, config, extra_env=extra_env)
+            write_stats("sqlite.json", stats)
+
+
+def fsync_share(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per test: the share of time that goes away with synchronous=OFF
+    (fsync-bound) and the slowdown over native without syncing (CPU-bound
+    in the enclave).
+    """
+    keys = ["system", "journal", "cache-size", "page-size", "sqlite-test", "sqlite-op-type"]
+    times = df.pivot_table(index=keys, columns="synchronous", values="sqlite-time [s]", aggfunc="median")
+    if "full" not in times.columns or "off" not in times.columns:
+        return pd.DataFrame()
+    times = times.reset_index()
+    times["fsync-share"] = ((times["full"] - times["off"]) / times["full"]).clip(lower=0)
+    native = times[times.system == "native"][keys[1:] + ["off"]]
+    times = times.merge(native.rename(columns={"off": "native-off"}), on=keys[1:], how="left")
+    times["cpu-slowdown"] = times["off"] / times["native-off"]
+    times["bound"] = times["fsync-share"].map(lambda share: "fsync" if share >= 0.5 else "cpu")
+    return times
 
 
 def main() -> None:
     stats = read_stats("sqlite.json")
+    if stats["system"] and not stats["journal"]:
+        print("sqlite.json has no configuration columns, starting over")
+        stats.clear()
     settings = create_settings()
     storage = Storage(settings)
 
@@ -109,13 +212,16 @@ def main() -> None:
         "sgx-lkl": benchmark_sqlite_sgx_lkl,
         "sgx-io": benchmark_sqlite_sgx_io,
     }
-    system = set(stats["system"])
+    configs = config_matrix()
+    done = set(
+        zip(stats["system"], stats["journal"], stats["synchronous"], stats["cache-size"], stats["page-size"])
+    )
     for name, benchmark in benchmarks.items():
-        if name in system:
+        todo = [c for c in configs if (name,) + c.key() not in done]
+        if not todo:
             print(f"skip {name} benchmark")
             continue
-        benchmark(storage, stats)
-        write_stats("sqlite.json", stats)
+        benchmark(storage, stats, todo)
 
     csv = f"sqlite-speedtest-{NOW}.tsv"
     print(csv)
@@ -123,6 +229,10 @@ def main() -> None:
     df.to_csv(csv, index=False, sep="\t")
     df.to_csv("sqlite-speedtest-latest.tsv", index=False, sep="\t")
 
+    share = fsync_share(df)
+    share.to_csv(f"sqlite-fsync-{NOW}.tsv", index=False, sep="\t")
+    share.to_csv("sqlite-fsync-latest.tsv", index=False, sep="\t")
+
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,6 @@
 import getpass
 import os
+import tempfile
 import time
 from enum import Enum
 from typing import Any, Optional, Dict
@@ -140,7 +141,11 @@ def setup_hugepages(kind: StorageKind) -> None:
     set_hugepages(num)
 
 
-def setup_luks(plain_dev: str, luks_name: str, key: str) -> str:
+# dm-crypt through the kernel crypto API, i.e. the AES-NI accelerated xts(aes)
+DEFAULT_CIPHER = "capi:xts(aes)-plain64"
+
+
+def setup_luks(plain_dev: str, luks_name: str, key: str, cipher: str = DEFAULT_CIPHER) -> str:
     run(
         [
             "sudo",
@@ -152,8 +157,7 @@ def setup_luks(plain_dev: str, luks_name: str, key: str) -> str:
             plain_dev,
             "--batch-mode",
             "--cipher",
-            "capi:xts(aes)-plain64",
-            # "aes-xts-plain64",
+            cipher,
             "--key-size",
             "256",
             "--hash",
@@ -167,6 +171,16 @@ def setup_luks(plain_dev: str, luks_name: str, key: str) -> str:
     cryptsetup_luks_open(plain_dev, luks_name, key)
     return f"/dev/mapper/{luks_name}"
 
+def write_image_files(dev: str, files: Dict[str, str]) -> None:
+    """Add files to the root of the filesystem on `dev`, i.e. generated fio jobs"""
+    with tempfile.TemporaryDirectory() as mnt:
+        run(["sudo", "mount", dev, mnt])
+        try:
+            for name, content in files.items():
+                run(["sudo", "tee", os.path.join(mnt, name)], input=content, stdout=subprocess.DEVNULL)
+        finally:
+            run(["sudo", "umount", mnt])
+
 # https://sconedocs.github.io/SCONE_Fileshield/
 
 
@@ -174,7 +188,9 @@ class Storage:
     def __init__(self, settings: Settings) -> None:
         self.settings = settings
 
-    def setup(self, kind: StorageKind) -> Mount:
+    def setup(
+        self, kind: StorageKind, extra_files: Dict[str, str] = {}, cipher: str = DEFAULT_CIPHER
+    ) -> Mount:
         if kind == StorageKind.SCONE and self.settings.spdk_hd_key:
             image = nix_build("iotest-image-scone")
         else:
@@ -210,7 +226,7 @@ class Storage:
         # TRIM for optimal performance
         run(["sudo", "blkdiscard", "-f", raw_dev])
         if self.settings.spdk_hd_key and kind != StorageKind.SCONE:
-            dev = setup_luks(raw_dev, spdk_device, self.settings.spdk_hd_key)
+            dev = setup_luks(raw_dev, spdk_device, self.settings.spdk_hd_key, cipher)
         else:
             dev = raw_dev
         run(
@@ -226,6 +242,8 @@ class Storage:
             ]
         )
         run(["sudo", "resize2fs", dev])
+        if extra_files:
+            write_image_files(dev, extra_files)
 
         if self.settings.spdk_hd_key and kind != StorageKind.SCONE:
             run(["sudo", "cryptsetup", "close", spdk_device])
@@ -1,6 +1,6 @@
 import os
 import json
-from typing import Dict, List
+from typing import Any, Dict, List, Set, Tuple
 import subprocess
 import signal
 import pandas as pd
@@ -8,6 +8,7 @@ import pandas as pd
 from helpers import (
     NOW,
     create_settings,
+    env_list,
     nix_build,
     read_stats,
     write_stats,
@@ -15,10 +16,50 @@ from helpers import (
 from network import Network, NetworkKind
 
 
+# written by tools/generate_syscall_remap.py --coverage
+SYSCALL_COVERAGE = os.environ.get("SYSCALL_COVERAGE", "syscall-coverage.json")
+# what udp-send can issue, one syscall per message
+SUPPORTED_SYSCALLS = ["sendto", "sendmsg"]
+# without a coverage report, as before
+DEFAULT_SYSCALL = "sendto"
+
+
+def load_syscall_coverage(path: str) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {s["name"]: s for s in json.load(f)["syscalls"]}
+
+
+def benchmark_candidates(coverage: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Syscalls forwarded to LKL that may block, i.e. where sync vs. async matters"""
+    return sorted(
+        name for name, s in coverage.items()
+        if s["handler"] == "lkl" and s["may_block"] and s["native"] is not None
+    )
+
+
+def select_syscalls(coverage: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    The blocking LKL syscalls of the coverage report that udp-send can issue,
+    SYSCALL_PERF_SYSCALLS narrows them down.
+    """
+    if not coverage:
+        return env_list("SYSCALL_PERF_SYSCALLS", [DEFAULT_SYSCALL])
+    candidates = benchmark_candidates(coverage)
+    if candidates:
+        print(f"blocking LKL syscalls: {' '.join(candidates)}")
+    selected = [s for s in SUPPORTED_SYSCALLS if s in candidates]
+    return [s for s in env_list("SYSCALL_PERF_SYSCALLS", selected) if s in selected]
+
+
 class Benchmark:
     def __init__(self) -> None:
         self.settings = create_settings()
         self.network = Network(self.settings)
+        self.coverage = load_syscall_coverage(SYSCALL_COVERAGE)
+        self.syscalls = select_syscalls(self.coverage)
+        print(f"benchmarked syscalls: {' '.join(self.syscalls)}")
 
     def run(
         self,
@@ -26,13 +67,28 @@ class Benchmark:
         system: str,
         stats: Dict[str, List],
         extra_env: Dict[str, str] = {},
+    ) -> None:
+        for syscall in self.syscalls:
+            if (system, syscall) in done_runs(stats):
+                print(f"skip {system} {syscall}")
+                continue
+            self.run_syscall(attribute, system, syscall, stats, extra_env)
+            write_stats("syscall-perf.json", stats)
+
+    def run_syscall(
+        self,
+        attribute: str,
+        system: str,
+        syscall: str,
+        stats: Dict[str, List],
+        extra_env: Dict[str, str],
     ) -> None:
         env = os.environ.copy()
         env.update(extra_env)
         env["SGXLKL_ETHREADS"] = "2" if system == "sync" else "1"
         simpleio = nix_build(attribute)
 
-        cmd = [str(simpleio), "bin/udp-send", self.settings.remote_dpdk_ip, "2000000"]
+        cmd = [str(simpleio), "bin/udp-send", self.settings.remote_dpdk_ip, "2000000", syscall]
         proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True, env=env)
         assert proc.stdout is not None
         found_results = False
@@ -44,6 +100,10 @@ class Benchmark:
                     break
                 data = json.loads(line)
                 stats["system"].append(system)
+                coverage = self.coverage.get(syscall, {})
+                stats["syscall"].append(syscall)
+                stats["syscall_handler"].append(coverage.get("handler", "unknown"))
+                stats["syscall_may_block"].append(coverage.get("may_block", True))
                 for k, v in data.items():
                     stats[k].append(v)
             elif line == "<results>":
@@ -91,17 +151,21 @@ BENCHMARKS = {
 }
 
 
+def done_runs(stats: Dict[str, List]) -> Set[Tuple[str, str]]:
+    # runs from before the syscall column only measured sendto
+    syscalls = stats["syscall"] or [DEFAULT_SYSCALL] * len(stats["system"])
+    return set(zip(stats["system"], syscalls))
+
+
 def main() -> None:
     stats = read_stats("syscall-perf.json")
-    system = set(stats["system"])
     benchmark = Benchmark()
 
     for name, benchmark_func in BENCHMARKS.items():
-        if name in system:
+        if all((name, syscall) in done_runs(stats) for syscall in benchmark.syscalls):
             print(f"skip {name} benchmark")
             continue
         benchmark_func(benchmark, stats)
-        write_stats("syscall-perf.json", stats)
 
     csv = f"syscall-perf-{NOW}.tsv"
     print(csv)
@@ -0,0 +1,164 @@
+"""
+In-process ELF section header parser shared by gdb_sgx_plugin.py and gdb.py.
+
+Replaces `readelf -W -S` subprocesses. Parsed section tables are cached by
+content hash, and the hash itself is cached per (path, mtime, size), so
+reloading the same libsgxlkl or DSO does not touch the file again.
+"""
+
+import hashlib
+import os
+import struct
+from typing import Dict, List, NamedTuple, Tuple
+
+SHN_UNDEF = 0
+SHN_XINDEX = 0xFFFF
+
+SHF_ALLOC = 0x2
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+
+class Section(NamedTuple):
+    nr: int
+    name: str
+    type: int
+    flags: int
+    addr: int
+    offset: int
+    size: int
+
+
+# (realpath, st_mtime_ns, st_size) -> content hash
+_HASHES: Dict[Tuple[str, int, int], str] = {}
+# content hash -> parsed sections
+_SECTIONS: Dict[str, List[Section]] = {}
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def _stat_key(path: str) -> Tuple[str, int, int]:
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def _cstring(table: bytes, offset: int) -> str:
+    end = table.find(b"\0", offset)
+    if end == -1:
+        end = len(table)
+    return table[offset:end].decode("utf-8", "replace")
+
+
+def parse_sections(data: bytes) -> List[Section]:
+    """Parse the section header table of an in-memory ELF image"""
+    if data[:4] != b"\x7fELF":
+        raise ValueError("not an ELF file")
+    elf_class = data[4]
+    if data[5] == ELFDATA2LSB:
+        endian = "<"
+    elif data[5] == ELFDATA2MSB:
+        endian = ">"
+    else:
+        raise ValueError("unknown ELF data encoding %d" % data[5])
+
+    if elf_class == ELFCLASS64:
+        ehdr_fmt = endian + "16xHHIQQQIHHHHHH"
+        shdr_fmt = endian + "IIQQQQIIQQ"
+    elif elf_class == ELFCLASS32:
+        ehdr_fmt = endian + "16xHHIIIIIHHHHHH"
+        shdr_fmt = endian + "IIIIIIIIII"
+    else:
+        raise ValueError("unknown ELF class %d" % elf_class)
+
+    (_, _, _, _, _, shoff, _, _, _, _, shentsize, shnum, shstrndx) = \
+        struct.unpack_from(ehdr_fmt, data, 0)
+    if shoff == 0:
+        return []
+
+    def shdr(idx: int) -> tuple:
+        return struct.unpack_from(shdr_fmt, data, shoff + idx * shentsize)
+
+    # large section counts are stored in the initial section header
+    first = shdr(0)
+    if shnum == 0:
+        shnum = first[5]
+    if shstrndx == SHN_XINDEX:
+        shstrndx = first[6]
+
+    headers = [shdr(i) for i in range(shnum)]
+    strtab = b""
+    if shstrndx != SHN_UNDEF and shstrndx < shnum:
+        str_off, str_size = headers[shstrndx][4], headers[shstrndx][5]
+        strtab = bytes(data[str_off:str_off + str_size])
+
+    sections = []
+    for nr, h in enumerate(headers):
+        name, sh_type, flags, addr, offset, size = h[:6]
+        sections.append(Section(nr=nr,
+                                name=_cstring(strtab, name),
+                                type=sh_type,
+                                flags=flags,
+                                addr=addr,
+                                offset=offset,
+                                size=size))
+    return sections
+
+
+def get_sections_from_bytes(data: bytes, digest: str = None) -> List[Section]:
+    if digest is None:
+        digest = content_hash(data)
+    sections = _SECTIONS.get(digest)
+    if sections is None:
+        sections = parse_sections(data)
+        _SECTIONS[digest] = sections
+    return sections
+
+
+def get_sections(path: str) -> List[Section]:
+    """Return the section headers of `path`, parsing each distinct file once"""
+    key = _stat_key(path)
+    digest = _HASHES.get(key)
+    if digest is not None and digest in _SECTIONS:
+        return _SECTIONS[digest]
+    with open(key[0], "rb") as f:
+        data = f.read()
+    digest = content_hash(data)
+    _HASHES[key] = digest
+    return get_sections_from_bytes(data, digest)
+
+
+def remember_file(path: str, digest: str) -> None:
+    """Record the content hash of a file we have just written ourselves"""
+    _HASHES[_stat_key(path)] = digest
+
+
+def symbol_file_args(sections: List[Section], base: int) -> Tuple[int, List[Tuple[str, int]]]:
+    """
+    Compute the arguments for gdb's add-symbol-file: the relocated address of
+    .text and a (name, address) pair for every other allocated section.
+    """
+    text_addr = base
+    others = []
+    for s in sections:
+        if s.nr == 0 or not s.name:
+            continue
+        if s.name == ".text":
+            text_addr = s.addr + base
+        elif s.addr != 0:
+            others.append((s.name, s.addr + base))
+    return text_addr, others
+
+
+def mapped_range(sections: List[Section], base: int) -> Tuple[int, int]:
+    """Return the [start, end) address range of all allocated sections"""
+    alloc = [s for s in sections if s.flags & SHF_ALLOC and s.size]
+    if not alloc:
+        return base, base
+    return (base + min(s.addr for s in alloc),
+            base + max(s.addr + s.size for s in alloc))
@@ -38,6 +38,8 @@ from ctypes import create_string_buffer
 import load_symbol_cmd
 import sgx_emmt
 import ctypes
+import threading
+import time
 
 # Calculate the bit mode of current debuggee project
 SIZE = gdb.parse_and_eval("sizeof(long)")
@@ -46,6 +48,9 @@ ET_SIM = 0x1
 ET_DEBUG = 0x2
 PAGE_SIZE = 0x1000
 KB_SIZE = 1024
+# Unused enclave stack memory is filled with 0xcc
+STACK_FILL_BYTE = b'\xcc'
+STACK_FILL_HALF_PAGE = STACK_FILL_BYTE * (PAGE_SIZE >> 1)
 # The following definitions should strictly align with the structure of
 # debug_enclave_info_t in uRTS.
 # Here we only care about the first 7 items in the structure.
@@ -55,6 +60,8 @@ KB_SIZE = 1024
 ENCLAVE_INFO_SIZE = 5 * 8 + 2 * 4
 INFO_FMT = 'QQQIIQQ'
 ENCLAVES_ADDR = {}
+# start address -> enclave_info of every enclave with debugging enabled
+ENCLAVE_INFOS = {}
 
 # The following definitions should strictly align with the struct of
 # tcs_t
@@ -174,6 +181,7 @@ class enclave_info(object):
         gdb.execute(gdb_cmd, False, True)
         global ENCLAVES_ADDR
         ENCLAVES_ADDR[self.start_addr] = gdb_cmd.split()[2]
+        ENCLAVE_INFOS[self.start_addr] = self
         return 0
 
     def get_peak_heap_used(self):
@@ -209,12 +217,8 @@ class enclave_info(object):
             string = read_from_memory(stack_addr + mid*PAGE_SIZE + (PAGE_SIZE>>1), PAGE_SIZE>>1)
             if string == None:
                 return -2
-            dirty_flag = 0
-            for i in range(0, PAGE_SIZE>>4):
-                temp = struct.unpack_from("Q", string, ((PAGE_SIZE>>4) - 1 - i)*8)[0]
-                if (self.internal_compare(temp, 0xcccccccccccccccc)) != 0:
-                    dirty_flag = 1
-                    break
+            # the upper half of an unused page still holds the fill pattern
+            dirty_flag = 0 if bytes(string) == STACK_FILL_HALF_PAGE else 1
             if dirty_flag == 0:
                 low = mid + 1
                 page_index = mid
@@ -222,48 +226,54 @@ class enclave_info(object):
                 high = mid -1
         return page_index
 
+    def get_stack_used(self, tcs_addr):
+        """Get the peak value of the stack used by the thread of one TCS"""
+        tcs_str = read_from_memory(tcs_addr, ENCLAVE_TCS_INFO_SIZE)
+        if tcs_str == None:
+            return -1
+        tcs_tuple = struct.unpack_from(TCS_INFO_FMT, tcs_str)
+        offset = tcs_tuple[7]
+        if SIZE == 4:
+            td_fmt = '20I'
+        elif SIZE == 8:
+            td_fmt = '20Q'
+        td_str = read_from_memory(self.start_addr+offset, (20*SIZE))
+        if td_str == None:
+            return -1
+        td_tuple = struct.unpack_from(td_fmt, td_str)
+
+        stack_commit_addr = td_tuple[19]
+        stack_base_addr = td_tuple[2]
+        stack_limit_addr = td_tuple[3]
+
+        stack_usage = 0
+        if stack_commit_addr > stack_limit_addr:
+            stack_base_addr_page_align = (stack_base_addr + PAGE_SIZE - 1) & ~(PAGE_SIZE - 1)
+            stack_usage = stack_base_addr_page_align - stack_commit_addr
+        elif stack_limit_addr != 0:
+            page_index = self.find_boundary_page_index(stack_limit_addr, self.stack_size)
+            if page_index == (self.stack_size)/PAGE_SIZE - 1:
+                return 0
+            elif page_index == -2:
+                return -1
+            else:
+                string = read_from_memory(stack_limit_addr + (page_index+1) * PAGE_SIZE, PAGE_SIZE)
+                if string == None:
+                    return -1
+                # index of the first byte that differs from the fill pattern
+                used = bytes(string).lstrip(STACK_FILL_BYTE)
+                if used:
+                    i = len(string) - len(used)
+                    stack_usage = self.stack_size - (page_index+1) * PAGE_SIZE - i
+        return stack_usage
+
     def get_peak_stack_used(self):
         """Get the peak value of the stack used"""
         peak_stack_used = 0
         for tcs_addr in self.tcs_addr_list:
-            tcs_str = read_from_memory(tcs_addr, ENCLAVE_TCS_INFO_SIZE)
-            if tcs_str == None:
+            stack_usage = self.get_stack_used(tcs_addr)
+            if stack_usage == -1:
                 return -1
-            tcs_tuple = struct.unpack_from(TCS_INFO_FMT, tcs_str)
-            offset = tcs_tuple[7]
-            if SIZE == 4:
-                td_fmt = '20I'
-            elif SIZE == 8:
-                td_fmt = '20Q'
-            td_str = read_from_memory(self.start_addr+offset, (20*SIZE))
-            if td_str == None:
-                return -1
-            td_tuple = struct.unpack_from(td_fmt, td_str)
-
-            stack_commit_addr = td_tuple[19]
-            stack_base_addr = td_tuple[2]
-            stack_limit_addr = td_tuple[3]
-
-            stack_usage = 0
-            if stack_commit_addr > stack_limit_addr:
-                stack_base_addr_page_align = (stack_base_addr + PAGE_SIZE - 1) & ~(PAGE_SIZE - 1)
-                stack_usage = stack_base_addr_page_align - stack_commit_addr
-            elif stack_limit_addr != 0:
-                page_index = self.find_boundary_page_index(stack_limit_addr, self.stack_size)
-                if page_index == (self.stack_size)/PAGE_SIZE - 1:
-                    continue
-                elif page_index == -2:
-                    return -1
-                else:
-                    string = read_from_memory(stack_limit_addr + (page_index+1) * PAGE_SIZE, PAGE_SIZE)
-                    if string == None:
-                        return -1
-                    for i in range(0, len(string)):
-                        temp = struct.unpack_from("B", string, i)[0]
-                        if (self.internal_compare(temp, 0xcc)) != 0:
-                            stack_usage = self.stack_size - (page_index+1) * PAGE_SIZE - i
-                            break
-
             if peak_stack_used < stack_usage:
                 peak_stack_used = stack_usage
 
@@ -293,6 +303,9 @@ class enclave_info(object):
         if (self.enclave_type & ET_SIM) != ET_SIM and (self.enclave_type & ET_DEBUG) != ET_DEBUG:
             return -2
         self.show_emmt()
+        if EMMT_SAMPLER.active():
+            EMMT_SAMPLER.sample()
+        ENCLAVE_INFOS.pop(self.start_addr, None)
         try:
             # clear TCS debug flag
             for tcs_addr in self.tcs_addr_list:
@@ -332,6 +345,112 @@ class enclave_info(object):
         self.tcs_addr_list.append(tcs_addr)
         return 0
 
+class emmt_sampler(object):
+    """Periodically record peak heap and per-TCS stack usage of all debugged
+    enclaves as a time series. gdb must run the inferior asynchronously
+    ("set mi-async on" and "run&"), so that the sampler can interrupt it,
+    read the counters and continue."""
+    def __init__(self):
+        self.interval = 1.0
+        self.path = None
+        self.rows = []
+        self.start_time = 0
+        self.pending = False
+        self.timer = None
+
+    def active(self):
+        return self.path is not None
+
+    def start(self, interval, path):
+        self.interval = interval
+        self.path = path
+        self.rows = []
+        self.start_time = time.time()
+        self.pending = False
+        gdb.events.stop.connect(self.stop_handler)
+        gdb.events.exited.connect(self.exited_handler)
+        self.schedule()
+
+    def stop(self):
+        if not self.active():
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        gdb.events.stop.disconnect(self.stop_handler)
+        gdb.events.exited.disconnect(self.exited_handler)
+        self.write()
+        self.path = None
+
+    def schedule(self):
+        self.timer = threading.Timer(self.interval, gdb.post_event, [self.tick])
+        self.timer.daemon = True
+        self.timer.start()
+
+    def tick(self):
+        # never interrupt twice: the outstanding SIGINT still has to arrive
+        if not self.active() or self.pending:
+            return
+        thread = gdb.selected_thread()
+        if thread is not None and thread.is_running():
+            self.pending = True
+            gdb.execute("interrupt", False, True)
+        else:
+            self.sample()
+            self.schedule()
+
+    def stop_handler(self, event):
+        if not self.pending:
+            return
+        # breakpoints or signals that beat our interrupt belong to the user,
+        # our SIGINT is reported once the inferior is resumed
+        if not isinstance(event, gdb.SignalEvent) or event.stop_signal != "SIGINT":
+            return
+        self.pending = False
+        self.sample()
+        self.schedule()
+        gdb.post_event(lambda: gdb.execute("continue&", False, True))
+
+    def exited_handler(self, event):
+        self.stop()
+
+    def sample(self):
+        now = time.time() - self.start_time
+        for ei in list(ENCLAVE_INFOS.values()):
+            try:
+                heap = ei.get_peak_heap_used()
+                for tcs_addr in ei.tcs_addr_list:
+                    stack = ei.get_stack_used(tcs_addr)
+                    self.rows.append((now, ei.enclave_path, heap, tcs_addr, stack))
+            except gdb.MemoryError:
+                # enclave might be destroyed already
+                pass
+
+    def write(self):
+        with open(self.path, "w") as f:
+            f.write("time\tenclave\tpeak_heap_used\ttcs\tstack_used\n")
+            for (now, path, heap, tcs_addr, stack) in self.rows:
+                f.write("%.3f\t%s\t%d\t%#x\t%d\n" % (now, path, heap, tcs_addr, stack))
+        print ("sgx_emmt: wrote {0:d} samples to {1:s}".format(len(self.rows), self.path))
+
+EMMT_SAMPLER = emmt_sampler()
+
+class emmt_sample(gdb.Command):
+    """Record enclave memory usage periodically:
+sgx_emmt_sample INTERVAL_SECONDS FILE.tsv
+sgx_emmt_sample stop"""
+    def __init__ (self):
+        gdb.Command.__init__ (self, "sgx_emmt_sample", gdb.COMMAND_RUNNING)
+
+    def invoke (self, arg, from_tty):
+        argv = gdb.string_to_argv(arg)
+        if argv == ["stop"]:
+            EMMT_SAMPLER.stop()
+            return
+        if len(argv) != 2:
+            raise gdb.GdbError("Usage: sgx_emmt_sample INTERVAL_SECONDS FILE.tsv | stop")
+        EMMT_SAMPLER.stop()
+        EMMT_SAMPLER.start(float(argv[0]), argv[1])
+
 class CreateEnclaveBreakpoint(gdb.Breakpoint):
     def __init__(self):
         gdb.Breakpoint.__init__ (self, spec="__gdb_hook_init_done", internal=1)
@@ -417,3 +536,4 @@ def newobj_handler(event):
 if __name__ == "__main__":
     gdb.events.new_objfile.connect(newobj_handler)
     sgx_emmt.init_emmt()
+    emmt_sample()
@@ -30,103 +30,38 @@
 #
 #
 
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from io import StringIO
-
-import traceback, errno, string, re, sys, time, readelf;
-
-def GetLoadSymbolCommand(EnclaveFile, Base, Offset):
-    text = readelf.ReadElf(EnclaveFile)
-    if text == None:
-        return -1
-    SegsFile = StringIO(text)
+import elf_sections
 
+def GetLoadSymbolCommand(EnclaveFile, Base, Offset='0'):
     try:
-        FileList = SegsFile.readlines()
-        n=4;
-        m=100;
-        Out = [[[] for ni in range(n)] for mi in range(m)]
-        i=0;
-        Out[99][2] = '0';
-        # Parse the readelf output file to extract the section names and
-        # their offsets and add the Proj base address.
-        for line in FileList:
-            list = line.split();
-            if(len(list) > 0):
-                SegOffset = -1;
-                # The readelf will put a space after the open bracket for single
-                # digit section numbers.  This causes the line.split to create
-                # an extra element in the array for these lines.
-                if(re.match('\[\s*[0-9]+\]',list[0])):
-                    SegOffset = 0;
-                if(re.match('\s*[0-9]+\]',list[1])):
-                    SegOffset = 1;
-
-                if(SegOffset != -1):
-                    if (list[SegOffset+1][0] == '.'):
-                        # If it is the .text section, put it in a special place in the array
-                        # because the 'add-symbol-file' command treats it differently.
-                        #print "%#08x" % (int(list[SegOffset+3], 16))
-                        if(list[SegOffset+1] == ".text"):
-                            Out[99][0] = "-s";
-                            Out[99][1] = list[SegOffset+1];
-                            Out[99][2] = str(int(list[SegOffset+3], 16) + int(Base, 10) + int(Offset, 10));
-                            Out[99][3] = " ";
-                        elif(int(list[SegOffset+3], 16) != 0):
-                            Out[i][0] = "-s";
-                            Out[i][1] = list[SegOffset+1];
-                            Out[i][2] = str(int(list[SegOffset+3], 16) + int(Base, 10) + int(Offset, 10));
-                            Out[i][3] = " ";
-                            i = i+1;
-        if('0' != Out[99][2]):
-            # The last section must not have the '\' line continuation character.
-            Out[i-1][3] = '';
-
-            # Write the GDB 'add-symbol-file' command with all the arguments to the setup GDB command file.
-            # Note: The mandatory argument for the 'add-symbol-file' command is the .text section without a
-            # '-s .SectionName'.  All other sections need the '-s .SectionName'.
-            gdbcmd = "add-symbol-file '" + EnclaveFile + "' " + '%(Location)#08x' % {'Location':int(Out[99][2])} + " "
-            for j in range(i):
-                gdbcmd += Out[j][0] + " " + Out[j][1] + " " + '%(Location)#08x' % {'Location' : int(Out[j][2])} + " " + Out[j][3]
-        else:
-            return -1
-
-        return gdbcmd
-
-    except:
-        print ("Error parsing enclave file.  Check format of file.")
+        sections = elf_sections.get_sections(EnclaveFile)
+    except (OSError, ValueError) as e:
+        print ("Error parsing enclave file %s: %s" % (EnclaveFile, e))
         return -1
 
-def GetUnloadSymbolCommand(EnclaveFile, Base):
-    text = readelf.ReadElf(EnclaveFile)
-    if text == None:
+    # Add the Proj base address to the offset of every named section.
+    # The .text section is the mandatory argument of 'add-symbol-file' and
+    # is passed without '-s .SectionName'.
+    base = int(Base, 10) + int(Offset, 10)
+    text = [s for s in sections if s.name == ".text"]
+    if not text:
         return -1
-    SegsFile = StringIO(text)
-
-    try:
-        FileList = SegsFile.readlines()
-        # Parse the readelf output file to extract the section names and
-        # their offsets and add the Proj base address.
-        for line in FileList:
-            list = line.split();
-            if(len(list) > 0):
-                SegOffset = -1;
-                # The readelf will put a space after the open bracket for single
-                # digit section numbers.  This causes the line.split to create
-                # an extra element in the array for these lines.
-                if(re.match('\[\s*[0-9]+\]',list[0])):
-                    SegOffset = 0;
-                if(re.match('\s*[0-9]+\]',list[1])):
-                    SegOffset = 1;
 
-                if(SegOffset != -1):
-                    if (list[SegOffset+1][0] == '.'):
-                        # If it is the .text section, get the .text start address and plus enclave start address
-                        if(list[SegOffset+1] == ".text"):
-                            return "remove-symbol-file -a " + str(int(list[SegOffset+3], 16) + int(Base, 10))
+    gdbcmd = "add-symbol-file '" + EnclaveFile + "' " + '%(Location)#08x' % {'Location': text[0].addr + base}
+    for s in sections:
+        if s.name.startswith('.') and s.name != ".text" and s.addr != 0:
+            gdbcmd += " -s " + s.name + " " + '%(Location)#08x' % {'Location': s.addr + base}
+    return gdbcmd
 
-    except:
-        print ("Error parsing enclave file.  Check format of file.")
+def GetUnloadSymbolCommand(EnclaveFile, Base):
+    try:
+        sections = elf_sections.get_sections(EnclaveFile)
+    except (OSError, ValueError) as e:
+        print ("Error parsing enclave file %s: %s" % (EnclaveFile, e))
         return -1
+
+    # Get the .text start address and plus enclave start address
+    for s in sections:
+        if s.name == ".text":
+            return "remove-symbol-file -a " + str(s.addr + int(Base, 10))
+    return -1
@@ -1,48 +1,169 @@
 # To use, add source /path/to/gdb.py to your $HOME/.gdbinit file.
+#
+# Symbols of in-enclave libraries are only loaded once a stop hits an address
+# inside them. Set SGXLKL_GDB_EAGER_SYMBOLS=1 to load them as soon as they are
+# mapped, e.g. to set breakpoints in a library before it is first entered.
 
 import gdb
-import atexit
+import bisect
 import os
-import re
-import subprocess
+import struct
+import sys
 import tempfile
 import textwrap as tw
-from typing import Optional, List
+from typing import Optional, List, Dict
 from collections import defaultdict
 from dataclasses import dataclass
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "gdb-sgx-plugin"))
+import elf_sections
+
+SYMBOL_CACHE_DIR = os.environ.get(
+    "SGXLKL_GDB_SYMBOL_CACHE",
+    os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                 "sgx-lkl-gdb", "symbols"))
+
+
+def cache_symbol_image(image: bytes) -> str:
+    """
+    Store an in-enclave symbol image under its content hash and return the path.
+    Identical images are only written once and are reused by later gdb sessions.
+    """
+    digest = elf_sections.content_hash(image)
+    path = os.path.join(SYMBOL_CACHE_DIR, digest + ".so")
+    if not os.path.exists(path):
+        os.makedirs(SYMBOL_CACHE_DIR, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=SYMBOL_CACHE_DIR, suffix='.tmp', delete=False) as f:
+            f.write(image)
+        os.replace(f.name, path)
+    elf_sections.get_sections_from_bytes(image, digest)
+    elf_sections.remember_file(path, digest)
+    return path
+
+
 def add_symbol_file(filename, baseaddr):
-    sections = []
-    textaddr = '0'
+    textaddr, sections = elf_sections.symbol_file_args(
+        elf_sections.get_sections(filename), baseaddr)
 
-    p = subprocess.Popen(["readelf", "-SW", filename], stdout=subprocess.PIPE)
+    cmd = "add-symbol-file %s 0x%08x" % (filename, textaddr)
 
-    for line in p.stdout.readlines():
-        line = line.decode("utf-8").strip()
-        if not line.startswith('[') or line.startswith('[Nr]'):
-            continue
+    for name, addr in sections:
+        cmd += " -s %s 0x%x" % (name, addr)
 
-        line = re.sub(r'\[ *(\d+)\]', '\\1', line)
-        sec = dict(zip(['nr', 'name', 'type', 'addr'], line.split()))
+    gdb.execute(cmd)
 
-        if sec['nr'] == '0':
-            continue
 
-        if sec['name'] == '.text':
-            textaddr = sec['addr']
-        elif int(sec['addr'], 16) != 0:
-            sections.append(sec)
+@dataclass
+class Dso:
+    path: str
+    base: int
+    start: int
+    end: int
+    loaded: bool = False
+
 
-    cmd = "add-symbol-file %s 0x%08x" % (filename, int(textaddr, 16) + baseaddr)
+class DsoRegistry:
+    """
+    Records where in-enclave libraries are mapped and defers add-symbol-file
+    until a stop hits an address inside one of them.
+    """
+    def __init__(self) -> None:
+        self.starts: List[int] = []
+        self.dsos: List[Dso] = []
+        self.eager = os.environ.get("SGXLKL_GDB_EAGER_SYMBOLS", None) is not None
+
+    def add(self, path: str, base: int) -> Dso:
+        start, end = elf_sections.mapped_range(elf_sections.get_sections(path), base)
+        dso = Dso(path=path, base=base, start=start, end=end)
+        idx = bisect.bisect_left(self.starts, start)
+        self.starts.insert(idx, start)
+        self.dsos.insert(idx, dso)
+        if self.eager:
+            self.load(dso)
+        return dso
+
+    def find(self, pc: int) -> Optional[Dso]:
+        idx = bisect.bisect_right(self.starts, pc) - 1
+        if idx >= 0 and pc < self.dsos[idx].end:
+            return self.dsos[idx]
+        return None
+
+    def load(self, dso: Dso) -> None:
+        if dso.loaded:
+            return
+        dso.loaded = True
+        gdb.write('Loading symbols for %s at base 0x%x...\n' % (dso.path, dso.base))
+        add_symbol_file(dso.path, dso.base)
 
-    for s in sections:
-        addr = int(s['addr'], 16)
-        if s['name'] == '.text' or addr == 0:
+    def load_for_pc(self, pc: int) -> bool:
+        dso = self.find(pc)
+        if dso is None or dso.loaded:
+            return False
+        self.load(dso)
+        return True
+
+    def load_all(self) -> None:
+        for dso in self.dsos:
+            self.load(dso)
+
+
+DSO_REGISTRY = DsoRegistry()
+# how many frames of the stopped thread are checked for unloaded libraries
+LAZY_SYMBOLS_MAX_FRAMES = 64
+
+
+def load_symbols_on_stop(event: gdb.StopEvent) -> None:
+    if not DSO_REGISTRY.dsos:
+        return
+    try:
+        frame = gdb.newest_frame()
+    except gdb.error:
+        return
+    depth = 0
+    while frame is not None and depth < LAZY_SYMBOLS_MAX_FRAMES:
+        if DSO_REGISTRY.load_for_pc(frame.pc()):
+            # new symbols can change how the remaining frames are unwound
+            gdb.invalidate_cached_frames()
+            frame = gdb.newest_frame()
+            depth = 0
             continue
+        try:
+            frame = frame.older()
+        except gdb.error:
+            break
+        depth += 1
 
-        cmd += " -s %s 0x%x" % (s['name'], int(baseaddr + addr))
 
-    gdb.execute(cmd)
+class LoadDsoSymbols(gdb.Command):
+    """
+        Load deferred symbols of in-enclave libraries.
+        Param: address inside a library, or "all" (default)
+    """
+    def __init__(self) -> None:
+        super(LoadDsoSymbols, self).__init__("lazy-symbols-load", gdb.COMMAND_FILES)
+
+    def invoke(self, arg, from_tty) -> None:
+        argv = gdb.string_to_argv(arg)
+        if not argv or argv[0] == "all":
+            DSO_REGISTRY.load_all()
+            return
+        pc = int(gdb.parse_and_eval(argv[0]))
+        if DSO_REGISTRY.find(pc) is None:
+            raise gdb.GdbError("No in-enclave library mapped at 0x%x" % pc)
+        DSO_REGISTRY.load_for_pc(pc)
+
+
+class ListDsos(gdb.Command):
+    """
+        List in-enclave libraries and whether their symbols are loaded.
+    """
+    def __init__(self) -> None:
+        super(ListDsos, self).__init__("lazy-symbols-list", gdb.COMMAND_FILES)
+
+    def invoke(self, arg, from_tty) -> None:
+        for dso in DSO_REGISTRY.dsos:
+            gdb.write("0x%016x-0x%016x %s %s\n" % (
+                dso.start, dso.end, "loaded  " if dso.loaded else "deferred", dso.path))
 
 
 class StarterExecBreakpoint(gdb.Breakpoint):
@@ -93,15 +214,10 @@ class LoadLibraryBreakpoint(gdb.Breakpoint):
 
         # work out where new library is loaded
         base_addr = int(gdb.parse_and_eval('dso->base').cast(uintptr_t))
-        fn = None
-        with tempfile.NamedTemporaryFile(suffix='.so', delete=False) as f:
-            f.write(memvw)
-            fn = f.name
+        fn = cache_symbol_image(bytes(memvw))
 
-        gdb.write('Loading symbols at base 0x%x...\n' % (int(base_addr)))
-        add_symbol_file(fn, int(base_addr))
+        DSO_REGISTRY.add(fn, int(base_addr))
 
-        atexit.register(os.unlink, fn)
         return False
 
 
@@ -116,8 +232,7 @@ class LoadLibraryFromFileBreakpoint(gdb.Breakpoint):
         libpath = gdb.execute('printf "%s", libpath', to_string=True)
         base_addr = int(gdb.parse_and_eval('dso->base').cast(uintptr_t))
 
-        gdb.write('Loading symbols at base 0x%x...\n' % (int(base_addr)))
-        add_symbol_file(libpath, int(base_addr))
+        DSO_REGISTRY.add(libpath, int(base_addr))
 
         return False
 
@@ -487,55 +602,147 @@ class LogSyscallTids(gdb.Command):
         return slot_syscallnos
 
 
-stacktrace_regex = re.compile(r"\[[0-9. ]+\]\s+[0-9a-f]+:\s+\[<([0-9a-f]+)>\]")
-info_line = re.compile(r'Line (\d+) of "([^"]+)" starts at address 0x[0-9a-f]+ <([^>]+)>')
+@dataclass
+class LineInfo:
+    symbol: str
+    filename: str
+    line: int
+
+
+class LineIndex:
+    """
+        Caches symbol and source line lookups per PC, so that backtraces of
+        many tasks sharing the same kernel paths resolve each address once.
+    """
+    def __init__(self) -> None:
+        self.cache: Dict[int, LineInfo] = {}
+        gdb.events.new_objfile.connect(self._new_objfile_handler)
+
+    def _new_objfile_handler(self, event) -> None:
+        self.cache.clear()
+
+    def _lookup(self, pc: int, is_return_address: bool) -> LineInfo:
+        # return addresses point behind the call instruction
+        lookup_pc = pc - 1 if is_return_address else pc
+        symbol = "??"
+        try:
+            block = gdb.block_for_pc(lookup_pc)
+        except RuntimeError:
+            block = None
+        while block is not None and block.function is None:
+            block = block.superblock
+        if block is not None:
+            symbol = "%s+0x%x" % (block.function.name, pc - block.start)
+        sal = gdb.find_pc_line(lookup_pc)
+        if sal.symtab is None:
+            return LineInfo(symbol, "??", 0)
+        return LineInfo(symbol, sal.symtab.filename, sal.line)
+
+    def resolve(self, frames: List[int]) -> List[LineInfo]:
+        infos = []
+        for i, pc in enumerate(frames):
+            # return addresses are cached separately as they resolve to pc - 1
+            key = pc if i == 0 else -pc
+            info = self.cache.get(key)
+            if info is None:
+                info = self._lookup(pc, i != 0)
+                self.cache[key] = info
+            infos.append(info)
+        return infos
+
+
+LINE_INDEX: Optional[LineIndex] = None
+BT_LKL_MAX_DEPTH = 64
+
+
+def get_line_index() -> LineIndex:
+    global LINE_INDEX
+    if LINE_INDEX is None:
+        LINE_INDEX = LineIndex()
+    return LINE_INDEX
+
+
+def unwind_frame_pointers(ip: int, fp: int, max_depth: int = BT_LKL_MAX_DEPTH) -> List[int]:
+    """
+        Walk the saved frame pointer chain starting at fp directly in memory.
+    """
+    inferior = gdb.selected_inferior()
+    frames = [ip]
+    while fp != 0 and len(frames) < max_depth:
+        try:
+            next_fp, ret = struct.unpack("<QQ", bytes(inferior.read_memory(fp, 16)))
+        except gdb.MemoryError:
+            break
+        if ret == 0:
+            break
+        frames.append(ret)
+        # callers live at higher addresses, anything else is a corrupted chain
+        if next_fp <= fp:
+            break
+        fp = next_fp
+    return frames
+
+
+def selected_thread_frames(max_depth: int = BT_LKL_MAX_DEPTH) -> List[int]:
+    frames = []
+    frame = gdb.newest_frame()
+    while frame is not None and len(frames) < max_depth:
+        frames.append(frame.pc())
+        frame = frame.older()
+    return frames
+
+
+def task_lthread(task: gdb.Value) -> int:
+    #define task_thread_info(task)	((struct thread_info *)(task)->stack)
+    thread_info = task["stack"].cast(thread_info_type.get_type().pointer())
+    return int(thread_info["tid"])
+
+
+def task_frames(task: gdb.Value) -> List[int]:
+    """
+        Kernel backtrace of a sleeping LKL task from the context saved in the
+        lthread that backs it.
+    """
+    lt = task_lthread(task)
+    if lt == 0:
+        return []
+    ctx = gdb.Value(lt).cast(gdb.lookup_type("struct lthread").pointer())["ctx"]
+    uintptr_t = gdb.lookup_type("uintptr_t")
+    return unwind_frame_pointers(int(ctx["eip"].cast(uintptr_t)),
+                                 int(ctx["ebp"].cast(uintptr_t)))
+
+
+def write_backtrace(frames: List[int]) -> None:
+    for i, info in enumerate(get_line_index().resolve(frames)):
+        if info.filename == "??":
+            gdb.write("[%3d] %50s 0x%x\n" % (i, info.symbol, frames[i]))
+        else:
+            gdb.write("[%3d] %50s in %s:%d\n" % (i, info.symbol, info.filename, info.line))
 
 
 class BtLkl(gdb.Command):
     """
-        Recovers backtrace via lkl's dump_stack function
+        Print kernel backtraces of LKL tasks.
+        Param: PID of a task, or "all" for every task (optional).
+        Without parameter the stack of the selected thread is decoded.
     """
     def __init__(self):
         super(BtLkl, self).__init__("bt-lkl", gdb.COMMAND_USER)
 
-    def parse_stack_trace(self):
-        """
-        Screen scrape lkl's output and get the line of every entry
-        """
-        out = subprocess.check_output(["tmux", "capture-pane", "-pS", "-1000"])
-        frames = []
-        found_call_trace = False
-        for line in out.decode("utf-8").split("\n"):
-            line = line.rstrip()
-            if "Call Trace:" in line:
-                found_call_trace = True
-                frames = []
-                continue
-            if found_call_trace:
-                match = stacktrace_regex.match(line)
-                if not match:
-                    found_call_trace = False
-                    continue
-                frames.append(int(match.group(1), 16))
-        return frames
-
     def invoke(self, arg, from_tty):
-        if os.environ.get("SGXLKL_VERBOSE", None) != "1":
-            gdb.write("Environment variable SGXLKL_VERBOSE=1 is not set!\n")
-            return
-        gdb.execute('call dump_stack()')
-        frames = self.parse_stack_trace()
-        for i, frame in enumerate(frames):
-             line = gdb.execute('info line *0x%x' % frame, to_string=True)
-             match = info_line.match(line)
-             if match:
-                 symbol_offset = match.group(3)
-                 filename = match.group(2)
-                 line = match.group(1)
-                 gdb.write("[%3d] %50s in %s:%s\n" % (i, symbol_offset, filename, line))
-             else:
-                 # better safe then sorry
-                 gdb.write("[%3d] %s\n" %(i, line))
+        argv = gdb.string_to_argv(arg)
+        if not argv:
+            write_backtrace(selected_thread_frames())
+        elif argv[0] == "all":
+            for task in task_lists():
+                gdb.write("%s pid %d %s\n" % (task, int(task["pid"]), task["comm"].string()))
+                write_backtrace(task_frames(task))
+                gdb.write("\n")
+        else:
+            task = get_task_by_pid(int(argv[0]))
+            if task is None:
+                raise gdb.GdbError("No task of PID " + argv[0])
+            write_backtrace(task_frames(task))
         gdb.flush()
 
 class Hexyl(gdb.Command):
@@ -575,9 +782,11 @@ class CachedType:
     def __init__(self, name):
         self._type = None
         self._name = name
+        self._offsets = {}
 
     def _new_objfile_handler(self, event):
         self._type = None
+        self._offsets = {}
         gdb.events.new_objfile.disconnect(self._new_objfile_handler)
 
     def get_type(self):
@@ -590,6 +799,20 @@ class CachedType:
                 gdb.events.new_objfile.connect(self._new_objfile_handler)
         return self._type
 
+    def offset_of(self, field):
+        offset = self._offsets.get(field)
+        if offset is None:
+            typeobj = self.get_type()
+            for f in typeobj.fields():
+                if f.name == field:
+                    offset = f.bitpos // 8
+                    break
+            else:
+                # e.g. members of anonymous unions
+                offset = offset_of(typeobj.pointer(), field)
+            self._offsets[field] = offset
+        return offset
+
 
 task_type = CachedType("struct task_struct")
 thread_info_type = CachedType("struct thread_info")
@@ -607,13 +830,12 @@ def offset_of(typeobj, field):
     return int(str(element[field].address).split()[0], 16)
 
 
-def container_of(ptr, typeobj, member):
+def container_of(ptr, cached_type, member):
     return (ptr.cast(get_long_type()) -
-            offset_of(typeobj, member)).cast(typeobj)
+            cached_type.offset_of(member)).cast(cached_type.get_type().pointer())
 
 
 def task_lists():
-    task_ptr_type = task_type.get_type().pointer()
     init_task = gdb.parse_and_eval("init_task").address
     t = g = init_task
 
@@ -622,28 +844,74 @@ def task_lists():
             yield t
 
             t = container_of(t['thread_group']['next'],
-                             task_ptr_type, "thread_group")
+                             task_type, "thread_group")
             if t == g:
                 break
 
         t = g = container_of(g['tasks']['next'],
-                             task_ptr_type, "tasks")
+                             task_type, "tasks")
         if t == init_task:
             return
 
 
+class TaskTable:
+    """
+        Snapshot of all tasks, taken on first use and dropped whenever the
+        inferior stops or resumes since tasks may have come and gone.
+    """
+    def __init__(self) -> None:
+        self._tasks: Optional[List[gdb.Value]] = None
+        self._by_pid: Dict[int, gdb.Value] = {}
+        gdb.events.stop.connect(self.invalidate)
+        gdb.events.cont.connect(self.invalidate)
+
+    def invalidate(self, event=None) -> None:
+        self._tasks = None
+        self._by_pid = {}
+
+    def tasks(self) -> List[gdb.Value]:
+        if self._tasks is None:
+            self._tasks = list(task_lists())
+            self._by_pid = {}
+            for task in self._tasks:
+                # the thread group leader comes first
+                self._by_pid.setdefault(int(task['pid']), task)
+        return self._tasks
+
+    def by_pid(self, pid: int) -> Optional[gdb.Value]:
+        self.tasks()
+        return self._by_pid.get(pid)
+
+
+TASK_TABLE: Optional[TaskTable] = None
+
+
+def get_task_table() -> TaskTable:
+    global TASK_TABLE
+    if TASK_TABLE is None:
+        TASK_TABLE = TaskTable()
+    return TASK_TABLE
+
+
 def get_task_by_pid(pid):
-    for task in task_lists():
-        if int(task['pid']) == pid:
-            return task
+    return get_task_table().by_pid(int(pid))
+
+
+def task_field(task, thread_info, field):
+    """Read a field that depending on the kernel config lives in task_struct or thread_info"""
+    for obj in (task, thread_info):
+        try:
+            return int(obj[field])
+        except gdb.error:
+            pass
     return None
 
 
 class LxTaskByPidFunc(gdb.Function):
     """Find Linux task by PID and return the task_struct variable.
 
-$lx_task_by_pid(PID): Given PID, iterate over all tasks of the target and
-return that task_struct variable which PID matches."""
+$lx_task_by_pid(PID): Given PID, look up the task in the cached task table
+and return that task_struct variable which PID matches."""
 
     def __init__(self):
         super(LxTaskByPidFunc, self).__init__("lx_task_by_pid")
@@ -658,16 +926,31 @@ return that task_struct variable which PID matches."""
 
 
 class LxPs(gdb.Command):
-    """Dump Linux tasks."""
+    """Dump Linux tasks.
+lx-ps --csv [FILE]: write address, pid, tid, state, cpu and comm of all tasks
+as CSV (default /tmp/tasks.csv)."""
 
     def __init__(self):
         super(LxPs, self).__init__("lx-ps", gdb.COMMAND_DATA)
 
     def invoke(self, arg, from_tty):
-        for task in task_lists():
+        argv = gdb.string_to_argv(arg)
+        rows = []
+        for task in get_task_table().tasks():
             # adapted from:
             #define task_thread_info(task)	((struct thread_info *)(task)->stack)
             thread_info = task["stack"].cast(thread_info_type.get_type().pointer())
+            if argv and argv[0] == "--csv":
+                state = task_field(task, thread_info, "state")
+                if state is None:
+                    state = task_field(task, thread_info, "__state")
+                rows.append([str(task),
+                             int(task["pid"]),
+                             "0x%02x" % int(thread_info["tid"]),
+                             state,
+                             task_field(task, thread_info, "cpu"),
+                             task["comm"].string()])
+                continue
             # f"{int(t['tid'])}"
             gdb.write("{address} {pid} 0x{tid:02x} {comm}\n".format(
                 address=task,
@@ -675,9 +958,20 @@ class LxPs(gdb.Command):
                 tid=int(thread_info["tid"]),
                 comm=task["comm"].string()))
 
+        if argv and argv[0] == "--csv":
+            import csv
+            dest = argv[1] if len(argv) > 1 else "/tmp/tasks.csv"
+            print(f"write to {dest}")
+            with open(dest, "w") as f:
+                writer = csv.writer(f)
+                writer.writerow(["address", "pid", "tid", "state", "cpu", "comm"])
+                for row in rows:
+                    writer.writerow(row)
+
 
        
 if __name__ == '__main__':
+    gdb.events.stop.connect(load_symbols_on_stop)
     StarterExecBreakpoint()
     LthreadBacktrace()
     LthreadStats()
@@ -693,3 +987,5 @@ if __name__ == '__main__':
     Curpath()
     LxTaskByPidFunc()
     LxPs()
+    LoadDsoSymbols()
+    ListDsos()
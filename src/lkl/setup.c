@@ -743,6 +743,8 @@ static void lkl_mount_root_disk(struct enclave_disk_config *disk) {
     lkl_mount_procfs();
 }
 
+static void do_sysfs(void);
+
 void lkl_mount_disks(struct enclave_disk_config* _disks, size_t _num_disks, const char *cwd) {
     num_disks = _num_disks;
     if (num_disks <= 0)
@@ -801,6 +803,8 @@ void lkl_mount_disks(struct enclave_disk_config* _disks, size_t _num_disks, cons
         lkl_start_spdk(spdk_context);
     }
 
+    do_sysfs();
+
     if (cwd) {
         lkl_set_working_dir(cwd);
     }
@@ -856,11 +860,25 @@ void lkl_poststart_net(enclave_config_t* encl, int net_dev_id) {
     }
 }
 
-static void do_sysctl(enclave_config_t *encl) {
-    if (!encl->sysctl)
-        return;
+// SGXLKL_SYSCTL entries with an absolute path as key are written to that file
+// instead, once all disks are attached (e.g. /sys/block/vdb/queue/scheduler).
+static char *sysfs_config = NULL;
+
+static int write_sysfs(const char *path, const char *val) {
+    int fd = lkl_sys_open(path, LKL_O_WRONLY, 0);
+    if (fd < 0)
+        return fd;
+    size_t len = strlen(val);
+    long ret = lkl_sys_write(fd, val, len);
+    lkl_sys_close(fd);
+    if (ret < 0)
+        return ret;
+    return (size_t)ret == len ? 0 : -LKL_EIO;
+}
 
-    char *sysctl_all = strdup(encl->sysctl);
+static void parse_sysctl(const char *config, int absolute,
+                         int (*set)(const char *key, const char *val)) {
+    char *sysctl_all = strdup(config);
     char *sysctl = sysctl_all;
     while (*sysctl) {
         while (*sysctl == ' ')
@@ -882,16 +900,34 @@ static void do_sysctl(enclave_config_t *encl) {
         }
         sysctl = val_end;
 
+        if ((path[0] == '/') != absolute)
+            continue;
+
         SGXLKL_VERBOSE("Setting sysctl config: %s=%s\n", path, val);
-        if (lkl_sysctl(path, val)) {
+        if (set(path, val)) {
             sgxlkl_warn("Failed to set sysctl config %s=%s\n", path, val);
-            break;
+            continue;
         }
     }
 
     free(sysctl_all);
 }
 
+static void do_sysctl(enclave_config_t *encl) {
+    if (!encl->sysctl)
+        return;
+
+    sysfs_config = encl->sysctl;
+    parse_sysctl(encl->sysctl, 0, lkl_sysctl);
+}
+
+static void do_sysfs(void) {
+    if (!sysfs_config)
+        return;
+
+    parse_sysctl(sysfs_config, 1, write_sysfs);
+}
+
 static void init_wireguard(enclave_config_t *encl) {
     wg_device new_device = {
         .name = "wg0",
@@ -213,7 +213,7 @@ static void help(char* prog) {
     printf("\n\nSGX-LKL configuration via environment variables:\n");
     printf("## General ##\n");
     printf("SGXLKL_CMDLINE: Linux kernel command line.\n");
-    printf("SGXLKL_SYSCTL: 'sysctl' configurations. Semicolon-separated list of key value pairs in the form 'key1=value1;key2=value2;[...]'.\n");
+    printf("SGXLKL_SYSCTL: 'sysctl' configurations. Semicolon-separated list of key value pairs in the form 'key1=value1;key2=value2;[...]'. Keys starting with '/' are written to that file once disks are attached, e.g. '/sys/block/vdb/queue/scheduler=none'.\n");
     printf("SGXLKL_SIGPIPE: Set to 1 to enable delivery of SIGPIPE.\n");
     printf("SGXLKL_NON_PIE: Set to 1 when running applications not compiled as position-independent. In this case the size of the enclave is limited to the available space at the beginning of the address space.\n");
     printf("SGXLKL_VERBOSE: Set to 1 to enable verbose SGX-LKL output.\n");
@@ -1,42 +1,168 @@
 #!/usr/bin/env python3
 
+import hashlib
+import json
 import os
 import struct
 import subprocess
 import sys
 import tempfile
-from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
 
 
-def get_init_functions(lib: str) -> List[str]:
-    with tempfile.TemporaryDirectory() as tempdir:
-        subprocess.run(["ar", "x", lib], cwd=tempdir, check=True)
-        proc = subprocess.run(
-            ["readelf", "-r", "--wide"] + glob(os.path.join(tempdir, "*.o")),
-            stdout=subprocess.PIPE,
-        )
-        init_array = False
-        symbols = []
-        for line in proc.stdout.decode("utf-8").split("\n"):
-            if line.startswith("Relocation section '.rela.init_array"):
-                init_array = True
-                continue
-            elif init_array and line.startswith("Relocation section"):
-                init_array = False
-            elif init_array and "Offset" not in line and line != "":
-                # example
-                # 0             1            2                 3                4                      5 6
-                # 000000000000  017c00000001 R_X86_64_64       000000000000179e mp_hdlr_init_ops_mp_mc + 0
-                fields = line.split()
-                symbol = fields[4]
-                sym_offset = fields[6]
-                if symbol == ".text" or sym_offset != "0":
-                    raise Exception(
-                        f"initializer in {lib} found that has no symbol. Function needs to be non-static!:\n{line}"
-                    )
-                symbols.append(symbol)
+SHT_SYMTAB = 2
+SHT_RELA = 4
+STT_FUNC = 2
+STT_SECTION = 3
+STB_GLOBAL = 1
+
+
+class Elf:
+    """Minimal reader for the 64-bit little-endian ELF files we link"""
+
+    def __init__(self, data: bytes, name: str) -> None:
+        if data[:4] != b"\x7fELF" or data[4] != 2 or data[5] != 1:
+            raise Exception(f"{name}: not a 64-bit little-endian ELF file")
+        self.data = data
+        self.name = name
+        shoff, = struct.unpack_from("<Q", data, 0x28)
+        shentsize, shnum, shstrndx = struct.unpack_from("<HHH", data, 0x3A)
+        # (name, type, addr, offset, size, link, info, entsize)
+        self.sections = []
+        for i in range(shnum):
+            (sh_name, sh_type, _, sh_addr, sh_offset, sh_size, sh_link,
+             sh_info, _, sh_entsize) = struct.unpack_from(
+                 "<IIQQQQIIQQ", data, shoff + i * shentsize)
+            self.sections.append([sh_name, sh_type, sh_addr, sh_offset,
+                                  sh_size, sh_link, sh_info, sh_entsize])
+        if self.sections:
+            strtab = self.sections[shstrndx]
+            for section in self.sections:
+                section[0] = self.string(strtab, section[0])
+
+    def string(self, strtab: list, offset: int) -> str:
+        start = strtab[3] + offset
+        end = self.data.index(b"\0", start)
+        return self.data[start:end].decode("utf-8")
+
+    def content(self, section: list) -> bytes:
+        return self.data[section[3]:section[3] + section[4]]
+
+    def section(self, name: str) -> Optional[list]:
+        for section in self.sections:
+            if section[0] == name:
+                return section
+        return None
+
+    def symbols(self, symtab: list) -> Iterator[Tuple[str, int, int, int]]:
+        """Yield (name, info, shndx, value) of every symbol in symtab"""
+        strtab = self.sections[symtab[5]]
+        for off in range(symtab[3], symtab[3] + symtab[4], 24):
+            st_name, st_info, _, st_shndx, st_value, _ = struct.unpack_from(
+                "<IBBHQQ", self.data, off)
+            yield self.string(strtab, st_name), st_info, st_shndx, st_value
+
+
+def ar_members(data: bytes, lib: str) -> Iterator[Tuple[str, bytes]]:
+    if data[:8] != b"!<arch>\n":
+        raise Exception(f"{lib} is not an ar archive")
+    offset = 8
+    long_names = b""
+    while offset + 60 <= len(data):
+        header = data[offset:offset + 60]
+        name = header[:16].decode("utf-8").rstrip()
+        size = int(header[48:58].decode("utf-8"))
+        offset += 60
+        content = data[offset:offset + size]
+        offset += size + (size & 1)
+        if name == "//":
+            long_names = content
+            continue
+        if name in ["/", "/SYM64/"]:
+            continue
+        if name.startswith("/"):
+            start = int(name[1:])
+            end = long_names.index(b"/\n", start)
+            name = long_names[start:end].decode("utf-8")
+        yield name.rstrip("/"), content
+
+
+def object_init_functions(obj: Elf, lib: str) -> List[str]:
+    symbols = []
+    for rela in obj.sections:
+        if rela[1] != SHT_RELA or not rela[0].startswith(".rela.init_array"):
+            continue
+        symtab = obj.sections[rela[5]]
+        syms = list(obj.symbols(symtab))
+        content = obj.content(rela)
+        for off in range(0, len(content), 24):
+            r_offset, r_info, r_addend = struct.unpack_from("<QQq", content, off)
+            name, info, shndx, _ = syms[r_info >> 32]
+            if info & 0xF == STT_SECTION:
+                name = obj.sections[shndx][0]
+            if name == ".text" or r_addend != 0:
+                raise Exception(
+                    f"initializer in {lib} found that has no symbol. Function needs to be non-static!:\n"
+                    f"{obj.name}: {r_offset:012x} {r_info:012x} {name} + {r_addend:x}"
+                )
+            symbols.append(name)
+    return symbols
+
+
+def scan_archive(job: Tuple[str, Optional[Dict]]) -> Tuple[str, List[str]]:
+    lib, entry = job
+    with open(lib, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    # touched but unchanged archive
+    if entry and entry["sha256"] == digest:
+        return digest, entry["symbols"]
+    symbols = []
+    for name, content in ar_members(data, lib):
+        if content[:4] != b"\x7fELF":
+            continue
+        symbols += object_init_functions(Elf(content, name), lib)
+    return digest, symbols
+
+
+def get_init_functions(libs: List[str], cache_path: str) -> List[str]:
+    """
+    Scan the .rela.init_array sections of all objects of the static libraries
+    in parallel. Results are cached per archive by mtime/size and content hash.
+    """
+    cache: Dict[str, Dict] = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            try:
+                cache = json.load(f)
+            except json.JSONDecodeError:
+                cache = {}
+
+    results: Dict[str, List[str]] = {}
+    todo = []
+    for lib in libs:
+        st = os.stat(lib)
+        entry = cache.get(lib)
+        if entry and entry["mtime"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            results[lib] = entry["symbols"]
+        else:
+            todo.append(lib)
+
+    with ProcessPoolExecutor() as executor:
+        jobs = [(lib, cache.get(lib)) for lib in todo]
+        for lib, (digest, symbols) in zip(todo, executor.map(scan_archive, jobs)):
+            st = os.stat(lib)
+            cache[lib] = dict(mtime=st.st_mtime_ns, size=st.st_size, sha256=digest, symbols=symbols)
+            results[lib] = symbols
+
+    with open(cache_path, "w") as f:
+        json.dump(cache, f)
+
+    symbols: List[str] = []
+    for lib in libs:
+        symbols += results[lib]
     return symbols
 
 
@@ -66,34 +192,24 @@ void main() {}
 """
             )
         subprocess.run(cmd, cwd=tempdir, check=True)
-        main = os.path.join(tempdir, "main")
-        objdump_proc = subprocess.run(
-            [
-                "objcopy",
-                "main",
-                "/dev/null",
-                "--dump-section",
-                ".init_array=init_array",
-            ],
-            check=True,
-            cwd=tempdir,
-        )
-        addrs = []
-        with open(os.path.join(tempdir, "init_array"), "rb") as f2:
-            section = f2.read()
-            for i in range(len(section) // 8):
-                addrs.append(hex(struct.unpack("P", section[i * 8:(i + 1) * 8])[0]))
-
-        addr_str = "\n".join(addrs).encode("utf-8")
-        addr2line_proc = subprocess.run(
-            ["addr2line", "-f", "-e", main], input=addr_str, stdout=subprocess.PIPE
-        )
-        lines = addr2line_proc.stdout.split(b"\n")
-        symbols = []
-        for i, line in enumerate(lines):
-            if i % 2 == 0 and len(line) > 0:
-                symbols.append(line.decode("utf-8"))
-        return symbols
+        with open(os.path.join(tempdir, "main"), "rb") as f:
+            elf = Elf(f.read(), "main")
+
+        init_array = elf.section(".init_array")
+        symtab = elf.section(".symtab")
+        if init_array is None or symtab is None:
+            raise Exception("linked binary has no .init_array or .symtab")
+        section = elf.content(init_array)
+        addrs = [struct.unpack_from("<Q", section, i * 8)[0] for i in range(len(section) // 8)]
+
+        # resolve like `addr2line -f`: prefer global functions over local ones
+        functions: Dict[int, str] = {}
+        for name, info, _, value in elf.symbols(symtab):
+            if info & 0xF != STT_FUNC or not name:
+                continue
+            if value not in functions or info >> 4 == STB_GLOBAL:
+                functions[value] = name
+        return [functions.get(addr, "??") for addr in addrs]
 
 
 # This is literally a linker script. DPDK generates tons of initializers that
@@ -107,7 +223,7 @@ def main() -> None:
     output = sys.argv[1]
     linker_script = os.path.realpath(sys.argv[2])
     linker_flags = sys.argv[3].split()
-    symbols: List[str] = []
+    libs: List[str] = []
     lib_path = []
 
     for flag in linker_flags:
@@ -120,11 +236,14 @@ def main() -> None:
             for p in lib_path:
                 libpath = Path(p).joinpath(f"lib{libname}.a")
                 if libpath.exists():
-                    symbols += get_init_functions(str(libpath))
+                    libs.append(str(libpath.resolve()))
                     break
             else:
                 raise Exception(f"{libname} not found in libpath {lib_path}")
 
+    # only validates that all initializers are non-static, the order comes
+    # from the linked binary
+    get_init_functions(libs, f"{output}.cache.json")
     symbols = get_link_order(linker_script, linker_flags)
 
     with open(output, "w") as f:
@@ -3,7 +3,13 @@
 # This script is used to generate the fixup table mapping x86-64 syscalls
 # onto their LKL equivalents.
 #
-# The output is part of src/misc/syscall.c in sgx-musl-lkl
+# The output is part of src/misc/syscall.c in sgx-musl-lkl. Besides the remap
+# table it emits per-syscall flags (handled by LKL or the host, may block) and
+# with --coverage a JSON report that apps/nix/syscall-perf.py can consume.
+
+import argparse
+import json
+import sys
 
 LKL_UNISTD_PATH="../lkl/tools/lkl/include/lkl/asm-generic/unistd.h"
 NATIVE_TBL_PATH="../lkl/arch/x86/entry/syscalls/syscall_64.tbl"
@@ -52,23 +58,140 @@ def parse_unistd(f, prefix, syscall_tab, attr):
         setattr(syscall_tab[name], attr, num)
 
 
-syscall_tab = {}
-with open(LKL_UNISTD_PATH, 'r') as f:
-    parse_unistd(f, LKL_PREFIX, syscall_tab, 'lkl_num')
-with open(NATIVE_TBL_PATH, 'r') as f:
-    parse_table(f, syscall_tab, 'native_num')
-
-syscall_nums = [f for f in syscall_tab.values() if f.native_num is not None and f.lkl_num is not None]
-syscall_nums.sort(key=lambda f: f.native_num)
-
-print("static const short syscall_remap_len = {};".format(syscall_nums[-1].native_num))
-print("static const short syscall_remap[] = {")
-x = 0
-for n in range(syscall_nums[-1].native_num+1):
-    if syscall_nums[x].native_num != n:
-        print("\t-1, /* not implemented in x86-64 */")
-        continue
-    e = syscall_nums[x]
-    print("\t{}, /* {} - x86-64 syscall: {} */".format(e.lkl_num, e.name, e.native_num))
-    x += 1
-print("};")
+# Syscalls that sgx-lkl-musl serves itself (memory management, threading on
+# top of lthreads, time) or forwards to the host instead of LKL.
+HOST_SYSCALLS = {
+    "mmap", "munmap", "mremap", "mprotect", "madvise", "brk",
+    "clone", "futex", "exit", "exit_group", "set_tid_address", "sched_yield",
+    "nanosleep", "clock_nanosleep", "clock_gettime", "gettimeofday", "time",
+    "rt_sigaction", "rt_sigprocmask", "arch_prctl",
+}
+
+# Syscalls that can wait for I/O, timers or other threads and therefore
+# should take the asynchronous path.
+BLOCKING_SYSCALLS = {
+    "read", "write", "readv", "writev", "pread64", "pwrite64", "preadv",
+    "pwritev", "preadv2", "pwritev2", "recvfrom", "sendto", "recvmsg",
+    "sendmsg", "recvmmsg", "sendmmsg", "accept", "accept4", "connect",
+    "poll", "ppoll", "select", "pselect6", "epoll_wait", "epoll_pwait",
+    "nanosleep", "clock_nanosleep", "futex", "wait4", "waitid", "pause",
+    "rt_sigsuspend", "rt_sigtimedwait", "fsync", "fdatasync", "sync",
+    "syncfs", "sync_file_range", "flock", "msgrcv", "msgsnd", "semop",
+    "semtimedop", "io_getevents", "io_pgetevents", "sendfile", "splice",
+    "tee", "copy_file_range", "fallocate",
+}
+
+SYSCALL_LKL = 0x1
+SYSCALL_HOST = 0x2
+SYSCALL_MAY_BLOCK = 0x4
+
+
+def syscall_flags(e):
+    flags = 0
+    if e.name in HOST_SYSCALLS:
+        flags |= SYSCALL_HOST
+    elif e.lkl_num is not None:
+        flags |= SYSCALL_LKL
+    if e.name in BLOCKING_SYSCALLS:
+        flags |= SYSCALL_MAY_BLOCK
+    return flags
+
+
+def handler(flags):
+    if flags & SYSCALL_HOST:
+        return "host"
+    elif flags & SYSCALL_LKL:
+        return "lkl"
+    return "none"
+
+
+def print_tables(syscall_tab, out):
+    # index by native number, several names can share one number, prefer
+    # the one LKL implements
+    by_native = {}
+    for e in sorted(syscall_tab.values(), key=lambda e: (e.lkl_num is None, e.name)):
+        if e.native_num is None:
+            continue
+        if e.native_num in by_native:
+            print("/* duplicate x86-64 syscall {}: {} ignored in favour of {} */".format(
+                e.native_num, e.name, by_native[e.native_num].name), file=out)
+            continue
+        by_native[e.native_num] = e
+    remap_len = max(by_native.keys())
+
+    print("static const short syscall_remap_len = {};".format(remap_len), file=out)
+    print("static const short syscall_remap[] = {", file=out)
+    for n in range(remap_len + 1):
+        e = by_native.get(n)
+        if e is None:
+            print("\t-1, /* not implemented in x86-64 */", file=out)
+        elif e.lkl_num is None:
+            print("\t-1, /* {} - x86-64 syscall: {}, not implemented in lkl */".format(e.name, n), file=out)
+        else:
+            print("\t{}, /* {} - x86-64 syscall: {} */".format(e.lkl_num, e.name, e.native_num), file=out)
+    print("};", file=out)
+
+    print("", file=out)
+    print("#define SYSCALL_LKL {:#x}".format(SYSCALL_LKL), file=out)
+    print("#define SYSCALL_HOST {:#x}".format(SYSCALL_HOST), file=out)
+    print("#define SYSCALL_MAY_BLOCK {:#x}".format(SYSCALL_MAY_BLOCK), file=out)
+    print("static const unsigned char syscall_flags[] = {", file=out)
+    for n in range(remap_len + 1):
+        e = by_native.get(n)
+        if e is None:
+            print("\t0, /* not implemented in x86-64 */", file=out)
+            continue
+        flags = syscall_flags(e)
+        names = [name for bit, name in [(SYSCALL_LKL, "SYSCALL_LKL"),
+                                         (SYSCALL_HOST, "SYSCALL_HOST"),
+                                         (SYSCALL_MAY_BLOCK, "SYSCALL_MAY_BLOCK")]
+                 if flags & bit]
+        print("\t{}, /* {} */".format(" | ".join(names) or "0", e.name), file=out)
+    print("};", file=out)
+    return by_native
+
+
+def write_coverage(by_native, syscall_tab, path):
+    syscalls = []
+    for e in sorted(syscall_tab.values(), key=lambda e: (e.native_num is None, e.native_num or 0, e.name)):
+        flags = syscall_flags(e)
+        syscalls.append(dict(
+            name=e.name,
+            native=e.native_num,
+            lkl=e.lkl_num,
+            handler=handler(flags),
+            may_block=bool(flags & SYSCALL_MAY_BLOCK),
+            remapped=e.native_num is not None and by_native.get(e.native_num) is e,
+        ))
+    native = [s for s in syscalls if s["native"] is not None]
+    summary = dict(
+        native=len(native),
+        lkl=sum(1 for s in native if s["handler"] == "lkl"),
+        host=sum(1 for s in native if s["handler"] == "host"),
+        unsupported=sum(1 for s in native if s["handler"] == "none"),
+        may_block=sum(1 for s in native if s["may_block"]),
+        lkl_only=sum(1 for s in syscalls if s["native"] is None),
+    )
+    with open(path, "w") as f:
+        json.dump(dict(summary=summary, syscalls=syscalls), f, indent=2)
+    print("coverage: {}".format(summary), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the x86-64 to LKL syscall tables")
+    parser.add_argument("--coverage", help="write a JSON coverage report to this file")
+    args = parser.parse_args()
+
+    syscall_tab = {}
+    with open(LKL_UNISTD_PATH, 'r') as f:
+        parse_unistd(f, LKL_PREFIX, syscall_tab, 'lkl_num')
+    with open(NATIVE_TBL_PATH, 'r') as f:
+        parse_table(f, syscall_tab, 'native_num')
+
+    by_native = print_tables(syscall_tab, sys.stdout)
+    if args.coverage:
+        write_coverage(by_native, syscall_tab, args.coverage)
+
+
+if __name__ == "__main__":
+    main()